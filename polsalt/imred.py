@@ -17,6 +17,7 @@ and up to date.
 # polSALT: fix VAR and BPM extensions after mosaic
 
 import os, sys, glob, copy, shutil, inspect
+from multiprocessing import Pool
 
 import numpy as np
 from astropy.io import fits as pyfits
@@ -36,7 +37,7 @@ from saltcrclean import multicrclean
 from saltcombine import saltcombine
 from saltflat import saltflat
 #from saltmosaic import saltmosaic
-from saltmosaic_kn import saltmosaic
+from saltmosaic_kn import saltmosaic, saltmosaic_struct
 from saltillum import saltillum
 debug = True
 
@@ -44,7 +45,8 @@ import reddir
 from specpolutils import datedline
 datadir = os.path.dirname(inspect.getfile(reddir))+"/data/"
 
-def imred(infilelist, prodir, bpmfile=None, crthresh='', gaindb = None, cleanup=True):
+def imred(infilelist, prodir, bpmfile=None, crthresh='', gaindb = None, cleanup=True, nworkers=1,
+    inmemory=False, geotran=True):
     #get the name of the files
     infiles=','.join(['%s' % x for x in infilelist])
     
@@ -66,123 +68,35 @@ def imred(infilelist, prodir, bpmfile=None, crthresh='', gaindb = None, cleanup=
     #create the observation log
 #    obs_dict=obslog(infilelist)
 
-    verbose=True
-
     with logging(logfile, debug) as log:
         log.message('Pysalt Version: '+pysalt.verno, with_header=False)
  
     #prepare the data
-
-        for img in infilelist:
-            hdu = pyfits.open(img)
-
-            # for backwards compatibility
-            hdu = remove_duplicate_keys(hdu)  
-            if not 'XTALK' in hdu[1].header:
-                hdu[1].header['XTALK']=1474
-                hdu[2].header['XTALK']=1474
-                hdu[3].header['XTALK']=1166
-                hdu[4].header['XTALK']=1111
-                hdu[5].header['XTALK']=1377
-                hdu[6].header['XTALK']=1377
-
-            img = os.path.basename(img)
-                                                                    
-            hdu = prepare(hdu, createvar=False, badpixelstruct=None)
-            if not cleanup: hdu.writeto('p'+img, overwrite=True)
-
-            hdu = bias(hdu,subover=True, trim=True, subbias=False,
-                       bstruct=None, median=False, function='polynomial',
-                       order=5, rej_lo=5.0, rej_hi=5.0, niter=10,
-                       plotover=False, log=log, verbose=verbose)    
-            if not cleanup: hdu.writeto('bp'+img, overwrite=True)
-
-            # put windowed data into full image
-            exts = len(hdu)
-            if exts > 7:
-                rows, cols = hdu[1].data.shape
-                cbin, rbin = [int(x) for x in hdu[0].header['CCDSUM'].split(" ")]
-                ampsecO = hdu[1].header["AMPSEC"].strip("[]").split(",")
-                ampsecE = hdu[7].header["AMPSEC"].strip("[]").split(",")
-                rO = int((float(ampsecO[1].split(":")[0]) - 1.)/rbin)
-                rE = int((float(ampsecE[1].split(":")[0]) - 1.)/rbin)
-                keylist = ['BIASSEC','DATASEC','AMPSEC','CCDSEC','DETSEC']
-                oldlist = [hdu[1].header[key].strip("[]").split(",")[1] for key in keylist]
-                newlist = 2*['1:'+str(int(0.5+4102/rbin))]+3*[str(int(rbin/2))+':4102']
-
-                for amp in range(6):
-                    hduO = hdu[amp+1].copy()                    
-                    hdu[amp+1].data = np.zeros((4102/rbin,cols))
-                    hdu[amp+1].data[rO:rO+rows] = hduO.data
-                    hdu[amp+1].data[rE:rE+rows] = hdu[amp+7].data
-                    hdu[amp+1].update_header
-                    for k,key in enumerate(keylist): 
-                        hdu[amp+1].header[key] = \
-                            hdu[amp+1].header[key].replace(oldlist[k],newlist[k])
-                del hdu[7:]
-                hdu[0].header['NSCIEXT'] = 6
-     
-            badpixelstruct = saltio.openfits(bpmfile)
-            hdu = add_variance(hdu, badpixelstruct)
-             
-            #gain correct the data 
-            if gaindb: 
-                usedb = True
-                dblist = saltio.readgaindb(gaindb.strip())
-            else:
-                usedb = False
-                dblist = ''
-            hdu = gain(hdu, mult=True, usedb=usedb, dblist=dblist, log=log, verbose=verbose)
-            if not cleanup: hdu.writeto('gbp'+img, overwrite=True)
-
-            #cross talk correct the data
-            hdu=xtalk(hdu, [], log=log, verbose=verbose)
-
-            #cosmic ray clean the data
-            #only clean the object data            
-            if crthresh=='':
-                thresh = 5.0
-                if hdu[0].header['GRATING'].strip()=='PG0300': thresh = 7.0
-            else: thresh=crthresh
-
-            if hdu[0].header['CCDTYPE']=='OBJECT' and \
-                hdu[0].header['LAMPID']=='NONE' and \
-                hdu[0].header['INSTRUME']=='RSS':
-                if crthresh != False:
-                    log.message('Cleaning CR using thresh={}'.format(thresh))
-                    hdu = multicrclean(hdu, crtype='edge', thresh=thresh, mbox=11, bthresh=5.0,
-                        flux_ratio=0.2, bbox=25, gain=1.0, rdnoise=5.0, fthresh=5.0, bfactor=2,
-                        gbox=3, maxiter=5, log=log, verbose=verbose)
-                    for ext in range(13,19): hdu[ext].data = hdu[ext].data.astype('uint8')
-                    hdu[0].header.add_history('CRCLEAN: multicrclean, thresh = ',thresh)
-                else:
-                    hdu[0].header.add_history('CRCLEAN: None')
-            hdu.writeto('xgbp'+img, overwrite=True)
-            hdu.close()
+    #images are independent until the mosaic, so optionally farm them out to nworkers processes
+    #inmemory: mosaic each image straight from CR cleaning, without the xgbp file round trip
+    #geotran=False: mosaic with the numpy transform in saltmosaic_kn instead of IRAF geotran
+        imgkwargs = dict(bpmfile=bpmfile, crthresh=crthresh, gaindb=gaindb, cleanup=cleanup)
+        if inmemory: imgkwargs.update(geomfile=geomfile, geotran=geotran)
+        if nworkers > 1:
+            imred_pool(infilelist, logfile, nworkers, log=log, **imgkwargs)
+        else:
+            for img in infilelist:
+                imred_image(img, log=log, **imgkwargs)
         
+    if inmemory: return
+
     #mosaic the data
     #khn: attempt to use most recent previous geometry to obsdate.  
 
     #geomfile=iraf.osfn("pysalt$data/rss/RSSgeom.dat")
     
     try:
-       saltmosaic('xgbpP*fits', '', 'm', geomfile, interp='linear', cleanup=True, geotran=True, clobber=True, logfile=logfile, verbose=True)
+       saltmosaic('xgbpP*fits', '', 'm', geomfile, interp='linear', cleanup=True, geotran=geotran, clobber=True, logfile=logfile, verbose=True)
     except:
-       saltmosaic('xgbpP*fits', '', 'm', geomfile, interp='linear', cleanup=True, geotran=True, clobber=True, logfile=logfile, verbose=True)
-    #khn: fix mosaiced VAR and BPM extensions
-    #khn: fix mosaiced bpm missing some of gap
+       saltmosaic('xgbpP*fits', '', 'm', geomfile, interp='linear', cleanup=True, geotran=geotran, clobber=True, logfile=logfile, verbose=True)
     for img in infilelist:
         filename = 'mxgbp'+os.path.basename(img)
-        hdu = pyfits.open(filename, 'update')
-        hdu[2].header['EXTNAME'] = 'VAR'
-        hdu[3].header['EXTNAME'] = 'BPM'
-        bpm_rc = (hdu[3].data>0).astype('uint8')
-        zeroscicol = hdu['SCI'].data.sum(axis=0) == 0
-        bpmgapcol = bpm_rc.mean(axis=0) == 1
-        addbpmcol = zeroscicol & ~bpmgapcol
-        addbpmcol[np.argmax(addbpmcol)-4:np.argmax(addbpmcol)] = True    # allow for chip tilt
-        bpm_rc[:,addbpmcol] = 1
-        hdu[3].data = bpm_rc
+        hdu = fix_mosaic(pyfits.open(filename, 'update'))
         hdu.writeto(filename,overwrite=True)
 
     #clean up the images
@@ -192,6 +106,155 @@ def imred(infilelist, prodir, bpmfile=None, crthresh='', gaindb = None, cleanup=
            for f in glob.glob('gbp*fits'): os.remove(f)
            for f in glob.glob('xgbp*fits'): os.remove(f)
 
+def fix_mosaic(hdu):
+    #khn: fix mosaiced VAR and BPM extensions
+    #khn: fix mosaiced bpm missing some of gap
+    hdu[2].header['EXTNAME'] = 'VAR'
+    hdu[3].header['EXTNAME'] = 'BPM'
+    bpm_rc = (hdu[3].data>0).astype('uint8')
+    zeroscicol = hdu['SCI'].data.sum(axis=0) == 0
+    bpmgapcol = bpm_rc.mean(axis=0) == 1
+    addbpmcol = zeroscicol & ~bpmgapcol
+    addbpmcol[np.argmax(addbpmcol)-4:np.argmax(addbpmcol)] = True    # allow for chip tilt
+    bpm_rc[:,addbpmcol] = 1
+    hdu[3].data = bpm_rc
+    return hdu
+
+def imred_image(img, bpmfile=None, crthresh='', gaindb=None, cleanup=True, geomfile=None, geotran=True,
+    log=None, verbose=True):
+    """Basic reductions of one raw image, through CR cleaning.  Output is 'xgbp'+basename(img)
+    If geomfile is given, the mosaic is done here in memory and the output is 'mxgbp'+basename(img),
+    with xgbp written only if cleanup is False
+    """
+
+    hdu = pyfits.open(img)
+
+    # for backwards compatibility
+    hdu = remove_duplicate_keys(hdu)  
+    if not 'XTALK' in hdu[1].header:
+        hdu[1].header['XTALK']=1474
+        hdu[2].header['XTALK']=1474
+        hdu[3].header['XTALK']=1166
+        hdu[4].header['XTALK']=1111
+        hdu[5].header['XTALK']=1377
+        hdu[6].header['XTALK']=1377
+
+    img = os.path.basename(img)
+                                                            
+    hdu = prepare(hdu, createvar=False, badpixelstruct=None)
+    if not cleanup: hdu.writeto('p'+img, overwrite=True)
+
+    hdu = bias(hdu,subover=True, trim=True, subbias=False,
+               bstruct=None, median=False, function='polynomial',
+               order=5, rej_lo=5.0, rej_hi=5.0, niter=10,
+               plotover=False, log=log, verbose=verbose)    
+    if not cleanup: hdu.writeto('bp'+img, overwrite=True)
+
+    # put windowed data into full image
+    exts = len(hdu)
+    if exts > 7:
+        rows, cols = hdu[1].data.shape
+        cbin, rbin = [int(x) for x in hdu[0].header['CCDSUM'].split(" ")]
+        ampsecO = hdu[1].header["AMPSEC"].strip("[]").split(",")
+        ampsecE = hdu[7].header["AMPSEC"].strip("[]").split(",")
+        rO = int((float(ampsecO[1].split(":")[0]) - 1.)/rbin)
+        rE = int((float(ampsecE[1].split(":")[0]) - 1.)/rbin)
+        keylist = ['BIASSEC','DATASEC','AMPSEC','CCDSEC','DETSEC']
+        oldlist = [hdu[1].header[key].strip("[]").split(",")[1] for key in keylist]
+        newlist = 2*['1:'+str(int(0.5+4102/rbin))]+3*[str(int(rbin/2))+':4102']
+
+        for amp in range(6):
+            hduO = hdu[amp+1].copy()                    
+            hdu[amp+1].data = np.zeros((4102/rbin,cols))
+            hdu[amp+1].data[rO:rO+rows] = hduO.data
+            hdu[amp+1].data[rE:rE+rows] = hdu[amp+7].data
+            hdu[amp+1].update_header
+            for k,key in enumerate(keylist): 
+                hdu[amp+1].header[key] = \
+                    hdu[amp+1].header[key].replace(oldlist[k],newlist[k])
+        del hdu[7:]
+        hdu[0].header['NSCIEXT'] = 6
+
+    badpixelstruct = saltio.openfits(bpmfile)
+    hdu = add_variance(hdu, badpixelstruct)
+     
+    #gain correct the data 
+    if gaindb: 
+        usedb = True
+        dblist = saltio.readgaindb(gaindb.strip())
+    else:
+        usedb = False
+        dblist = ''
+    hdu = gain(hdu, mult=True, usedb=usedb, dblist=dblist, log=log, verbose=verbose)
+    if not cleanup: hdu.writeto('gbp'+img, overwrite=True)
+
+    #cross talk correct the data
+    hdu=xtalk(hdu, [], log=log, verbose=verbose)
+
+    #cosmic ray clean the data
+    #only clean the object data            
+    if crthresh=='':
+        thresh = 5.0
+        if hdu[0].header['GRATING'].strip()=='PG0300': thresh = 7.0
+    else: thresh=crthresh
+
+    if hdu[0].header['CCDTYPE']=='OBJECT' and \
+        hdu[0].header['LAMPID']=='NONE' and \
+        hdu[0].header['INSTRUME']=='RSS':
+        if crthresh != False:
+            log.message('Cleaning CR using thresh={}'.format(thresh))
+            hdu = multicrclean(hdu, crtype='edge', thresh=thresh, mbox=11, bthresh=5.0,
+                flux_ratio=0.2, bbox=25, gain=1.0, rdnoise=5.0, fthresh=5.0, bfactor=2,
+                gbox=3, maxiter=5, log=log, verbose=verbose)
+            for ext in range(13,19): hdu[ext].data = hdu[ext].data.astype('uint8')
+            hdu[0].header.add_history('CRCLEAN: multicrclean, thresh = ',thresh)
+        else:
+            hdu[0].header.add_history('CRCLEAN: None')
+    if (geomfile is None) | (not cleanup): hdu.writeto('xgbp'+img, overwrite=True)
+    if geomfile is None:
+        hdu.close()
+        return 'xgbp'+img
+
+    #mosaic the data in memory
+    try:
+        mhdu = saltmosaic_struct(hdu, geomfile, interp='linear', geotran=geotran, cleanup=True, log=log, verbose=verbose)
+    except:
+        mhdu = saltmosaic_struct(hdu, geomfile, interp='linear', geotran=geotran, cleanup=True, log=log, verbose=verbose)
+    mhdu = fix_mosaic(mhdu)
+    mhdu.writeto('mxgbp'+img, overwrite=True, output_verify='ignore')
+    hdu.close()
+
+    return 'mxgbp'+img
+
+def imred_pool(infilelist, logfile, nworkers, log=None, **kwargs):
+    """Run imred_image on infilelist in a pool of nworkers processes
+
+    Each image logs to its own im<obsdate>_<image>.log, and these are appended to
+    logfile in infilelist order once the pool is done, so the log reads as if run serially.
+    """
+    imglogfilelist = [logfile.rsplit('.',1)[0]+'_'+os.path.basename(img).split('.')[0]+'.log' \
+        for img in infilelist]
+    pool = Pool(min(nworkers,len(infilelist)))
+    try:
+        outfilelist = pool.map(imred_worker, \
+            [(img,imglogfile,kwargs) for img,imglogfile in zip(infilelist,imglogfilelist)], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    for imglogfile in imglogfilelist:
+        if not os.path.isfile(imglogfile): continue
+        if log: log.message(open(imglogfile).read(), with_header=False, with_stdout=False)
+        os.remove(imglogfile)
+    return outfilelist
+
+def imred_worker(args):
+    # process pool entry: single picklable argument, private log for each image
+    img, imglogfile, kwargs = args
+    if os.path.isfile(imglogfile): os.remove(imglogfile)
+    with logging(imglogfile, debug) as log:
+        outfile = imred_image(img, log=log, **kwargs)
+    return outfile
+
 def remove_duplicate_keys(hdu):
     # in case of duplicate primary header keys, remove those with blank values
     keylist = hdu[0].header.keys()
@@ -271,4 +334,5 @@ if __name__=='__main__':
     rawdir=sys.argv[1]
     prodir=os.path.curdir+'/'
     bpmfile = os.path.dirname(sys.argv[0]) + '/bpm_sn.fits'
-    imred(rawdir, prodir, cleanup=True, bpmfile=bpmfile)
+    nworkers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    imred(rawdir, prodir, cleanup=True, bpmfile=bpmfile, nworkers=nworkers)
@@ -9,10 +9,10 @@ General purpose smoothing which properly uses pixel mask
 import os, sys, glob, shutil, inspect
 
 import numpy as np
-import pyfits
-from scipy.interpolate import griddata
+from astropy.io import fits as pyfits
+from scipy.interpolate import RectBivariateSpline, interp1d
 
-np.set_printoptions(threshold=np.nan)
+np.set_printoptions(threshold=sys.maxsize)
 
 # ---------------------------------------------------------------------------------
 def boxsmooth1d(ar_x,ok_x,xbox,blklim):
@@ -20,42 +20,111 @@ def boxsmooth1d(ar_x,ok_x,xbox,blklim):
 # ar_x: float nparray;  ok_x = bool nparray
 # xbox: int;   blklim: float
 
-    arr_x = ar_x*ok_x
-    bins = ar_x.shape[0]
-    kernal = np.ones(xbox)
-    if xbox/2. == 0:
-        kernal[0] = 0.5
-        kernal = np.append(kernal,0.5)
-    nkers = kernal.shape[0]
-    valmask_x = np.convolve(arr_x,kernal)[(nkers-1)/2:(nkers-1)/2+bins]
-    count_x = np.convolve(ok_x,kernal)[(nkers-1)/2:(nkers-1)/2+bins]
-    arr_x = np.zeros(bins)
-    okbin_x = count_x > xbox*blklim
-    arr_x[okbin_x] = valmask_x[okbin_x]/count_x[okbin_x]
-        
-    return arr_x
+    return boxsmooth(ar_x,ok_x,xbox,blklim)
+
+# ---------------------------------------------------------------------------------
+def boxsmooth(ar_nx,ok_nx,xbox,blklim,mode="mean",axis=-1):
+# sliding boxcar mean or median along axis of any number of series (using okmask, 
+#   with ok points in > blklim fraction of the box), zero elsewhere
+# box is xbox/2 either side (xbox odd), or xbox/2 before and xbox/2-1 after (xbox even), truncated at ends
+# mean from cumulative sums; median from a strided window view, done in chunks of series
+
+    ar_xn = np.moveaxis(np.asarray(ar_nx,dtype=float),axis,0)
+    ok_xn = np.moveaxis(np.asarray(ok_nx,dtype=bool),axis,0)
+    bins = ar_xn.shape[0]
+    kers = int(xbox)
+    lo_x = (np.arange(bins) - kers/2).clip(0,bins)
+    hi_x = (np.arange(bins) - kers/2 + kers).clip(0,bins)
+
+    count_xn = np.cumsum(np.insert(ok_xn.astype(int),0,0,axis=0),axis=0)
+    count_xn = count_xn[hi_x] - count_xn[lo_x]
+    okbin_xn = count_xn > xbox*blklim
+    arr_xn = np.zeros(ar_xn.shape)
+
+    if mode == "mean":
+        sum_xn = np.cumsum(np.insert(np.where(ok_xn,ar_xn,0.),0,0.,axis=0),axis=0)
+        arr_xn[okbin_xn] = (sum_xn[hi_x] - sum_xn[lo_x])[okbin_xn]/count_xn[okbin_xn]
+    elif mode == "median":
+        ar_Nx = np.where(ok_xn,ar_xn,np.nan).reshape((bins,-1)).T
+        okbin_Nx = okbin_xn.reshape((bins,-1)).T
+        arr_Nx = np.zeros(ar_Nx.shape)
+        chunk = max(1,2**22/(bins*kers))
+        for N0 in range(0,ar_Nx.shape[0],chunk):
+            arpad_Nx = np.pad(ar_Nx[N0:N0+chunk],((0,0),(kers/2,kers-kers/2)),   \
+                'constant',constant_values=np.nan)
+            Ns = arpad_Nx.shape[0]
+            win_Nxk = np.lib.stride_tricks.as_strided(arpad_Nx,shape=(Ns,bins,kers),  \
+                strides=arpad_Nx.strides+arpad_Nx.strides[-1:])
+            ok_Nx = okbin_Nx[N0:N0+chunk]
+            arr_Nx[N0:N0+chunk][ok_Nx] = np.nanmedian(win_Nxk[ok_Nx],axis=-1)
+        arr_xn = arr_Nx.T.reshape(ar_xn.shape)
+    else:
+        print "Illegal mode "+mode+" for smoothing"
+        exit()
+
+    return np.moveaxis(arr_xn,0,axis)
+
+# ---------------------------------------------------------------------------------
+def blksmooth(ar_nx,ok_nx,blk,blklim=0.5,axis=-1):
+# blkaverage along axis of any number of series (using mask, with blks with > blklim fraction of the pts),
+#   then cubic interpolate each series through its ok blocks, zero beyond the outer ok block centers
+# returns smoothed array and its okmask
+
+    ar_xn = np.moveaxis(np.asarray(ar_nx,dtype=float),axis,0)
+    ok_xn = np.moveaxis(np.asarray(ok_nx,dtype=bool),axis,0)
+    bins = ar_xn.shape[0]
+    blks = bins/blk
+    offset = (bins - blks*blk)/2
+    ar_Nbx = np.where(ok_xn,ar_xn,0.)[offset:offset+blks*blk].reshape((blks,blk,-1)).transpose((2,0,1))
+    ok_Nbx = ok_xn[offset:offset+blks*blk].reshape((blks,blk,-1)).transpose((2,0,1))
+
+    count_Nb = ok_Nbx.sum(axis=-1)
+    okcount_Nb = count_Nb > blk*blklim
+    ar_Nb = np.zeros(count_Nb.shape)
+    ar_Nb[okcount_Nb] = ar_Nbx.sum(axis=-1)[okcount_Nb]/count_Nb[okcount_Nb]
+    gridblk = np.arange(offset+blk/2,offset+blks*blk+blk/2,blk)
+    grid = np.arange(bins)
+    arsm_Nx = np.zeros((ar_Nb.shape[0],bins))
+    for N in np.where(okcount_Nb.sum(axis=1) > 3)[0]:
+        arsm_Nx[N] = interp1d(gridblk[okcount_Nb[N]], ar_Nb[N,okcount_Nb[N]], kind="cubic",   \
+            bounds_error=False, fill_value=0.)(grid)
+    arsm_xn = np.moveaxis(arsm_Nx.T.reshape(ar_xn.shape),0,axis)
+
+    return arsm_xn,(arsm_xn != 0.)
 
 # ---------------------------------------------------------------------------------
-def blksmooth2d(ar_rc,ok_rc,rblk,cblk,blklim,mode="mean",debug=False):
+def blksmooth2d(ar_rc,ok_rc,rblk,cblk,blklim,mode="mean",debug=False,datacenter=False):
 # blkaverage (using mask, with blks with > blklim fraction of the pts), then spline interpolate result
 # optional: median instead of mean
+# datacenter=True: square blocks centered on the ok data, slopes only between nonzero blocks, 
+#   result zero outside ok data extent (formerly rssmaptools.blksmooth2d)
 
     rows,cols = ar_rc.shape
     arr_rc = np.zeros_like(ar_rc)
     arr_rc[ok_rc] = ar_rc[ok_rc]
     r_rc,c_rc = np.indices((rows,cols)).astype(float)
-    rblks,cblks = int(rows/rblk),int(cols/cblk)
 
-# equalize block scaling to avoid triangularization failure    
-    rfac,cfac = max(rblk,cblk)/rblk, max(rblk,cblk)/cblk     
-    r0,c0 = (rows % rblk)/2,(cols % cblk)/2
+    if datacenter:
+        rblk,cblk = max(rblk,cblk), max(rblk,cblk)
+        rok_i,cok_i = np.where(ok_rc)
+        rcenter = (rok_i.max() + rok_i.min())/2
+        ccenter = (cok_i.max() + cok_i.min())/2
+        drdat = rok_i.max() - rok_i.min()
+        dcdat = cok_i.max() - cok_i.min()
+        rblks,cblks = int(np.ceil(float(drdat)/rblk)),int(np.ceil(float(dcdat)/cblk))
+        r0 = min(max(0,rcenter-rblk*rblks/2),rows-rblk*rblks)
+        c0 = min(max(0,ccenter-cblk*cblks/2),cols-cblk*cblks)
+    else:
+        rblks,cblks = int(rows/rblk),int(cols/cblk)
+        r0,c0 = (rows % rblk)/2,(cols % cblk)/2
+
     arr_RCb = arr_rc[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)]    \
         .reshape(rblks,rblk,cblks,cblk).transpose(0,2,1,3).reshape(rblks,cblks,rblk*cblk)
     ok_RCb = ok_rc[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)]    \
         .reshape(rblks,rblk,cblks,cblk).transpose(0,2,1,3).reshape(rblks,cblks,rblk*cblk)
-    r_RCb = rfac*((ok_rc*r_rc)[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)])    \
+    r_RCb = ((ok_rc*r_rc)[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)])    \
         .reshape(rblks,rblk,cblks,cblk).transpose(0,2,1,3).reshape(rblks,cblks,rblk*cblk)
-    c_RCb = cfac*((ok_rc*c_rc)[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)])    \
+    c_RCb = ((ok_rc*c_rc)[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)])    \
         .reshape(rblks,rblk,cblks,cblk).transpose(0,2,1,3).reshape(rblks,cblks,rblk*cblk)    
     ok_RC = ok_RCb.sum(axis=-1) > rblk*cblk*blklim
     arr_RC = np.zeros((rblks,cblks))
@@ -77,12 +146,15 @@ def blksmooth2d(ar_rc,ok_rc,rblk,cblk,blklim,mode="mean",debug=False):
 # evaluate slopes at edge for edge extrapolation   
     dar_RC = arr_RC[1:,:] - arr_RC[:-1,:]
     dac_RC = arr_RC[:,1:] - arr_RC[:,:-1]
+    if datacenter:
+        dar_RC *= ((arr_RC[1:,:]!=0.) & (arr_RC[:-1,:]!=0.))
+        dac_RC *= ((arr_RC[:,1:]!=0.) & (arr_RC[:,:-1]!=0.))
     dr_RC = r_RC[1:,:] - r_RC[:-1,:]
     dc_RC = c_RC[:,1:] - c_RC[:,:-1]
 
     dadr_RC = np.zeros_like(dar_RC);    dadc_RC = np.zeros_like(dac_RC)
-    dadr_RC[dr_RC!=0] = rfac*dar_RC[dr_RC!=0]/dr_RC[dr_RC!=0]
-    dadc_RC[dc_RC!=0] = cfac*dac_RC[dc_RC!=0]/dc_RC[dc_RC!=0]
+    dadr_RC[dr_RC!=0] = dar_RC[dr_RC!=0]/dr_RC[dr_RC!=0]
+    dadc_RC[dc_RC!=0] = dac_RC[dc_RC!=0]/dc_RC[dc_RC!=0]
     argR = np.where(ok_RC.sum(axis=1)>0)[0]
     argC = np.where(ok_RC.sum(axis=0)>0)[0]    
     dadr_RC[argR[0],argC]    *= (arr_RC[argR[0,],argC] > 0)
@@ -96,16 +168,14 @@ def blksmooth2d(ar_rc,ok_rc,rblk,cblk,blklim,mode="mean",debug=False):
         np.savetxt('r_RC_0.txt',r_RC,fmt="%9.2f")
         np.savetxt('c_RC_0.txt',c_RC,fmt="%9.2f")
         
-# force outer block positions into a rectangle to avoid edge effects, spline interpolate
+# spline interpolate on the regular block grid, out to the rectangle of outer ok blocks
 
-    r_RC[argR[[0,-1]][:,None],argC] = rfac*(r0+(rblk-1)/2.+rblk*argR[[0,-1]])[:,None]
-    c_RC[argR[:,None],argC[[0,-1]]] = cfac*(c0+(cblk-1)/2.+cblk*argC[[0,-1]])
-        
-    arr_rc = griddata((r_RC[ok_RC],c_RC[ok_RC]),arr_RC[ok_RC],  \
-        tuple(np.mgrid[:rfac*rows:rfac,:cfac*cols:cfac].astype(float)),method='cubic',fill_value=0.)
+    r_R = r0+(rblk-1)/2.+rblk*np.arange(rblks)
+    c_C = c0+(cblk-1)/2.+cblk*np.arange(cblks)
+    arr_rc = blkspline2d(arr_RC,ok_RC,r_R,c_C,rows,cols)
 
     if debug:
-        pyfits.PrimaryHDU(arr_rc.astype('float32')).writeto('arr_rc_0.fits',clobber=True)
+        pyfits.PrimaryHDU(arr_rc.astype('float32')).writeto('arr_rc_0.fits',overwrite=True)
 
 # extrapolate to original array size
     argR_r = ((np.arange(rows) - r0)/rblk).clip(0,rblks-1).astype(int)
@@ -121,9 +191,47 @@ def blksmooth2d(ar_rc,ok_rc,rblk,cblk,blklim,mode="mean",debug=False):
                     dadc_RC[argR_r[r0-rblk/2:r1+rblk/2],argC[0]][:,None]*np.arange(-int(cblk/2),0)
     arr_rc[r0-rblk/2:r1+rblk/2,c1+1:c1+cblk/2] += arr_rc[r0-rblk/2:r1+rblk/2,c1][:,None] + \
                     dadc_RC[argR_r[r0-rblk/2:r1+rblk/2],argC[-1]-1][:,None]*np.arange(1,cblk/2)
-    
+
+    if datacenter:
+        arr_rc[((np.abs(r_rc-rcenter) > drdat/2) | (np.abs(c_rc-ccenter) > dcdat/2))] = 0.    
     if debug:
-        pyfits.PrimaryHDU(arr_rc.astype('float32')).writeto('arr_rc_1.fits',clobber=True)
+        pyfits.PrimaryHDU(arr_rc.astype('float32')).writeto('arr_rc_1.fits',overwrite=True)
     
     return arr_rc
 
+# ---------------------------------------------------------------------------------
+def blkspline2d(arr_RC,ok_RC,r_R,c_C,rows,cols):
+# bicubic spline through ok blocks of a regular block grid (centers r_R,c_C), evaluated on rows x cols pixels
+# masked blocks inside the outer ok blocks are first filled by linear interpolation along block rows, then columns
+# zero outside the rectangle of outer ok block centers
+
+    argR = np.where(ok_RC.any(axis=1))[0]
+    argC = np.where(ok_RC.any(axis=0))[0]
+    Rlist,Clist = range(argR[0],argR[-1]+1),range(argC[0],argC[-1]+1)
+    a_RC = arr_RC[argR[0]:argR[-1]+1,argC[0]:argC[-1]+1].astype(float)
+    ok_RC = ok_RC[argR[0]:argR[-1]+1,argC[0]:argC[-1]+1]
+    r_R = r_R[Rlist].astype(float); c_C = c_C[Clist].astype(float)
+
+    okrow_R = ok_RC.any(axis=1)
+    for R in np.where(okrow_R & ~ok_RC.all(axis=1))[0]:
+        a_RC[R] = np.interp(c_C,c_C[ok_RC[R]],a_RC[R,ok_RC[R]])
+    if (~okrow_R).any():
+        for C in range(len(c_C)):
+            a_RC[:,C] = np.interp(r_R,r_R[okrow_R],a_RC[okrow_R,C])
+
+    r_r = np.arange(np.ceil(r_R[0]),np.floor(r_R[-1])+1).astype(int)
+    c_c = np.arange(np.ceil(c_C[0]),np.floor(c_C[-1])+1).astype(int)
+
+# single block row or column: constant across it
+    if len(r_R) == 1:
+        r_R = r_R + np.array([-.5,.5]);   a_RC = np.repeat(a_RC,2,axis=0)
+    if len(c_C) == 1:
+        c_C = c_C + np.array([-.5,.5]);   a_RC = np.repeat(a_RC,2,axis=1)
+
+    arr_rc = np.zeros((rows,cols))
+    if (r_r.shape[0] > 0) & (c_c.shape[0] > 0):
+        arr_rc[r_r[0]:r_r[-1]+1,c_c[0]:c_c[-1]+1] =     \
+            RectBivariateSpline(r_R,c_C,a_RC,kx=min(3,len(r_R)-1),ky=min(3,len(c_C)-1))(r_r,c_c)
+
+    return arr_rc
+
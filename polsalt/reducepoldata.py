@@ -14,46 +14,53 @@ from specpolwavmap import specpolwavmap
 from specpolextract import specpolextract
 from specpolrawstokes import specpolrawstokes
 from specpolfinalstokes import specpolfinalstokes
+from reducestages import runstage, imagegroups, configgroups, rawstokesgroups
 
+# python reducepoldata.py obsdate [stage ...]
+#   each stage is redone only for groups whose inputs or parameters changed since the last run,
+#   as recorded in sci/reducepoldata.json.  Stages listed after obsdate are redone in full.
 obsdate = sys.argv[1]
+forcelist = sys.argv[2:]
 
 os.chdir(obsdate)
 if not os.path.isdir('sci'): os.mkdir('sci')
 os.chdir('sci')
+manifestfile = 'reducepoldata.json'
 
-#basic image reductions
-infile_list = glob.glob('../raw/P*fits')
-
-#imred(infile_list, './', datadir+'bpm_rss_11.fits', cleanup=False)
-imred(infile_list, './', datadir+'bpm_rss_11.fits', cleanup=True)
-
-#basic polarimetric reductions
 # debug=True
 
 debug=False
 logfile='specpol'+obsdate+'.log'
 
+#basic image reductions, by image
+infile_list = sorted(glob.glob('../raw/P*fits'))
+
+#params = dict(prodir='./', bpmfile=datadir+'bpm_rss_11.fits', cleanup=False)
+params = dict(prodir='./', bpmfile=datadir+'bpm_rss_11.fits', cleanup=True)
+infile_list = runstage(manifestfile, 'imred', imred, imagegroups(infile_list), params=params,    \
+    outnames=lambda flist: ['mxgbp'+os.path.basename(f) for f in flist], force=('imred' in forcelist), logfile=logfile)
+
+#basic polarimetric reductions, by configuration
 #target and wavelength map
-infile_list = sorted(glob.glob('m*fits'))
-linelistlib=""
-specpolwavmap(infile_list, linelistlib=linelistlib, inter=True, logfile=logfile)
+params = dict(linelistlib="")
+infile_list = runstage(manifestfile, 'wavmap', specpolwavmap, configgroups(infile_list, logfile), params=params,  \
+    outnames=lambda flist: ['w'+f for f in flist], runargs=dict(logfile=logfile),   \
+    force=('wavmap' in forcelist), logfile=logfile)
 
 #background subtraction and extraction
-#infile_list = sorted(glob.glob('wm*099.fits')+glob.glob('wm*10[0-6].fits'))    # optional subselection
-
-infile_list = sorted(glob.glob('wm*fits'))
-specpolextract(infile_list, logfile=logfile, debug=debug)
+#infile_list = [f for f in infile_list if (f[-8:-5] >= '099') & (f[-8:-5] <= '106')]    # optional subselection
 
-#raw stokes
-#infile_list = sorted(glob.glob('e*06[8-9].fits')+glob.glob('e*07[0-1].fits')+glob.glob('e*07[4-7].fits'))       # optional subselection
+infile_list = runstage(manifestfile, 'extract', specpolextract, configgroups(infile_list, logfile),    \
+    outnames=lambda flist: ['e'+f for f in flist], runargs=dict(logfile=logfile, debug=debug), \
+    force=('extract' in forcelist), logfile=logfile)
 
-infile_list = sorted(glob.glob('e*fits'))
-specpolrawstokes(infile_list, logfile=logfile)
+#raw stokes: file names number the configurations over the whole night, so all are redone together
+infile_list = runstage(manifestfile, 'rawstokes', specpolrawstokes, {'all':infile_list}, outglob='*_h*.fits',  \
+    runargs=dict(logfile=logfile), force=('rawstokes' in forcelist), logfile=logfile)
 
-#final stokes
-#polcal = 'polcal0.txt'                                 # null calibration
-#infile_list = sorted(glob.glob('*_h[0,2]*.fits'))      # optional subselection 
+#final stokes, by raw stokes configuration
+#infile_list = [f for f in infile_list if f.count('_h0') | f.count('_h2')]      # optional subselection
 
-polcal = 'polcal.txt'
-infile_list = sorted(glob.glob('*_h*.fits'))
-specpolfinalstokes(infile_list, polcal=polcal, logfile=logfile, debug=debug)
+infile_list = runstage(manifestfile, 'finalstokes', specpolfinalstokes, rawstokesgroups(infile_list),   \
+    outglob='*_stokes.fits', runargs=dict(logfile=logfile, debug=debug),  \
+    force=('finalstokes' in forcelist), logfile=logfile)
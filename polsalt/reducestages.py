@@ -0,0 +1,169 @@
+"""
+reducestages
+
+Incremental reduction driver: redo a pipeline stage only for the groups of input files whose
+products are stale.
+
+A stage is a function fn(infilelist, **params), done for each group of its input files
+(one raw image for imred, one configuration for wavmap and extract, one raw stokes configuration
+for finalstokes).  A manifest (json) records for each stage and group the input files, the
+parameters, and the output files it made, each file with its size, mtime, and md5 hash.  A group
+is redone if it is new, its input files or parameters changed, or one of its outputs was removed
+or altered.  Since the hashes decide, a redone group whose outputs come out identical does not make
+the next stage redo anything.  The manifest is rewritten after each stage call, so an interrupted
+reduction resumes where it stopped.
+
+"""
+
+import os, glob, json, hashlib
+
+from saltsafelog import logging
+from specpolutils import list_configurations
+
+# ------------------------------------
+def filehash(filename, file_dict):
+    """Return md5 hash of file, recomputed only if its size or mtime differ from file_dict"""
+    filestat = os.stat(filename)
+    if filename in file_dict:
+        size, mtime, md5 = file_dict[filename]
+        if (size == filestat.st_size) & (mtime == filestat.st_mtime): return md5
+
+    md5 = hashlib.md5()
+    with open(filename,'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''): md5.update(block)
+    file_dict[filename] = [filestat.st_size, filestat.st_mtime, md5.hexdigest()]
+    return file_dict[filename][2]
+
+def readmanifest(manifestfile):
+    """Return the manifest dictionary, empty if there is no usable manifest file"""
+    manifest = {'files':{}, 'stages':{}}
+    if not os.path.isfile(manifestfile): return manifest
+    try:
+        manifest.update(json.load(open(manifestfile)))
+    except ValueError:
+        pass
+    return manifest
+
+def writemanifest(manifestfile, manifest):
+    """Write the manifest, via a temporary file so an interrupted write leaves the old one"""
+    tmpfile = manifestfile+'.%i.tmp' % os.getpid()
+    with open(tmpfile,'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(tmpfile, manifestfile)
+
+# ------------------------------------
+def runstage(manifestfile, stage, fn, group_dict, params={}, outnames=None, outglob=None,
+        runargs={}, force=False, logfile='salt.log'):
+    """Do stage fn for the stale groups in group_dict, and return the outputs of all groups
+
+    Parameters
+    ----------
+    manifestfile: str
+        json manifest, created if it does not exist
+
+    stage: str
+        stage name in the manifest
+
+    fn: function
+        called as fn(infilelist, **params, **runargs)
+
+    group_dict: dict
+        input file list for each group key.  Groups of this stage no longer in group_dict are
+        dropped from the manifest (their files are left, but no longer returned)
+
+    params: dict
+        parameters that change the products.  A change redoes all groups
+
+    outnames: function
+        outnames(infilelist) gives the output file names made from infilelist, those existing after
+        the run being taken.  The stale groups are then done in one fn call
+
+    outglob: str
+        if outnames is None, the stale groups are done one fn call each, and the outputs of a group
+        are the files matching outglob that the call made or rewrote
+
+    runargs: dict
+        other keyword arguments for fn, which do not change the products (logfile, nworkers)
+
+    force: bool
+        redo all groups
+
+    Returns: sorted list of output files of all groups in group_dict
+
+    """
+    manifest = readmanifest(manifestfile)
+    file_dict = manifest['files']
+    node_dict = manifest['stages'].setdefault(stage,{})
+    jsonparams = json.loads(json.dumps(params))         # as it comes back from the manifest
+
+    for key in node_dict.keys():
+        if key not in group_dict: del node_dict[key]
+
+    stalelist = []
+    staleinput_dict = {}
+    for key in sorted(group_dict):
+        input_dict = dict((f,filehash(f,file_dict)) for f in group_dict[key])
+        node = node_dict.get(key)
+        isstale = force | (node is None)
+        if not isstale:
+            isstale = (node['params'] != jsonparams) | (node['inputs'] != input_dict)
+        if not isstale:
+            isstale = not all([os.path.isfile(f) for f in node['outputs']])
+        if not isstale:
+            isstale = any([filehash(f,file_dict) != node['outputs'][f] for f in node['outputs']])
+        if isstale:
+            stalelist.append(key)
+            staleinput_dict[key] = input_dict
+
+    with logging(logfile, False) as log:
+        log.message('\n'+stage+': '+str(len(group_dict))+' groups, '+str(len(stalelist))+' to do: '+  \
+            ' '.join(stalelist), with_header=False)
+
+    fnargs = dict(params)
+    fnargs.update(runargs)
+    if outnames is not None:
+        callgrouplist = ([stalelist,] if len(stalelist) else [])
+    else:
+        callgrouplist = [[key] for key in stalelist]
+    for grouplist in callgrouplist:
+        infilelist = sorted(set(sum([group_dict[key] for key in grouplist],[])))
+        if outnames is None:
+            oldfile_dict = dict((f,(os.stat(f).st_size,os.stat(f).st_mtime)) for f in glob.glob(outglob))
+        fn(infilelist, **fnargs)
+
+        for key in grouplist:
+            if outnames is not None:
+                outfilelist = [f for f in outnames(group_dict[key]) if os.path.isfile(f)]
+            else:
+                outfilelist = [f for f in glob.glob(outglob) \
+                    if oldfile_dict.get(f) != (os.stat(f).st_size,os.stat(f).st_mtime)]
+            node_dict[key] = {'params':jsonparams, 'inputs':staleinput_dict[key],    \
+                'outputs':dict((f,filehash(f,file_dict)) for f in outfilelist)}
+        writemanifest(manifestfile, manifest)
+    if len(stalelist) == 0: writemanifest(manifestfile, manifest)
+
+    return sorted(set([str(f) for k in node_dict for f in node_dict[k]['outputs']]))
+
+# ------------------------------------
+def imagegroups(infilelist):
+    """Return group dictionary with one group for each image"""
+    return dict((os.path.basename(f),[f]) for f in infilelist)
+
+def configgroups(infilelist, logfile='salt.log'):
+    """Return group dictionary with one group (arcs and objects) for each configuration"""
+    with logging(logfile, False) as log:
+        config_dict = list_configurations(list(infilelist), log)
+    group_dict = {}
+    for config in config_dict:
+        key = '_'.join([str(x).strip() for x in config])
+        group_dict[key] = sorted(set(list(config_dict[config]['arc'])+list(config_dict[config]['object'])))
+    return group_dict
+
+def rawstokesgroups(infilelist):
+    """Return group dictionary with one group for each raw stokes configuration (_c<n>)"""
+    group_dict = {}
+    for f in infilelist:
+        namepartlist = os.path.basename(f).rsplit('.',1)[0].rsplit('_',3)
+        if len(namepartlist) < 4: continue
+        group_dict.setdefault(namepartlist[1],[]).append(f)
+    return group_dict
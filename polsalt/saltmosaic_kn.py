@@ -26,12 +26,11 @@ Updates
 import os
 import time
 import numpy
-from scipy import ndimage as nd
+from scipy import sparse
 from astropy.io import fits
 from pyraf import iraf
 
 from math import cos, sin, pi, floor
-from scipy.ndimage import geometric_transform
 
 import saltsafekey as saltkey
 import saltsafeio as saltio
@@ -111,6 +110,42 @@ def saltmosaic(images, outimages, outpref, geomfile, interp='linear',
             ostruct.close()
 
 
+def saltmosaic_struct(struct, geomfile, interp='linear', geotran=True,
+                      fill=False, cleanup=True, log=None, verbose=True):
+    """Mosaic an open SALT image struct in memory, returning the mosaicked
+        struct without writing it.  Same geometry and housekeeping as saltmosaic
+    """
+
+    # does CCD geometry definition file exist
+    saltio.fileexists(geomfile)
+    gap, xshift, yshift, rotation = saltio.readccdgeom(geomfile)
+
+    # create the mosaic
+    ostruct = make_mosaic(
+        struct,
+        gap,
+        xshift,
+        yshift,
+        rotation,
+        interp_type=interp,
+        geotran=geotran,
+        fill=fill,
+        cleanup=cleanup,
+        log=log,
+        verbose=verbose)
+
+    # housekeeping keywords
+    fname, hist = history(
+        level=1, wrap=False, exclude=['struct', 'log'])
+    saltkey.housekeeping(
+        ostruct[0],
+        'SMOSAIC',
+        'Images have been mosaicked, v0.3',
+        hist)
+
+    return ostruct
+
+
 def make_mosaic(struct, gap, xshift, yshift, rotation, interp_type='linear',
                 boundary='constant', constant=0, geotran=True, fill=False,
                 cleanup=True, log=None, verbose=False):
@@ -281,9 +316,10 @@ def make_mosaic(struct, gap, xshift, yshift, rotation, interp_type='linear',
             message += str(ydsec2[0]) + ':' + str(ydsec2[1]) + ']'
             log.message(message, with_stdout=verbose, with_header=False)
 
-    # write temporary file of tiled CCDs
-    hdulist = fits.HDUList(tilehdu)
-    hdulist.writeto(tilefile)
+    # write temporary file of tiled CCDs (only IRAF geotran needs it)
+    if geotran:
+        hdulist = fits.HDUList(tilehdu)
+        hdulist.writeto(tilefile)
 
     # iterate over CCDs, transform and rotate images
     yrot = [None] * 4
@@ -301,11 +337,12 @@ def make_mosaic(struct, gap, xshift, yshift, rotation, interp_type='linear',
     # this is hardwired for SALT where the second CCD is considered the
     # fiducial
     for hdu in range(1, int(nsciext / 2 + 1)):
-        tranfile[hdu] = saltio.tmpfile(outpath)
-        tranfile[hdu] += 'tran.fits'
-        if varframe:
-            tranfile[hdu + nccds] = saltio.tmpfile(outpath) + 'tran.fits'
-            tranfile[hdu + 2 * nccds] = saltio.tmpfile(outpath) + 'tran.fits'
+        if geotran:
+            tranfile[hdu] = saltio.tmpfile(outpath)
+            tranfile[hdu] += 'tran.fits'
+            if varframe:
+                tranfile[hdu + nccds] = saltio.tmpfile(outpath) + 'tran.fits'
+                tranfile[hdu + 2 * nccds] = saltio.tmpfile(outpath) + 'tran.fits'
 
         ccd = hdu % nccds
         if (ccd == 0):
@@ -315,6 +352,9 @@ def make_mosaic(struct, gap, xshift, yshift, rotation, interp_type='linear',
         yrot[ccd] = rot[ccd] * ybin / xbin
         xrot[ccd] = rot[ccd] * xbin / ybin
         dxshift = xbin * int(float(int(gap) / xbin) + 0.5) - gap
+#        geo_xshift = xsh[ccd] + (2 - ccd) * dxshift / xbin
+        geo_xshift = (xsh[ccd] + (2 - ccd) * dxshift) / xbin        # 20180308 kn binning fix
+        geo_yshift = ysh[ccd] / ybin
 
         # transformation using geotran IRAF task
         if (ccd != 2):
@@ -339,9 +379,6 @@ def make_mosaic(struct, gap, xshift, yshift, rotation, interp_type='linear',
                 yd, xd = tilehdu[ccd].data.shape
                 ncols = 'INDEF'  # ncols=xd+abs(xsh[ccd]/xbin)
                 nlines = 'INDEF'  # nlines=yd+abs(ysh[ccd]/ybin)
-#                geo_xshift = xsh[ccd] + (2 - ccd) * dxshift / xbin
-                geo_xshift = (xsh[ccd] + (2 - ccd) * dxshift) / xbin        # 20180308 kn binning fix
-                geo_yshift = ysh[ccd] / ybin
                 iraf.images.immatch.geotran(tilefile + "[" + str(ccd) + "]",
                                             tranfile[hdu],
                                             "",
@@ -406,35 +443,27 @@ def make_mosaic(struct, gap, xshift, yshift, rotation, interp_type='linear',
                         tranfile[hdu + 2 * nccds])[0].data>0).astype(float)
 
             else:
+                # native transform: same shift, rotation and boundaries as geotran above,
+                # one coordinate map for SCI, VAR, BPM
                 log.message(
-                    "Transform CCD #%i using dx=%s, dy=%s, rot=%s" %
+                    "Transform CCD #%i using dx=%s, dy=%s, xrot=%s, yrot=%s" %
                     (ccd,
-                     xsh[ccd] / 2.0,
-                        ysh[ccd] / 2.0,
-                        xrot[ccd]),
+                     geo_xshift,
+                        geo_yshift,
+                        xrot[ccd],
+                        yrot[ccd]),
                     with_stdout=verbose,
                     with_header=False)
-                tranhdu[hdu] = geometric_transform(
-                    tilehdu[ccd].data,
-                    tran_func,
-                    prefilter=False,
-                    order=1,
-                    extra_arguments=(xsh[ccd] / 2, ysh[ccd] / 2, 1, 1, xrot[ccd], yrot[ccd]))
-                tstruct = fits.PrimaryHDU(tranhdu[hdu])
-                tstruct.writeto(tranfile[hdu])
                 if varframe:
-                    tranhdu[hdu + nccds] = geometric_transform(
-                        tilehdu[hdu + 3].data,
-                        tran_func,
-                        prefilter=False,
-                        order=1,
-                        extra_arguments=(xsh[ccd] / 2, ysh[ccd] / 2, 1, 1, xrot[ccd], yrot[ccd]))
-                    tranhdu[hdu + 2 * nccds] = (geometric_transform(
-                        tilehdu[hdu + 6].data,
-                        tran_func,
-                        prefilter=False,
-                        order=1,
-                        extra_arguments=(xsh[ccd] / 2, ysh[ccd] / 2,1, 1, xrot[ccd], yrot[ccd])) > 0).astype(float)
+                    tranhdu[hdu], tranhdu[hdu + nccds], tranhdu[hdu + 2 * nccds] = \
+                        geotran_native([tilehdu[ccd].data, tilehdu[ccd + nccds].data,
+                                        tilehdu[ccd + 2 * nccds].data],
+                                       geo_xshift, geo_yshift, xrot[ccd], yrot[ccd],
+                                       cval_list=[0., 0., 1.])
+                    tranhdu[hdu + 2 * nccds] = (tranhdu[hdu + 2 * nccds] > 0).astype(float)
+                else:
+                    tranhdu[hdu], = geotran_native([tilehdu[ccd].data],
+                                       geo_xshift, geo_yshift, xrot[ccd], yrot[ccd])
 
         else:
             log.message(
@@ -577,28 +606,169 @@ def fill_gaps(data, mask):
     ys, xs = data.shape
     if isinstance(mask, numpy.ndarray):
         mask = (mask == 0)
-        for i in range(ys):
-            x = numpy.arange(xs)
-            rdata = data[i, :]
-            rmask = mask[i, :]
-            rmask = nd.minimum_filter(rmask, size=3)
-            if rmask.any() == True:
-                rdata = numpy.interp(x, x[rmask], rdata[rmask])
-                data[i, rmask == 0] = rdata[rmask == 0]
     else:
         mask = (data != mask)
-        for i in range(ys):
-            x = numpy.arange(xs)
-            rdata = data[i, :]
-            rmask = mask[i, :]
-            rmask = nd.minimum_filter(rmask, size=3)
-            if rmask.any() == True:
-                rdata = numpy.interp(x, x[rmask], rdata[rmask])
-                data[i, rmask == 0] = rdata[rmask == 0]
+
+    # good pixels are unmasked with unmasked neighbours in the row
+    good_rc = mask.copy()
+    good_rc[:, 1:] &= mask[:, :-1]
+    good_rc[:, :-1] &= mask[:, 1:]
+    if xs > 1:
+        good_rc[:, 0] = mask[:, 0] & mask[:, 1]
+        good_rc[:, -1] = mask[:, -1] & mask[:, -2]
+    fill_rc = numpy.zeros((ys, xs + 2), dtype=numpy.int8)
+    fill_rc[:, 1:-1] = ~good_rc
+    fill_rc[~good_rc.any(axis=1)] = 0
+    # runs of pixels to fill: first (_0) and last (_1) column of each run
+    edge_rc = numpy.diff(fill_rc, axis=1).ravel()
+    start_j = numpy.flatnonzero(edge_rc == 1)
+    end_j = numpy.flatnonzero(edge_rc == -1)
+    if len(start_j) == 0:
+        return data
+    r_j, c0_j = numpy.divmod(start_j, xs + 1)
+    c1_j = end_j % (xs + 1) - 1
+
+    # interpolate between the good pixels on either side of each run, as numpy.interp,
+    # with the end values carried past the first and last good pixel in the row
+    left_j = numpy.where(c0_j > 0, c0_j - 1, c1_j + 1)
+    right_j = numpy.where(c1_j < xs - 1, c1_j + 1, left_j)
+    len_j = c1_j - c0_j + 1
+    j_i = numpy.repeat(numpy.arange(len(len_j)), len_j)
+    c_i = numpy.arange(len_j.sum()) - numpy.repeat(numpy.cumsum(len_j) - len_j, len_j) + c0_j[j_i]
+    r_i = r_j[j_i]
+    left_i = left_j[j_i]
+    right_i = right_j[j_i]
+    yleft_i = data[r_i, left_i].astype(float)
+    yright_i = data[r_i, right_i].astype(float)
+    fill_i = yleft_i.copy()
+    isin_i = (right_i > left_i)
+    slope_i = (yright_i[isin_i] - yleft_i[isin_i]) / (right_i[isin_i] - left_i[isin_i])
+    fill_i[isin_i] = slope_i * (c_i[isin_i] - left_i[isin_i]) + yleft_i[isin_i]
+    data[r_i, c_i] = fill_i
 
     return data
 
 
+# gather tables from geotran_map, keyed by (tile shape, xshift, yshift, xrot, yrot).
+# The binned shifts and rotations follow from the geometry file and CCDSUM, the shape
+# from CCDSUM and window, so all the frames of a night share one entry per CCD.
+# An entry takes 32 bytes per pixel (about 270 MB for an unbinned tile), and each
+# imred_pool worker has its own cache, so only the two CCDs of one configuration are kept
+geomap_cache = {}
+geomap_cachesize = 2
+
+
+def geotran_map(shape, xshift, yshift, xrot, yrot, fluxconserve=True):
+    """Sparse linear-interpolation operator for the tran_func shift and rotation
+        about the tile centre
+
+       Parameters
+       ----------
+       shape: tuple
+          (rows, cols) of the input (and output) image
+
+       xshift, yshift, xrot, yrot: float
+          as for geotran_native
+
+       Returns
+       -------
+       tran_pp: scipy.sparse.csr_matrix
+          (rows*cols, rows*cols) source pixel weights for each output pixel
+       out_p: np.ndarray
+          weight of the output pixel falling outside the input, to multiply by cval
+
+    """
+    key = (tuple(shape), float(xshift), float(yshift), float(xrot), float(yrot), fluxconserve)
+    if key in geomap_cache:
+        return geomap_cache[key]
+
+    rows, cols = shape
+    npix = rows * cols
+    if fluxconserve:
+        jacobian = cos((xrot - yrot) * pi / 180.)
+    else:
+        jacobian = 1.
+
+    # the table is built in blocks of rows, to keep the float64 coordinates small,
+    # straight into the float32 weights and int32 indices that the matrix keeps
+    wt_pk = numpy.zeros((npix, 4), dtype=numpy.float32)
+    idx_pk = numpy.zeros((npix, 4), dtype=numpy.int32)
+    out_p = numpy.zeros(npix, dtype=numpy.float32)
+    blkrows = max(1, 2**18 // cols)
+
+    # geotran (xin, yin, xout, yout INDEF) rotates about the image centre, which
+    # maps to the output centre plus the shift
+    center_d = numpy.array([(rows - 1) / 2., (cols - 1) / 2.])
+    for row0 in range(0, rows, blkrows):
+        blkrows = min(blkrows, rows - row0)
+        b_p = slice(row0 * cols, (row0 + blkrows) * cols)
+        rc_dp = numpy.indices((blkrows, cols)).reshape((2, -1)) + \
+            numpy.array([row0, 0])[:, None] - center_d[:, None]
+        row_p, col_p = tran_func(rc_dp, xshift, yshift, 1, 1, xrot, yrot)
+        row_p += center_d[0]
+        col_p += center_d[1]
+
+        # four corners of each output pixel.  Output pixels mapping outside the input go
+        # wholly to cval, as for geotran and map_coordinates constant boundary
+        in_p = (row_p >= 0) & (row_p <= rows - 1) & (col_p >= 0) & (col_p <= cols - 1)
+        r0_p = numpy.clip(numpy.floor(row_p), 0, rows - 1).astype(numpy.int32)
+        c0_p = numpy.clip(numpy.floor(col_p), 0, cols - 1).astype(numpy.int32)
+        fr_p = (row_p - r0_p).astype(numpy.float32)
+        fc_p = (col_p - c0_p).astype(numpy.float32)
+        del row_p, col_p, rc_dp
+        wt_p = (jacobian * in_p).astype(numpy.float32)
+        for k, (dr, dc) in enumerate(((0, 0), (0, 1), (1, 0), (1, 1))):
+            idx_pk[b_p, k] = numpy.minimum(r0_p + dr, rows - 1) * cols + \
+                numpy.minimum(c0_p + dc, cols - 1)
+            wt_pk[b_p, k] = wt_p * (fr_p if dr else 1. - fr_p) * (fc_p if dc else 1. - fc_p)
+        out_p[b_p] = jacobian * (~in_p)
+
+    tran_pp = sparse.csr_matrix(
+        (wt_pk.ravel(), idx_pk.ravel(), numpy.arange(0, 4 * npix + 1, 4)),
+        shape=(npix, npix))
+    del wt_pk, idx_pk
+    tran_pp.eliminate_zeros()
+
+    if len(geomap_cache) >= geomap_cachesize:
+        geomap_cache.clear()
+    geomap_cache[key] = (tran_pp, out_p)
+    return geomap_cache[key]
+
+
+def geotran_native(data_list, xshift, yshift, xrot, yrot, cval_list=None,
+                   fluxconserve=True):
+    """Shift and rotate images with linear interpolation, the numpy equivalent
+        of the IRAF geotran call in make_mosaic
+
+       Parameters
+       ----------
+       data_list: list of np.ndarray
+          2d images of the same shape (eg SCI, VAR, BPM of one CCD tile).  They
+          are transformed together by one cached operator from geotran_map
+
+       xshift, yshift: float
+          shift in binned pixels
+
+       xrot, yrot: float
+          rotation of x and y axes in degrees
+
+       cval_list: list of float
+          value outside the input boundary for each image (default 0)
+
+       fluxconserve: bool
+          multiply by the jacobian of the transformation, as geotran does
+
+    """
+    if cval_list is None:
+        cval_list = [0.] * len(data_list)
+    shape = data_list[0].shape
+    tran_pp, out_p = geotran_map(shape, xshift, yshift, xrot, yrot, fluxconserve)
+
+    data_pi = numpy.array([data.ravel() for data in data_list]).T
+    tran_pi = tran_pp.dot(data_pi) + out_p[:, None] * numpy.array(cval_list)[None, :]
+    return [tran_pi[:, i].reshape(shape) for i in range(len(data_list))]
+
+
 def tran_func(a, xshift, yshift, xmag, ymag, xrot, yrot):
     xtran = ymag * a[0] * cos(yrot * pi / 180.0) \
         - xmag * a[1] * sin(xrot * pi / 180) \
@@ -61,11 +61,13 @@
 # 17 Jun 2018   Updated to allow reading of header values mistakenly written
 #               as ints as float, when float is specified (eg HWP-ANG)
 #               Removed sort at beginning, leaving this up to the user
+#               Added optional header index file, so headers already read are
+#               not read again by later pipeline stages
 
 from __future__ import with_statement
 
 from pyraf import iraf
-import os, glob, time 
+import os, glob, time, json
 from astropy.io import fits
 
 import saltsafekey as saltkey
@@ -153,10 +155,18 @@ def createobslogfits(headerDict):
 # -----------------------------------------------------------
 # read keyword and append to list
 
-def obslog(infiles, log=None):
+def obslog(infiles, log=None, indexfile=None, intfloat=True):
    """For a set of input files, create a dictionary contain all the header 
       information from the files.  Will print things to a saltlog if log is
       not None
+
+      If indexfile is given, header values are looked up there first, keyed by
+      the file path, modification time and size, and values read from new or
+      changed files are added to it.  Keyword warnings are only given when a
+      file is first read.
+
+      intfloat: if True, int values of float keywords are read as float (kn fix),
+      if False they are replaced by the default, as in pysalt saltobslog
     
       returns Dictionary
    """
@@ -166,10 +176,29 @@ def obslog(infiles, log=None):
    for k in scamheaderList: headerDict[k]=[]
    for k in rssheaderList: headerDict[k]=[]
 
+   index = readindex(indexfile)
+   newindex = False
+
    # interate over and open image files
 #   infiles.sort()                  This should be left up to the user at a higher level
    for infile in infiles:
 
+       #add in the image name
+       headerDict['FILENAME'].append(os.path.basename(infile))
+
+       # use the index entry if the file is unchanged
+       filekey = os.path.abspath(infile)
+       filestat = os.stat(infile)
+       entry = index.get(filekey)
+       if entry is not None:
+           if (entry[0] == filestat.st_mtime) & (entry[1] == filestat.st_size):
+               for k,f in zip(headerList[1:]+scamheaderList[1:]+rssheaderList[1:], \
+                         formatList[1:]+scamformatList[1:]+rssformatList[1:]):
+                   value = entry[2][k]
+                   if isinstance(value, unicode): value = value.encode('latin-1')
+                   headerDict[k].append(checkkey(value, finddefault(f), intfloat))
+               continue
+
        #open the file
        struct = saltio.openfits(infile)
 
@@ -180,31 +209,49 @@ def obslog(infiles, log=None):
        if (instrume=='RSS'): rss = True
        if (instrume=='SALTICAM'): scam=True
 
-       #add in the image name
-       headerDict['FILENAME'].append(os.path.basename(infile))
-
-       # ingest primary keywords from files in the image list
-       for k,f in zip(headerList[1:], formatList[1:]):
-           default=finddefault(f)
-           headerDict[k].append(getkey(struct[0], k, default=default, log=log, warn=True))
-
-       # ingest scam specific primary keywords from files in the image list
-       for k,f in zip(scamheaderList[1:], scamformatList[1:]):
-           default=finddefault(f)
-           headerDict[k].append(getkey(struct[0], k, default=default, log=log, warn=scam))
-
-       # ingest rss specific primary keywords from files in the image list
-       for k,f in zip(rssheaderList[1:], rssformatList[1:]):
-           default=finddefault(f)
-           headerDict[k].append(getkey(struct[0], k, default=default, log=log, warn=rss))
+       # ingest primary, scam and rss specific keywords from files in the image list.
+       #   The index keeps the values as read, before the type check
+       rawDict = {}
+       for keyList,fmtList,warn in ((headerList,formatList,True), \
+                    (scamheaderList,scamformatList,scam),(rssheaderList,rssformatList,rss)):
+           for k,f in zip(keyList[1:], fmtList[1:]):
+               default=finddefault(f)
+               rawDict[k] = readkey(struct[0], k, default=default, log=log, warn=warn)
+               headerDict[k].append(checkkey(rawDict[k], default, intfloat, \
+                    keyword=k, infile=struct._file.name, log=log, warn=warn))
 
        # close image files
        saltio.closefits(struct)
 
-       if log: log.message('SALTOBSLOG -- read %s' % infile, with_header=False)
+       if indexfile:
+           index[filekey] = [filestat.st_mtime, filestat.st_size, rawDict]
+           newindex = True
+
+   if newindex: writeindex(indexfile, index)
 
    return headerDict
 
+indexversion = 2
+
+def readindex(indexfile):
+   """Return the header index dictionary, empty if there is no usable index file"""
+   if not indexfile: return {}
+   if not os.path.isfile(indexfile): return {}
+   try:
+       index = json.load(open(indexfile), encoding='latin-1')
+   except ValueError:
+       return {}
+   if index.get('version') != indexversion: return {}
+   return index['files']
+
+def writeindex(indexfile, index):
+   """Write the header index, via a temporary file so a reader never sees it half written.
+      Header strings are bytes, kept as latin-1 so any of them survives the round trip"""
+   tmpfile = indexfile+'.%i.tmp' % os.getpid()
+   with open(tmpfile,'w') as f:
+       json.dump({'version':indexversion, 'files':index}, f, encoding='latin-1')
+   os.rename(tmpfile, indexfile)
+
 def finddefault(f):
    """return the default value given a format"""
    if f.count('A'): 
@@ -218,6 +265,13 @@ def finddefault(f):
 def getkey(struct,keyword,default,warn=True, log=None):
    """Return the keyword value.  Throw a warning if it doesn't work """
 
+   value = readkey(struct, keyword, default, warn=warn, log=log)
+   return checkkey(value, default, True, keyword=keyword, infile=struct._file.name, \
+        log=log, warn=warn)
+
+def readkey(struct,keyword,default,warn=True, log=None):
+   """Return the keyword value as in the header, default if missing or blank"""
+
    try:
         value = saltkey.get(keyword, struct)
         if isinstance(default, str):  value=value.strip()
@@ -227,9 +281,13 @@ def getkey(struct,keyword,default,warn=True, log=None):
         message = 'WARNING: cannot find keyword %s in %s' %(keyword, infile)
         if warn and log: log.message(message, with_header=False)
    if (str(value).strip() == ''): value = default
-   if ((type(value) == int)&(type(default) == float)): value = float(value)         # kn fix
+   return value
+
+def checkkey(value,default,intfloat=True,keyword='',infile='',warn=False, log=None):
+   """Return the value if it has the type of default, else default, with a warning"""
+
+   if (intfloat & (type(value) == int)&(type(default) == float)): value = float(value)   # kn fix
    if (type(value) != type(default)):
-        infile=struct._file.name
         message='WARNING: Type mismatch for %s for  %s in %s[0]' % (str(value), keyword, infile)
         message += '/n '+str(type(value)) + ' '+str(type(default))
         if warn and log: log.message(message, with_header=False)
@@ -4,9 +4,12 @@
 # New version 150912, much faster
 # New version 170504, fixed case where output bin coverage is larger than input bin coverage
 # New version 170909, again fixed case where output bin coverage is larger than input bin coverage
+# scrunch2d: same rebinning for a stack of rows, as one sparse matrix shared by several data arrays
+# scrunchmatrix_cached: rebinning matrices kept in memory, and optionally on disk, keyed by the bin edges
 
-import os, sys, time, glob, shutil
+import os, sys, time, glob, shutil, hashlib
 import numpy as np
+from scipy import sparse
 
 def scrunch1d(input,binedge):
 # new binedges are in coordinate system x where the left edge of the 0th input bin is at 0.0
@@ -51,6 +54,66 @@ def scrunch1d(input,binedge):
 
     return output_x
 
+def scrunchmatrix(binedge_nx,na):
+# sparse (N*nx, N*na) rebinning matrix for N rows of na input bins, binedge_nx (N,nx+1) as for scrunch1d
+# element is the overlap of output bin x with input bin a, clipped to the array.  nan edges give empty bins
+    binedge_nx = np.atleast_2d(binedge_nx).astype(float)
+    N,nx = binedge_nx.shape[0],binedge_nx.shape[1]-1
+    okx_nx = ((binedge_nx[:,1:]>0) & (binedge_nx[:,:-1]<na))
+    lo_X = np.where(okx_nx,np.clip(binedge_nx[:,:-1],0.,na),0.).flatten()
+    hi_X = np.where(okx_nx,np.clip(binedge_nx[:,1:],0.,na),0.).flatten()
+    ia0_X = np.floor(lo_X).astype(int)
+    na_X = np.where(hi_X > lo_X, np.ceil(hi_X).astype(int) - ia0_X, 0)
+
+# _e: matrix elements, input bins within each output bin
+    ptr_X = np.append(0,np.cumsum(na_X))
+    iX_e = np.repeat(np.arange(N*nx),na_X)
+    ia_e = ia0_X[iX_e] + np.arange(ptr_X[-1]) - ptr_X[iX_e]
+    wt_e = np.minimum(hi_X[iX_e],ia_e+1) - np.maximum(lo_X[iX_e],ia_e)
+
+    return sparse.csr_matrix((wt_e,(iX_e/nx)*na + ia_e,ptr_X),shape=(N*nx,N*na))
+
+scrunchcache = {}
+scrunchcachesize = 16
+
+def scrunchmatrix_cached(binedge_nx,na,cachefile=None):
+# scrunchmatrix, reused when called again with the same bin edges.  If cachefile (.npz) is given, the
+#   matrix is also read from or saved to it, so it survives between runs
+    binedge_nx = np.atleast_2d(binedge_nx).astype(float)
+    key = hashlib.sha1(binedge_nx.tostring() + str(binedge_nx.shape) + str(na)).hexdigest()
+    if key in scrunchcache: return scrunchcache[key]
+
+    scrunch_XA = None
+    if cachefile is not None:
+        if os.path.isfile(cachefile):
+            npz = np.load(cachefile)
+            if str(npz['key']) == key:
+                scrunch_XA = sparse.csr_matrix((npz['data'],npz['indices'],npz['indptr']), \
+                    shape=tuple(npz['shape']))
+            npz.close()
+    if scrunch_XA is None:
+        scrunch_XA = scrunchmatrix(binedge_nx,na)
+        if cachefile is not None:
+            np.savez(cachefile,key=key,data=scrunch_XA.data,indices=scrunch_XA.indices, \
+                indptr=scrunch_XA.indptr,shape=scrunch_XA.shape)
+
+    if len(scrunchcache) >= scrunchcachesize: scrunchcache.clear()
+    scrunchcache[key] = scrunch_XA
+    return scrunch_XA
+
+def scrunch2d(input_na,binedge_nx=None,scrunch_XA=None):
+# scrunch1d for each row of input_na (N,na), with bin edges binedge_nx (N,nx+1), or precomputed scrunch_XA
+#   from scrunchmatrix.  input_na may be a list of arrays sharing the bin edges, returns a list
+    inputlist = input_na if isinstance(input_na,list) else [input_na,]
+    N,na = np.atleast_2d(inputlist[0]).shape
+    if scrunch_XA is None: scrunch_XA = scrunchmatrix(binedge_nx,na)
+    nx = scrunch_XA.shape[0]/N
+    input_Ai = np.array([np.asarray(input,dtype=float).flatten() for input in inputlist]).T
+    output_Xi = scrunch_XA.dot(input_Ai)
+    outputlist = [output_Xi[:,i].reshape((N,nx)) for i in range(len(inputlist))]
+
+    return outputlist if isinstance(input_na,list) else outputlist[0]
+
 if __name__=='__main__':
     input=np.loadtxt(sys.argv[1])
     binedge=np.loadtxt(sys.argv[2])
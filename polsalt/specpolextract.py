@@ -10,7 +10,7 @@ import os, sys, glob, shutil, inspect
 
 import numpy as np
 import pyfits
-from scipy.interpolate import interp1d
+from multiprocessing import Pool
 from scipy import linalg as la
 
 from specpolutils import *
@@ -18,18 +18,218 @@ from specpolutils import *
 from oksmooth import blksmooth2d
 from specpolutils import configmap
 from specpollampextract import specpollampextract
-from specpolsignalmap import specpolsignalmap
+from specpolsignalmap import specpolsignalmap_cached
 from skysub2d_khn import make_2d_skyspectrum
-from scrunch1d import scrunch1d
+from scrunch1d import scrunch2d, scrunchmatrix_cached
 from pyraf import iraf
 from iraf import pysalt
-from saltobslog import obslog
 from saltsafelog import logging
 
 # np.seterr(invalid='raise')
 np.set_printoptions(threshold=np.nan)
 debug = True
 
+# ---------------------------------------------------------------------------------------------
+# arrays shared by the images of a configuration, set by specpolextract before extract_image is called.
+#   Pool workers are forked after it is set, so they see it without copying
+extractshared = {}
+
+def extract_image(i,hdulist=None):
+    """
+    Background subtract and optimally extract image i of the current configuration, write e*.fits
+
+    Parameters
+    ----------
+    i: int
+        index in extractshared['outfilelist']
+    hdulist: fits.HDUList
+        the open image, or None to open it here
+
+    Returns
+    -------
+    log line for the image
+
+    """
+    outfilelist = extractshared['outfilelist']
+    badbinnew_orc = extractshared['badbinnew_orc']
+    isedge_orc = extractshared['isedge_orc']
+    istarget_orc = extractshared['istarget_orc']
+    isbkgcont_orc = extractshared['isbkgcont_orc']
+    skyflat_orc = extractshared['skyflat_orc']
+    maprow_ocd = extractshared['maprow_ocd']
+    rows = extractshared['rows']
+    cols = extractshared['cols']
+    wavs = extractshared['wavs']
+    rbin = extractshared['rbin']
+    docolshift = extractshared['docolshift']
+    img_I = extractshared['img_I']
+    dcol_I = extractshared['dcol_I']
+    specrow_or = extractshared['specrow_or']
+    binedge_orw = extractshared['binedge_orw']
+    scrunch_oXA = extractshared['scrunch_oXA']
+    psf_orw = extractshared['psf_orw']
+    psfnormmin = extractshared['psfnormmin']
+    pwidth = extractshared['pwidth']
+    wedge_w = extractshared['wedge_w']
+    wbin = extractshared['wbin']
+    psfblock = extractshared['psfblock']
+    debug = extractshared['debug']
+
+    outfile = outfilelist[i]
+    closehdu = hdulist is None
+    if closehdu: hdulist = pyfits.open(outfile, memmap=True)
+    tnum = image_number(outfile)
+    badbin_orc = (hdulist['BPM'].data > 0)
+    badbinbkg_orc = (badbin_orc | badbinnew_orc | isedge_orc | istarget_orc)
+    if debug:
+        pyfits.PrimaryHDU(isedge_orc.astype('uint8')).writeto('isedge_orc_'+tnum+'.fits',clobber=True)
+        pyfits.PrimaryHDU(istarget_orc.astype('uint8')).writeto('istarget_orc_'+tnum+'.fits',clobber=True) 
+        pyfits.PrimaryHDU(badbinbkg_orc.astype('uint8')).writeto('badbinbkg_orc_'+tnum+'.fits',clobber=True)
+    target_orc = bkgsub(hdulist,badbinbkg_orc,isbkgcont_orc,skyflat_orc,maprow_ocd,tnum,debug=debug)
+    target_orc *= (~badbin_orc).astype(int)             
+    if debug:
+        pyfits.PrimaryHDU(target_orc.astype('float32')).writeto('target_'+tnum+'_orc.fits',clobber=True)
+    var_orc = hdulist['var'].data
+    badbin_orc = (hdulist['bpm'].data > 0) | badbinnew_orc
+
+    # extract spectrum optimally (Horne, PASP 1986)
+    target_orw = np.zeros((2,rows,wavs))   
+    var_orw = np.zeros_like(target_orw)
+    badbin_orw = np.ones((2,rows,wavs),dtype='bool')   
+    wt_orw = np.zeros_like(target_orw)
+    dcol = 0.
+    if docolshift:
+        if int(tnum) in img_I:
+            dcol = dcol_I[np.where(img_I==int(tnum))]    # table has observed shift
+    for o in (0,1):
+        if dcol: scrunch_XA = scrunchmatrix_cached(binedge_orw[o,specrow_or[o]]+dcol,cols)
+        else: scrunch_XA = scrunch_oXA[o]
+        target_Rw,var_Rw,badbin_Rw = scrunch2d([target_orc[o,specrow_or[o]], \
+            var_orc[o,specrow_or[o]],badbin_orc[o,specrow_or[o]].astype(float)],scrunch_XA=scrunch_XA)
+        target_orw[o,specrow_or[o]] = target_Rw
+        var_orw[o,specrow_or[o]] = var_Rw
+        badbin_orw[o,specrow_or[o]] = (badbin_Rw > 0.001)
+    badbin_orw |= (var_orw == 0)
+    badbin_orw |= ((psf_orw*(~badbin_orw)).sum(axis=1)[:,None,:] < psfnormmin)
+    if debug:
+#                   pyfits.PrimaryHDU(var_orw.astype('float32')).writeto('var_'+tnum+'_orw.fits',clobber=True)
+        pyfits.PrimaryHDU(badbin_orw.astype('uint8')).writeto('badbin_'+tnum+'_orw.fits',clobber=True)
+
+    # use master psf shifted in row to allow for guide errors
+    ok_w = ((psf_orw*badbin_orw).sum(axis=1) < 0.03/float(pwidth/2)).all(axis=0)
+    if psfblock:
+        pshift,pshift_b = crosscor_shift(psf_orw,target_orw,ok_w,pwidth,wblk=psfblock)
+        psfsh_orw = np.zeros_like(psf_orw)
+        for b,w0 in enumerate(range(0,wavs,psfblock)):
+            psfsh_orw[:,:,w0:w0+psfblock] = psf_rowshift(psf_orw[:,:,w0:w0+psfblock],pshift_b[b],pwidth)
+        if debug: np.savetxt("pshift_"+tnum+"_b.txt",np.vstack((wedge_w[:-1:psfblock],pshift_b)).T,fmt="%10.2f %8.3f")
+    else:
+        pshift = crosscor_shift(psf_orw,target_orw,ok_w,pwidth)
+        psfsh_orw = psf_rowshift(psf_orw,pshift,pwidth)
+#                pyfits.PrimaryHDU(psfsh_orw.astype('float32')).writeto('psfsh_'+tnum+'_orw.fits',clobber=True)
+
+    wt_orw[~badbin_orw] = psfsh_orw[~badbin_orw]/var_orw[~badbin_orw]
+    var_ow = (psfsh_orw*wt_orw*(~badbin_orw)).sum(axis=1)
+    badbin_ow = (var_ow == 0)
+    var_ow[~badbin_ow] = 1./var_ow[~badbin_ow]
+#                pyfits.PrimaryHDU(var_ow.astype('float32')).writeto('var_'+tnum+'_ow.fits',clobber=True)
+#                pyfits.PrimaryHDU(target_orw.astype('float32')).writeto('target_'+tnum+'_orw.fits',clobber=True)
+#                pyfits.PrimaryHDU(wt_orw.astype('float32')).writeto('wt_'+tnum+'_orw.fits',clobber=True)
+
+    sci_ow = (target_orw*wt_orw).sum(axis=1)*var_ow
+
+    badlim = 0.20
+    psfbadfrac_ow = (psfsh_orw*badbin_orw.astype(int)).sum(axis=1)/psfsh_orw.sum(axis=1)
+    badbin_ow |= (psfbadfrac_ow > badlim)
+
+    cdebug = 83
+    if debug: np.savetxt("xtrct"+str(cdebug)+"_"+tnum+".txt",np.vstack((psf_orw[:,:,cdebug],var_orw[:,:,cdebug], \
+        wt_orw[:,:,cdebug],target_orw[:,:,cdebug])).reshape((4,2,-1)).transpose(1,0,2).reshape((8,-1)).T,fmt="%12.5e")
+
+# write O,E spectrum, prefix "s". VAR, BPM for each spectrum. y dim is virtual (length 1)
+# for consistency with other modes
+    hduout = pyfits.PrimaryHDU(header=hdulist[0].header)    
+    hduout = pyfits.HDUList(hduout)
+    header=hdulist['SCI'].header.copy()
+    header.update('VAREXT',2)
+    header.update('BPMEXT',3)
+    header.update('CRVAL1',wedge_w[0]+wbin/2.)
+    header.update('CRVAL2',0)
+    header.update('CDELT1',wbin)
+    header.update('CTYPE1','Angstroms')
+
+    hduout.append(pyfits.ImageHDU(data=sci_ow.reshape((2,1,wavs)), header=header, name='SCI'))
+    header.update('SCIEXT',1,'Extension for Science Frame',before='VAREXT')
+    hduout.append(pyfits.ImageHDU(data=var_ow.reshape((2,1,wavs)), header=header, name='VAR'))
+    hduout.append(pyfits.ImageHDU(data=badbin_ow.astype("uint8").reshape((2,1,wavs)), header=header, name='BPM'))            
+
+    hduout.writeto('e'+outfile,clobber=True,output_verify='warn')
+    if closehdu: hdulist.close()
+
+    return '  %8.2f   e%s' % (pshift*rbin/8.,outfile)
+
+# ---------------------------------------------------------------------------------------------
+def crosscor_shift(psf_orw,target_orw,ok_w,pwidth,wblk=0):
+    """
+    Row shift of target relative to psf, from their cross-correlation in row summed over beams and
+    ok wavelengths, refined with a parabola fit around the peak
+
+    Parameters
+    ----------
+    psf_orw, target_orw: numpy 3d arrays
+    ok_w: numpy 1d boolean array
+        wavelengths to use
+    pwidth: int
+        psf width (rows); shifts are searched over +/- pwidth/2
+    wblk: int
+        if > 0, also find the shift for each block of wblk wavelengths
+
+    Returns
+    -------
+    pshift: float.  If the peak is at the edge of the search, where no parabola can be fit, 
+        the shift of the highest lag
+    pshift_b: numpy 1d array, if wblk > 0.  Blocks with no usable peak get pshift
+
+    """
+    rows,wavs = psf_orw.shape[1:]
+    # crosscor_s[s] = sum(psf_orw[:,s+r]*target_orw[:,pwidth/2+r]*ok_w), r < rows-pwidth, all s at once by FFT
+    tgt_orw = np.zeros_like(psf_orw)
+    tgt_orw[:,:rows-pwidth] = target_orw[:,pwidth/2:pwidth/2+rows-pwidth]*ok_w
+    cross_fw = (np.fft.rfft(psf_orw,n=rows,axis=1)*np.conj(np.fft.rfft(tgt_orw,n=rows,axis=1))).sum(axis=0)
+    crosscor_s = np.fft.irfft(cross_fw.sum(axis=1),n=rows)[:pwidth]
+    pshift = parabola_peak(crosscor_s,pwidth)
+    if not np.isfinite(pshift):                     # peak at edge of search: use the integer peak
+        pshift = float(pwidth/2 - np.argmax(crosscor_s))
+    if not wblk: return pshift
+
+    # blocks come free: sum the cross spectrum over each block of wavelengths before transforming back
+    crosscor_sb = np.fft.irfft(np.add.reduceat(cross_fw,np.arange(0,wavs,wblk),axis=1),n=rows,axis=0)[:pwidth]
+    pshift_b = np.array([parabola_peak(crosscor_sb[:,b],pwidth) for b in range(crosscor_sb.shape[1])])
+    pshift_b[~np.isfinite(pshift_b)] = pshift
+    pshift_b[np.abs(pshift_b) > pwidth/2] = pshift
+
+    return pshift,pshift_b
+
+def parabola_peak(crosscor_s,pwidth):
+    """shift (relative to pwidth/2) of the parabola fit to the cross-correlation around its peak, 
+    nan if the peak is too near the edge of the search for the fit"""
+    smax = np.argmax(crosscor_s)
+    s_S = np.arange(smax-pwidth/4,smax-pwidth/4+pwidth/2+1)
+    if (s_S[0] < 0) | (s_S[-1] >= crosscor_s.shape[0]): return np.nan      # peak at edge of search
+    with np.errstate(divide='ignore',invalid='ignore'):
+        polycof = la.lstsq(np.vstack((s_S**2,s_S,np.ones_like(s_S))).T,crosscor_s[s_S])[0]
+        return -(-0.5*polycof[1]/polycof[0] - pwidth/2)
+
+def psf_rowshift(psf_orw,pshift,pwidth):
+    """psf shifted by pshift rows (|pshift| < pwidth), linearly interpolated"""
+    rows = psf_orw.shape[1]
+    s = int(pshift+pwidth)-pwidth
+    sfrac = pshift-s
+    psfsh_orw = np.zeros_like(psf_orw)
+    outrow = np.arange(max(0,s+1),rows-(1+int(abs(pshift)))+max(0,s+1))
+    psfsh_orw[:,outrow] = (1.-sfrac)*psf_orw[:,outrow-s] + sfrac*psf_orw[:,outrow-s-1]
+    return psfsh_orw
+
 # ---------------------------------------------------------------------------------------------
 def bkgsub(hdulist,badbinbkg_orc,isbkgcont_orc,skyflat_orc,maprow_ocd,tnum,debug=False):
     """
@@ -59,7 +259,7 @@ def bkgsub(hdulist,badbinbkg_orc,isbkgcont_orc,skyflat_orc,maprow_ocd,tnum,debug
     """
 
     sci_orc = np.copy(hdulist['SCI'].data)
-    wav_orc = hdulist['WAV'].data
+    wav_orc = getwavmap(hdulist)
 
     rows,cols = hdulist['SCI'].data.shape[1:3]
     cbin,rbin = np.array(hdulist[0].header["CCDSUM"].split(" ")).astype(int)
@@ -104,7 +304,8 @@ def bkgsub(hdulist,badbinbkg_orc,isbkgcont_orc,skyflat_orc,maprow_ocd,tnum,debug
     return target_orc
 
 
-def specpolextract(infilelist, logfile='salt.log', debug=False):
+def specpolextract(infilelist, logfile='salt.log', debug=False, scrunchcache=False, nworkers=1,
+        psfblock=0, confworkers=1, signalcache=False, quicklook=0, quickcheck=False):
     """Produce a 1-D extract spectra for the O and E beams
 
     This also cleans the 2-D spectra of a number of artifacts, removes the background, accounts for small 
@@ -118,243 +319,242 @@ def specpolextract(infilelist, logfile='salt.log', debug=False):
     logfile: str
         Name of file for logging
 
+    scrunchcache: bool
+        Keep the wavelength rebinning matrices in obsname_scrunch_[o].npz next to the input files,
+        to be reused when the same configuration is extracted again
+
+    nworkers: int
+        Number of processes for the per-image background subtraction and extraction
+
+    psfblock: int
+        If > 0, the psf row shift for guide errors is found separately for each block of psfblock
+        wavelength bins, following slow drifts along the spectrum.  0: one shift per image
+
+    confworkers: int
+        Number of processes for configurations, which are independent.  Output names and the
+        grouping of the log are as for the serial run.  With confworkers > 1, the images of each
+        configuration are done serially (nworkers is ignored)
+
+    signalcache: bool
+        Keep the specpolsignalmap outputs in obsname_signalmap.npz next to the input files, keyed
+        by a hash of the co-added image, so that a re-extraction of unchanged images (e.g. with
+        other extraction parameters) skips the signal map
+
+    quicklook: int
+        If > 1, the signal map (psf, skyflat, stray light masks) is found on the summed image
+        averaged over blocks of quicklook columns, for a fast approximate reduction while observing.
+        Experimental, until its speed and fidelity are measured on real data
+
+    quickcheck: bool
+        With quicklook, also compute the full resolution signal map and log how the quick-look
+        one differs from it, and the time saved
 
     """
 
     with logging(logfile, debug) as log:
  
         config_dict = list_configurations(infilelist, log)
-        config_count = 0
-
-        for config in config_dict:
-            outfilelist = config_dict[config]['object']
-            outfiles = len(outfilelist)
-            obs_dict=obslog(outfilelist)
-            hdu0 =  pyfits.open(outfilelist[0])       
-            rows,cols = hdu0['SCI'].data.shape[1:3]
-            cbin,rbin = np.array(obs_dict["CCDSUM"][0].split(" ")).astype(int)
-            object_name = hdu0[0].header['OBJECT']
-            log.message('\nExtract: {3}  Grating {0} Grang {1:6.2f}  Artic {2:6.2f}'.format(
-                        config[0], config[1], config[2], object_name))
-            log.message(' Images: '+ ' '.join([str(image_number(img)) for img in outfilelist]), with_header=False)
-
-            # special version for lamp data
-            # this is now removed and will not be part of this code
-            #object = obs_dict["OBJECT"][0].strip().upper()
-            #ampid = obs_dict["LAMPID"][0].strip().upper()
-            #f ((object != "ARC") & (lampid != "NONE")) :
-            #   specpollampextract(outfilelist, logfile=logfile)           
-            #   continue
-
-            # sum spectra to find target, background artifacts, and estimate sky flat and psf functions
-            count = 0
-            for i in range(outfiles):
-                badbin_orc = pyfits.open(outfilelist[i])['BPM'].data > 0
-                if count == 0: 
-                    count_orc = (~badbin_orc).astype(int)
-                    image_orc = pyfits.open(outfilelist[i])['SCI'].data*count_orc
-                    var_orc = pyfits.open(outfilelist[i])['VAR'].data*count_orc
-                else:
-                    count_orc += (~badbin_orc).astype(int)
-                    image_orc += pyfits.open(outfilelist[i])['SCI'].data*(~badbin_orc).astype(int)
-                    var_orc += pyfits.open(outfilelist[i])['VAR'].data*(~badbin_orc).astype(int)
-                count += 1
-            if count ==0:
-                print 'No valid images'
-                continue
-            image_orc[count_orc>0] /= count_orc[count_orc>0]
-            badbinall_orc = (count_orc==0) | (image_orc==0)             # bin is bad in all images
-            badbinone_orc = (count_orc < count) | (image_orc==0)        # bin is bad in at least one image
-            var_orc[count_orc>0] /= (count_orc[count_orc>0])**2
-
-            wav_orc = pyfits.open(outfilelist[0])['WAV'].data
-            slitid = obs_dict["MASKID"][0]
-            okwav_oc = ~((wav_orc == 0).all(axis=1))
-
-            obsname = object_name + "_c" + str(config_count)+"_"+str(outfiles)
-            hdusum = pyfits.PrimaryHDU(header=hdu0[0].header)   
-            hdusum = pyfits.HDUList(hdusum)
-            hdusum[0].header['OBJECT']=obsname
-            header=hdu0['SCI'].header.copy()       
-            hdusum.append(pyfits.ImageHDU(data=image_orc, header=header, name='SCI'))
-            hdusum.append(pyfits.ImageHDU(data=var_orc, header=header, name='VAR'))
-            hdusum.append(pyfits.ImageHDU(data=badbinall_orc.astype('uint8'), header=header, name='BPM'))
-            hdusum.append(pyfits.ImageHDU(data=wav_orc, header=header, name='WAV'))
-
-            
-            if debug: hdusum.writeto(obsname+".fits",clobber=True)
-
-            # run specpolsignalmap on image
-            psf_orc,skyflat_orc,badbinnew_orc,isbkgcont_orc,maprow_od,drow_oc = \
-                specpolsignalmap(hdusum,logfile=logfile,debug=debug)
-
-            maprow_ocd = maprow_od[:,None,:] + np.zeros((2,cols,4)) 
-            maprow_ocd[okwav_oc] += drow_oc[okwav_oc,None]      
-
-            isedge_orc = (np.arange(rows)[:,None] < maprow_ocd[:,None,:,0]) | \
-                (np.arange(rows)[:,None] > maprow_ocd[:,None,:,3])
-            istarget_orc = okwav_oc[:,None,:] & (np.arange(rows)[:,None] > maprow_ocd[:,None,:,1]) & \
-                (np.arange(rows)[:,None] < maprow_ocd[:,None,:,2])
-                                   
-            isbkgcont_orc &= (~badbinall_orc & ~isedge_orc & ~istarget_orc)
-            badbinall_orc |= badbinnew_orc
-            badbinone_orc |= badbinnew_orc
-            hdusum['BPM'].data = badbinnew_orc.astype('uint8')
-            psf_orc *= istarget_orc.astype(int)
-
-            if debug: 
+
+    # the _c<n> index counts configurations with object images, as before
+    arglist = []
+    config_count = 0
+    for config in config_dict:
+        if len(config_dict[config]['object']) == 0: continue
+        arglist.append((config, config_dict[config]['object'], config_count, scrunchcache, \
+            (nworkers if confworkers < 2 else 1), psfblock, debug, signalcache, quicklook, quickcheck))
+        config_count += 1
+    configpool(extract_config, arglist, nworkers=confworkers, logfile=logfile)
+
+    return
+
+def extract_config(config, outfilelist, config_count, scrunchcache=False, nworkers=1, psfblock=0,
+        debug=False, signalcache=False, quicklook=0, quickcheck=False, logfile='salt.log'):
+    """Extract the images of one configuration, see specpolextract
+
+    Parameters
+    ----------
+    config: tuple
+        configuration key from list_configurations: grating, grang, artic, ...
+
+    outfilelist: list
+        image files of the configuration
+
+    config_count: int
+        configuration index, for the _c<n> output names
+
+    """
+
+    with logging(logfile, debug) as log:
+        outfiles = len(outfilelist)
+        obs_dict=obslog(outfilelist)
+        # open (memory map) each image once, for both the sum and the extraction
+        hdulist_i = [pyfits.open(outfile, memmap=True) for outfile in outfilelist]
+        hdu0 =  hdulist_i[0]
+        rows,cols = hdu0['SCI'].data.shape[1:3]
+        cbin,rbin = np.array(obs_dict["CCDSUM"][0].split(" ")).astype(int)
+        object_name = hdu0[0].header['OBJECT']
+        log.message('\nExtract: {3}  Grating {0} Grang {1:6.2f}  Artic {2:6.2f}'.format(
+                    config[0], config[1], config[2], object_name))
+        log.message(' Images: '+ ' '.join([str(image_number(img)) for img in outfilelist]), with_header=False)
+
+        # special version for lamp data
+        # this is now removed and will not be part of this code
+        #object = obs_dict["OBJECT"][0].strip().upper()
+        #ampid = obs_dict["LAMPID"][0].strip().upper()
+        #f ((object != "ARC") & (lampid != "NONE")) :
+        #   specpollampextract(outfilelist, logfile=logfile)           
+        #   continue
+
+        # sum spectra to find target, background artifacts, and estimate sky flat and psf functions
+        #   accumulate in float64, whatever the image dtypes
+        count = 0
+        count_orc = np.zeros((2,rows,cols),dtype=int)
+        image_orc = np.zeros((2,rows,cols))
+        var_orc = np.zeros((2,rows,cols))
+        for i in range(outfiles):
+            okbin_orc = ~(hdulist_i[i]['BPM'].data > 0)
+            count_orc += okbin_orc
+            image_orc += hdulist_i[i]['SCI'].data*okbin_orc
+            var_orc += hdulist_i[i]['VAR'].data*okbin_orc
+            count += 1
+        if count ==0:
+            print 'No valid images'
+            return
+        image_orc[count_orc>0] /= count_orc[count_orc>0]
+        badbinall_orc = (count_orc==0) | (image_orc==0)             # bin is bad in all images
+        badbinone_orc = (count_orc < count) | (image_orc==0)        # bin is bad in at least one image
+        var_orc[count_orc>0] /= (count_orc[count_orc>0])**2
+
+        wav_orc = getwavmap(hdu0)
+        slitid = obs_dict["MASKID"][0]
+        okwav_oc = ~((wav_orc == 0).all(axis=1))
+
+        obsname = object_name + "_c" + str(config_count)+"_"+str(outfiles)
+        hdusum = pyfits.PrimaryHDU(header=hdu0[0].header)   
+        hdusum = pyfits.HDUList(hdusum)
+        hdusum[0].header['OBJECT']=obsname
+        header=hdu0['SCI'].header.copy()       
+        hdusum.append(pyfits.ImageHDU(data=image_orc, header=header, name='SCI'))
+        hdusum.append(pyfits.ImageHDU(data=var_orc, header=header, name='VAR'))
+        hdusum.append(pyfits.ImageHDU(data=badbinall_orc.astype('uint8'), header=header, name='BPM'))
+        hdusum.append(pyfits.ImageHDU(data=wav_orc, header=header, name='WAV'))
+
+        
+        if debug: hdusum.writeto(obsname+".fits",clobber=True)
+
+        # run specpolsignalmap on image, or reuse its cached result for the same image
+        if signalcache:
+            signalfile = os.path.join(os.path.dirname(os.path.abspath(outfilelist[0])), \
+                obsname+'_signalmap.npz')
+        else: signalfile = None
+        psf_orc,skyflat_orc,badbinnew_orc,isbkgcont_orc,maprow_od,drow_oc = \
+            specpolsignalmap_cached(hdusum,logfile=logfile,debug=debug,cachefile=signalfile,quicklook=quicklook, \
+                quickcheck=quickcheck)
+
+        maprow_ocd = maprow_od[:,None,:] + np.zeros((2,cols,4)) 
+        maprow_ocd[okwav_oc] += drow_oc[okwav_oc,None]      
+
+        isedge_orc = (np.arange(rows)[:,None] < maprow_ocd[:,None,:,0]) | \
+            (np.arange(rows)[:,None] > maprow_ocd[:,None,:,3])
+        istarget_orc = okwav_oc[:,None,:] & (np.arange(rows)[:,None] > maprow_ocd[:,None,:,1]) & \
+            (np.arange(rows)[:,None] < maprow_ocd[:,None,:,2])
+                               
+        isbkgcont_orc &= (~badbinall_orc & ~isedge_orc & ~istarget_orc)
+        badbinall_orc |= badbinnew_orc
+        badbinone_orc |= badbinnew_orc
+        hdusum['BPM'].data = badbinnew_orc.astype('uint8')
+        psf_orc *= istarget_orc.astype(int)
+
+        if debug: 
 #                hdusum.writeto(obsname+".fits",clobber=True)
-               pyfits.PrimaryHDU(psf_orc.astype('float32')).writeto(obsname+'_psf_orc.fits',clobber=True) 
+           pyfits.PrimaryHDU(psf_orc.astype('float32')).writeto(obsname+'_psf_orc.fits',clobber=True) 
 #               pyfits.PrimaryHDU(badbinnew_orc.astype('uint8')).writeto('badbinnew_orc.fits',clobber=True)   
 #               pyfits.PrimaryHDU(badbinall_orc.astype('uint8')).writeto('badbinall_orc.fits',clobber=True)  
 #               pyfits.PrimaryHDU(badbinone_orc.astype('uint8')).writeto('badbinone_orc.fits',clobber=True)  
 
-            # set up wavelength binning
-            wbin = wav_orc[0,rows/2,cols/2]-wav_orc[0,rows/2,cols/2-1] 
-            wbin = 2.**(np.rint(np.log2(wbin)))         # bin to nearest power of 2 angstroms
-            wmin = (wav_orc.max(axis=1)[okwav_oc].reshape((2,-1))).min(axis=1).max()
-            wmax = wav_orc.max()
-            for o in (0,1): 
-                colmax = np.where((wav_orc[o] > 0.).any(axis=0))[0][-1]
-                row_r = np.where(wav_orc[o,:,colmax] > 0.)[0]
-                wmax = min(wmax,wav_orc[o,row_r,colmax].min())
-            wedgemin = wbin*int(wmin/wbin+0.5) + wbin/2.
-            wedgemax = wbin*int(wmax/wbin-0.5) + wbin/2.
-            wedge_w = np.arange(wedgemin,wedgemax+wbin,wbin)
-            wavs = wedge_w.shape[0] - 1
-            binedge_orw = np.zeros((2,rows,wavs+1))
-            specrow_or = (maprow_od[:,1:3].mean(axis=1)[:,None] + np.arange(-rows/4,rows/4)).astype(int)
-
-            # scrunch and normalize psf from summed images (using badbinone) for optimized extraction
-            # psf is normalized so its integral over row is 1.
-            psfnormmin = 0.70    # wavelengths with less than this flux in good bins are marked bad
-            psf_orw = np.zeros((2,rows,wavs))
-
-            for o in (0,1):
-                for r in specrow_or[o]:
-                    binedge_orw[o,r] = \
-                        interp1d(wav_orc[o,r,okwav_oc[o]],np.arange(cols)[okwav_oc[o]], \
-                                   kind='linear',bounds_error=False)(wedge_w)
-                    psf_orw[o,r] = scrunch1d(psf_orc[o,r],binedge_orw[o,r])
-
-            if debug: 
-                pyfits.PrimaryHDU(binedge_orw.astype('float32')).writeto(obsname+'_binedge_orw.fits',clobber=True)
-                pyfits.PrimaryHDU(psf_orw.astype('float32')).writeto(obsname+'_psf_orw.fits',clobber=True)
-
-            psfnorm_orw = np.repeat(psf_orw.sum(axis=1),rows,axis=1).reshape(2,rows,-1)
-            psf_orw[psfnorm_orw>0.] /= psfnorm_orw[psfnorm_orw>0.]
-            pmax = np.minimum(1.,np.median(psf_orw[psfnorm_orw>0.].reshape((2,rows,-1)).max(axis=1)))
-
-            log.message('Stellar profile width: %8.2f arcsec' % ((1./pmax)*rbin/8.), with_header=False)     
-            pwidth = int(1./pmax)
-
-            if debug: 
-                pyfits.PrimaryHDU(psf_orw.astype('float32')).writeto(obsname+'_psfnormed_orw.fits',clobber=True)
-
-            # set up optional image-dependent column shift for slitless data
-            colshiftfilename = "colshift.txt"
-            docolshift = os.path.isfile(colshiftfilename)
-            if docolshift:
-                img_I,dcol_I = np.loadtxt(colshiftfilename,dtype=float,unpack=True,usecols=(0,1))
-                shifts = img_I.shape[0]
-                log.message('Column shift: \n Images '+shifts*'%5i ' % tuple(img_I), with_header=False)                 
-                log.message(' Bins    '+shifts*'%5.2f ' % tuple(dcol_I), with_header=False)                 
-
-            log.message('\nArcsec offset     Output File', with_header=False)                  
-
-            # background-subtract and extract spectra
-            for i in range(outfiles):
-                hdulist = pyfits.open(outfilelist[i])
-                tnum = image_number(outfilelist[i])
-                badbin_orc = (hdulist['BPM'].data > 0)
-                badbinbkg_orc = (badbin_orc | badbinnew_orc | isedge_orc | istarget_orc)
-                if debug:
-                    pyfits.PrimaryHDU(isedge_orc.astype('uint8')).writeto('isedge_orc_'+tnum+'.fits',clobber=True)
-                    pyfits.PrimaryHDU(istarget_orc.astype('uint8')).writeto('istarget_orc_'+tnum+'.fits',clobber=True) 
-                    pyfits.PrimaryHDU(badbinbkg_orc.astype('uint8')).writeto('badbinbkg_orc_'+tnum+'.fits',clobber=True)
-                target_orc = bkgsub(hdulist,badbinbkg_orc,isbkgcont_orc,skyflat_orc,maprow_ocd,tnum,debug=debug)
-                target_orc *= (~badbin_orc).astype(int)             
-                if debug:
-                    pyfits.PrimaryHDU(target_orc.astype('float32')).writeto('target_'+tnum+'_orc.fits',clobber=True)
-                var_orc = hdulist['var'].data
-                badbin_orc = (hdulist['bpm'].data > 0) | badbinnew_orc
-
-                # extract spectrum optimally (Horne, PASP 1986)
-                target_orw = np.zeros((2,rows,wavs))   
-                var_orw = np.zeros_like(target_orw)
-                badbin_orw = np.ones((2,rows,wavs),dtype='bool')   
-                wt_orw = np.zeros_like(target_orw)
-                dcol = 0.
-                if docolshift:
-                    if int(tnum) in img_I:
-                        dcol = dcol_I[np.where(img_I==int(tnum))]    # table has observed shift
-                for o in (0,1):
-                    for r in specrow_or[o]:
-                        target_orw[o,r] = scrunch1d(target_orc[o,r],binedge_orw[o,r]+dcol)
-                        var_orw[o,r] = scrunch1d(var_orc[o,r],binedge_orw[o,r]+dcol)
-                        badbin_orw[o,r] = scrunch1d(badbin_orc[o,r].astype(float),binedge_orw[o,r]+dcol) > 0.001 
-                badbin_orw |= (var_orw == 0)
-                badbin_orw |= ((psf_orw*(~badbin_orw)).sum(axis=1)[:,None,:] < psfnormmin)
-                if debug:
-#                   pyfits.PrimaryHDU(var_orw.astype('float32')).writeto('var_'+tnum+'_orw.fits',clobber=True)
-                    pyfits.PrimaryHDU(badbin_orw.astype('uint8')).writeto('badbin_'+tnum+'_orw.fits',clobber=True)
-  
-                # use master psf shifted in row to allow for guide errors
-                ok_w = ((psf_orw*badbin_orw).sum(axis=1) < 0.03/float(pwidth/2)).all(axis=0)
-                crosscor_s = np.zeros(pwidth)
-                for s in range(pwidth):
-                    crosscor_s[s] = (psf_orw[:,s:s-pwidth]*target_orw[:,pwidth/2:-pwidth/2]*ok_w).sum()
-                smax = np.argmax(crosscor_s)
-                s_S = np.arange(smax-pwidth/4,smax-pwidth/4+pwidth/2+1)
-                polycof = la.lstsq(np.vstack((s_S**2,s_S,np.ones_like(s_S))).T,crosscor_s[s_S])[0]
-                pshift = -(-0.5*polycof[1]/polycof[0] - pwidth/2)
-                s = int(pshift+pwidth)-pwidth
-                sfrac = pshift-s
-                psfsh_orw = np.zeros_like(psf_orw)
-                outrow = np.arange(max(0,s+1),rows-(1+int(abs(pshift)))+max(0,s+1))
-                psfsh_orw[:,outrow] = (1.-sfrac)*psf_orw[:,outrow-s] + sfrac*psf_orw[:,outrow-s-1]
-#                pyfits.PrimaryHDU(psfsh_orw.astype('float32')).writeto('psfsh_'+tnum+'_orw.fits',clobber=True)
-
-                wt_orw[~badbin_orw] = psfsh_orw[~badbin_orw]/var_orw[~badbin_orw]
-                var_ow = (psfsh_orw*wt_orw*(~badbin_orw)).sum(axis=1)
-                badbin_ow = (var_ow == 0)
-                var_ow[~badbin_ow] = 1./var_ow[~badbin_ow]
-#                pyfits.PrimaryHDU(var_ow.astype('float32')).writeto('var_'+tnum+'_ow.fits',clobber=True)
-#                pyfits.PrimaryHDU(target_orw.astype('float32')).writeto('target_'+tnum+'_orw.fits',clobber=True)
-#                pyfits.PrimaryHDU(wt_orw.astype('float32')).writeto('wt_'+tnum+'_orw.fits',clobber=True)
-
-                sci_ow = (target_orw*wt_orw).sum(axis=1)*var_ow
-
-                badlim = 0.20
-                psfbadfrac_ow = (psfsh_orw*badbin_orw.astype(int)).sum(axis=1)/psfsh_orw.sum(axis=1)
-                badbin_ow |= (psfbadfrac_ow > badlim)
-
-                cdebug = 83
-                if debug: np.savetxt("xtrct"+str(cdebug)+"_"+tnum+".txt",np.vstack((psf_orw[:,:,cdebug],var_orw[:,:,cdebug], \
-                    wt_orw[:,:,cdebug],target_orw[:,:,cdebug])).reshape((4,2,-1)).transpose(1,0,2).reshape((8,-1)).T,fmt="%12.5e")
-
-            # write O,E spectrum, prefix "s". VAR, BPM for each spectrum. y dim is virtual (length 1)
-            # for consistency with other modes
-                hduout = pyfits.PrimaryHDU(header=hdulist[0].header)    
-                hduout = pyfits.HDUList(hduout)
-                header=hdulist['SCI'].header.copy()
-                header.update('VAREXT',2)
-                header.update('BPMEXT',3)
-                header.update('CRVAL1',wedge_w[0]+wbin/2.)
-                header.update('CRVAL2',0)
-                header.update('CDELT1',wbin)
-                header.update('CTYPE1','Angstroms')
-            
-                hduout.append(pyfits.ImageHDU(data=sci_ow.reshape((2,1,wavs)), header=header, name='SCI'))
-                header.update('SCIEXT',1,'Extension for Science Frame',before='VAREXT')
-                hduout.append(pyfits.ImageHDU(data=var_ow.reshape((2,1,wavs)), header=header, name='VAR'))
-                hduout.append(pyfits.ImageHDU(data=badbin_ow.astype("uint8").reshape((2,1,wavs)), header=header, name='BPM'))            
-            
-                hduout.writeto('e'+outfilelist[i],clobber=True,output_verify='warn')
-                log.message('  %8.2f   e%s' % (pshift*rbin/8.,outfilelist[i]), with_header=False)
-
-            #increate the config count
-            config_count += 1
+        # set up wavelength binning
+        wbin = wav_orc[0,rows/2,cols/2]-wav_orc[0,rows/2,cols/2-1] 
+        wbin = 2.**(np.rint(np.log2(wbin)))         # bin to nearest power of 2 angstroms
+        wmin = (wav_orc.max(axis=1)[okwav_oc].reshape((2,-1))).min(axis=1).max()
+        wmax = wav_orc.max()
+        for o in (0,1): 
+            colmax = np.where((wav_orc[o] > 0.).any(axis=0))[0][-1]
+            row_r = np.where(wav_orc[o,:,colmax] > 0.)[0]
+            wmax = min(wmax,wav_orc[o,row_r,colmax].min())
+        wedgemin = wbin*int(wmin/wbin+0.5) + wbin/2.
+        wedgemax = wbin*int(wmax/wbin-0.5) + wbin/2.
+        wedge_w = np.arange(wedgemin,wedgemax+wbin,wbin)
+        wavs = wedge_w.shape[0] - 1
+        binedge_orw = np.zeros((2,rows,wavs+1))
+        specrow_or = (maprow_od[:,1:3].mean(axis=1)[:,None] + np.arange(-rows/4,rows/4)).astype(int)
+
+        # scrunch and normalize psf from summed images (using badbinone) for optimized extraction
+        # psf is normalized so its integral over row is 1.
+        psfnormmin = 0.70    # wavelengths with less than this flux in good bins are marked bad
+        psf_orw = np.zeros((2,rows,wavs))
+
+        scrunch_oXA = []
+        for o in (0,1):
+            binedge_orw[o,specrow_or[o]] = \
+                interprows(wav_orc[o][specrow_or[o]][:,okwav_oc[o]],np.arange(cols)[okwav_oc[o]], \
+                               wedge_w,bounds_error=False)
+            if scrunchcache:
+                scrunchfile = os.path.join(os.path.dirname(os.path.abspath(outfilelist[0])), \
+                    obsname+'_scrunch_'+str(o)+'.npz')
+            else: scrunchfile = None
+            scrunch_oXA.append(scrunchmatrix_cached(binedge_orw[o,specrow_or[o]],cols,scrunchfile))
+            psf_orw[o,specrow_or[o]] = scrunch2d(psf_orc[o,specrow_or[o]],scrunch_XA=scrunch_oXA[o])
+
+        if debug: 
+            pyfits.PrimaryHDU(binedge_orw.astype('float32')).writeto(obsname+'_binedge_orw.fits',clobber=True)
+            pyfits.PrimaryHDU(psf_orw.astype('float32')).writeto(obsname+'_psf_orw.fits',clobber=True)
+
+        psfnorm_orw = np.repeat(psf_orw.sum(axis=1),rows,axis=1).reshape(2,rows,-1)
+        psf_orw[psfnorm_orw>0.] /= psfnorm_orw[psfnorm_orw>0.]
+        pmax = np.minimum(1.,np.median(psf_orw[psfnorm_orw>0.].reshape((2,rows,-1)).max(axis=1)))
+
+        log.message('Stellar profile width: %8.2f arcsec' % ((1./pmax)*rbin/8.), with_header=False)     
+        pwidth = int(1./pmax)
+
+        if debug: 
+            pyfits.PrimaryHDU(psf_orw.astype('float32')).writeto(obsname+'_psfnormed_orw.fits',clobber=True)
+
+        # set up optional image-dependent column shift for slitless data
+        colshiftfilename = "colshift.txt"
+        docolshift = os.path.isfile(colshiftfilename)
+        if docolshift:
+            img_I,dcol_I = np.loadtxt(colshiftfilename,dtype=float,unpack=True,usecols=(0,1))
+            shifts = img_I.shape[0]
+            log.message('Column shift: \n Images '+shifts*'%5i ' % tuple(img_I), with_header=False)                 
+            log.message(' Bins    '+shifts*'%5.2f ' % tuple(dcol_I), with_header=False)                 
+
+        log.message('\nArcsec offset     Output File', with_header=False)                  
+
+        # background-subtract and extract spectra, optionally over a pool of processes.
+        #   log lines are written in image order
+        extractshared.clear()
+        extractshared.update(outfilelist=outfilelist, badbinnew_orc=badbinnew_orc, isedge_orc=isedge_orc,
+            istarget_orc=istarget_orc, isbkgcont_orc=isbkgcont_orc, skyflat_orc=skyflat_orc,
+            maprow_ocd=maprow_ocd, rows=rows, cols=cols, wavs=wavs, rbin=rbin, docolshift=docolshift,
+            img_I=(img_I if docolshift else None), dcol_I=(dcol_I if docolshift else None),
+            specrow_or=specrow_or, binedge_orw=binedge_orw, scrunch_oXA=scrunch_oXA, psf_orw=psf_orw,
+            psfnormmin=psfnormmin, pwidth=pwidth, wedge_w=wedge_w, wbin=wbin, psfblock=psfblock, debug=debug)
+        try:
+            if (nworkers > 1) & (outfiles > 1):
+                pool = Pool(min(nworkers,outfiles))
+                try:
+                    msglist = pool.map(extract_image, range(outfiles), chunksize=1)
+                    pool.close()
+                finally:
+                    pool.terminate()
+                    pool.join()
+                for msg in msglist: log.message(msg, with_header=False)
+            else:
+                for i in range(outfiles):
+                    log.message(extract_image(i,hdulist_i[i]), with_header=False)
+        finally:
+            extractshared.clear()
+            for hdulist in hdulist_i: hdulist.close()
 
     return
 
@@ -16,7 +16,8 @@ from scipy.ndimage.interpolation import shift
 import reddir
 datadir = os.path.dirname(inspect.getfile(reddir))+"/data/"
 
-from scrunch1d import scrunch1d
+from scrunch1d import scrunch2d, scrunchmatrix
+from specpolutils import getwavmap, interprows
 from pyraf import iraf
 from iraf import pysalt
 from saltobslog import obslog
@@ -40,7 +41,7 @@ def specpollampextract(infilelist, logfile='salt.log'):
         cbin,rbin = np.array(obsdict["CCDSUM"][0].split(" ")).astype(int)
         slitid = obsdict["MASKID"][0]
         lampid = obsdict["LAMPID"][0].strip().upper()
-        lam_c = hdu0['WAV'].data[0,rows/2]
+        lam_c = getwavmap(hdu0,r_r=np.array([rows/2]))[0,0]
         files = len(infilelist)
         outfilelist = infilelist
 
@@ -65,7 +66,7 @@ def specpollampextract(infilelist, logfile='salt.log'):
         badbin_orc = (count_orc==0) | (image_orc==0)
         okbinpol_orc = (count_orc == count) & (image_orc != 0)    # conservative bpm for pol extraction
         var_orc[count_orc>0] /= count_orc[count_orc>0]**2
-        wav_orc = pyfits.open(outfilelist[0])['WAV'].data
+        wav_orc = getwavmap(pyfits.open(outfilelist[0]))
 #        pyfits.PrimaryHDU(image_orc.astype('float32')).writeto('lampsum_orc.fits',clobber=True)            
 
         lam_m = np.loadtxt(datadir+"wollaston.txt",dtype=float,usecols=(0,))
@@ -121,9 +122,8 @@ def specpollampextract(infilelist, logfile='salt.log'):
             drow2_c = np.polyval(np.polyfit(np.where(okprof_oc[o])[0],drow1_c[okprof_oc[o]],3),(range(cols)))
             okprof_orc[o] = (np.abs(drow2_c - drow1_c) < 3) & okprof_oc[o][None,:]
             drow_oc[o] = -(expectrow_oc[o] - expectrow_oc[o,cols/2] + drow2_c -drow2_c[cols/2])
-            for r in range(rows):
-                norm_orc[o,r] = interp1d(wav_orc[o,trow_o[o],okprof_oc[o]],maxval_oc[o,okprof_oc[o]], \
-                    bounds_error = False, fill_value=0.)(wav_orc[o,r])
+            norm_orc[o] = interprows(wav_orc[o,trow_o[o],okprof_oc[o]],maxval_oc[o,okprof_oc[o]],wav_orc[o], \
+                    bounds_error = False, fill_value=0.)
 
         log.message('Image tilt: %8.1f arcmin' % (60.*np.degrees(rowtilt*rbin/cbin)), with_header=False)        
         log.message('Target offset:     O    %4i     E    %4i' % tuple(drow_o), with_header=False)
@@ -228,11 +228,15 @@ def specpollampextract(infilelist, logfile='salt.log'):
         badbin_orc = ~okbinpol_orc 
         binedge_orw = np.zeros((2,rows,wavs+1))
         badbin_orw = np.ones((2,rows,wavs),dtype=bool); nottarg_orw = np.ones_like(badbin_orw)
+        scrunchlist = []
         for o in (0,1):
-            for r in range(edgerow_doc[0,o].min(),edgerow_doc[1,o].max()):
-                binedge_orw[o,r] = interp1d(wav_orc[o,r],np.arange(cols))(wedge_w)
-                badbin_orw[o,r] = (scrunch1d(badbin_orc[o,r].astype(int),binedge_orw[o,r]) > 0.)
-                nottarg_orw[o,r] = (scrunch1d((~istarg_orc[o,r]).astype(int),binedge_orw[o,r]) > 0.)                
+            row_R = np.arange(edgerow_doc[0,o].min(),edgerow_doc[1,o].max())
+            binedge_orw[o,row_R] = interprows(wav_orc[o,row_R],np.arange(cols),wedge_w)
+            scrunchlist.append((row_R,scrunchmatrix(binedge_orw[o,row_R],cols)))
+            badbin_Rw,nottarg_Rw = scrunch2d([badbin_orc[o,row_R].astype(int), \
+                (~istarg_orc[o,row_R]).astype(int)],scrunch_XA=scrunchlist[o][1])
+            badbin_orw[o,row_R] = (badbin_Rw > 0.)
+            nottarg_orw[o,row_R] = (nottarg_Rw > 0.)
         okbin_orw = ~badbin_orw
         istarg_orw = ~nottarg_orw
 
@@ -261,9 +265,9 @@ def specpollampextract(infilelist, logfile='salt.log'):
         # extract spectrum 
             target_orw = np.zeros((2,rows,wavs));   var_orw = np.zeros_like(target_orw)
             for o in (0,1):
-                for r in range(edgerow_doc[0,o].min(),edgerow_doc[1,o].max()):
-                    target_orw[o,r] = scrunch1d(target_orc[o,r],binedge_orw[o,r])
-                    var_orw[o,r] = scrunch1d(var_orc[o,r],binedge_orw[o,r])
+                row_R,scrunch_XA = scrunchlist[o]
+                target_orw[o,row_R],var_orw[o,row_R] = \
+                    scrunch2d([target_orc[o,row_R],var_orc[o,row_R]],scrunch_XA=scrunch_XA)
   
         # columns with negative extracted intensity are marked as bad
             sci_ow = (target_orw*okbin_orw).sum(axis=1)
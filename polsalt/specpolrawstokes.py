@@ -65,7 +65,9 @@ def specpolrawstokes(infilelist, logfile='salt.log', debug=False):
         log.message('specpolrawstokes version: 20191111', with_header=False) 
      
         # create the observation log
-        obs_dict = obslog(list(infilelist))         # ensure infilelist not altered by obs_dict
+        obs_dict = obslog(list(infilelist), \
+            indexfile=os.path.join(os.path.dirname(infilelist[0]),'obslog_index.json'))
+                                                    # ensure infilelist not altered by obs_dict
         images = len(infilelist)
         hsta_i = np.array([int(round(s/11.25)) for s in np.array(obs_dict['HWP-ANG']).astype(float)])
         qsta_i = np.array([int(round(s)) for s in np.array(obs_dict['QWP-STA'])])
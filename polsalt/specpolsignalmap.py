@@ -5,22 +5,24 @@ specpolsignalmap
 Find Second order, Littrow ghost
 Find sky lines and produce sky flat for 2d sky subtraction
 Make smoothed psf eighting factor for optimized extraction
+Quick-look version on an image averaged over column blocks
 
 """
 
-import os, sys, glob, shutil, inspect
+import os, sys, glob, shutil, inspect, hashlib, time
 
 import numpy as np
 import pyfits
 from scipy.interpolate import interp1d
-from scipy.ndimage.interpolation import shift
 from scipy.ndimage import convolve1d
 from scipy import linalg as la
 
 import reddir
 datadir = os.path.dirname(inspect.getfile(reddir))+"/data/"
 
-from oksmooth import boxsmooth1d,blksmooth2d
+from oksmooth import boxsmooth,blksmooth2d
+from specpolutils import colshift, getwavmap, interprows
+from specpolstray import ghostkernel, maskedmedian, littrowmap
 from pyraf import iraf
 from iraf import pysalt
 from saltobslog import obslog
@@ -129,13 +131,19 @@ def skyflat(hdu,trow_o,corerows,axisrow_o,log,datadir,debug=False):
     wav_w = np.arange(wavmin,wavmax,dwav)
     wavs = wav_w.shape[0]
     argwav_oyc = ((wav_oyc-wavmin)/dwav).astype(int)
-    gapwav_W = wav_oyc[:,:,isgap_c][wav_oyc[:,:,isgap_c]>0]    # wavelengths in gap somewhere in image
+    gapwav_W = np.sort(wav_oyc[:,:,isgap_c][wav_oyc[:,:,isgap_c]>0])    # wavelengths in gap somewhere in image
+  # gap wavelength bins: nearest gap wavelength (the sorted neighbors) within half a bin 
     isgap_w = np.zeros((wavs),dtype=bool)
-    for w in range(wavs): 
-        if (np.abs(wav_w[w] - gapwav_W).min()) < dwav/2.: isgap_w[w] = True
+    if gapwav_W.shape[0]:
+        W_w = np.searchsorted(gapwav_W,wav_w)
+        dgap_w = np.minimum(np.abs(wav_w - gapwav_W[np.maximum(W_w-1,0)]),    \
+                            np.abs(wav_w - gapwav_W[np.minimum(W_w,gapwav_W.shape[0]-1)]))
+        isgap_w = (dgap_w < dwav/2.)
     wavhist_ow = np.zeros((2,wavs))
     for o in (0,1): 
-        wavhist_ow[o] = (argwav_oyc[o,isline_oyc[o]][:,None] == np.arange(wavs)).sum(axis=0)
+        argwav_W = argwav_oyc[o,isline_oyc[o]]
+        argwav_W = argwav_W[(argwav_W >= 0) & (argwav_W < wavs)]
+        wavhist_ow[o] = np.bincount(argwav_W,minlength=wavs)
     wavhist_ow[:,isgap_w] = -1
 
     if debug: 
@@ -149,25 +157,27 @@ def skyflat(hdu,trow_o,corerows,axisrow_o,log,datadir,debug=False):
     thresh = rows
     argwav_l = np.flatnonzero((wavhist_ow[:,:-1].sum(axis=0) < thresh) \
                             & (wavhist_ow[:,1:].sum(axis=0) >= thresh)) + 1
-    argwav_ld = np.zeros((argwav_l.shape[0],2),dtype=int)
-    lines = 0
-    argwavlast = 0.
     gapclear = 3
 
-    for l in range(argwav_l.shape[0]):
-        argwav_ld[lines,0] = argwav_l[l] - \
-            np.argmax(wavhist_ow[:,argwav_l[l]:0:-1].sum(axis=0) < thresh/2.) + 1
-        argwav_ld[lines,1] = argwav_l[l] + \
-            np.argmax(wavhist_ow[:,argwav_l[l]:].sum(axis=0) < thresh/2.) - 1
-      # ignore multiple peaks of same line
-        if (argwav_ld[lines].mean() == argwavlast): continue
-        argwavlast = argwav_ld[lines].mean()
-      # ignore lines running into gaps
-        da_dW = argwav_ld[lines,:,None] - ((wav_w[isgap_w] - wavmin)/dwav).astype(int)
-        clearance_d = np.array([da_dW[0,da_dW[0]>0].min(),-da_dW[1,da_dW[1]<0].max()])
-        if (clearance_d.min()<=gapclear): continue
-        lines += 1
-    argwav_ld = argwav_ld[:lines]
+  # edges: last bin below 25% before the peak (not bin 0), first after it.  If none, peak +/- 1
+    arg_w = np.arange(wavs)
+    islow_w = (wavhist_ow.sum(axis=0) < thresh/2.)
+    lastlow_w = np.maximum.accumulate(np.where(islow_w & (arg_w > 0),arg_w,-1))
+    nextlow_w = np.minimum.accumulate(np.where(islow_w,arg_w,wavs)[::-1])[::-1]
+    argwav_ld = np.zeros((argwav_l.shape[0],2),dtype=int)
+    argwav_ld[:,0] = np.where(lastlow_w[argwav_l] > 0,lastlow_w[argwav_l],argwav_l) + 1
+    argwav_ld[:,1] = np.where(nextlow_w[argwav_l] < wavs,nextlow_w[argwav_l],argwav_l) - 1
+
+  # ignore multiple peaks of same line
+    argwavmean_l = argwav_ld.mean(axis=1)
+    isline_l = (argwavmean_l != np.append(0.,argwavmean_l[:-1]))
+  # ignore lines running into gaps: nearest gap below and above (sentinels if none: side is clear)
+    arggap_W = np.hstack((-2*wavs,((wav_w[isgap_w] - wavmin)/dwav).astype(int),3*wavs))
+    clearance_dl = np.array([argwav_ld[:,0] - arggap_W[np.searchsorted(arggap_W,argwav_ld[:,0])-1], \
+                arggap_W[np.searchsorted(arggap_W,argwav_ld[:,1],side='right')] - argwav_ld[:,1]])
+    isline_l &= (clearance_dl.min(axis=0) > gapclear)
+    argwav_ld = argwav_ld[isline_l]
+    lines = argwav_ld.shape[0]
   # make lines at least as wide as 75% of the central slitwidth
     wav_l = 0.5*(wav_w[argwav_ld[:,0]]+wav_w[argwav_ld[:,1]])
     dwav_l = np.maximum(dwav*(argwav_ld[:,1] - argwav_ld[:,0]), \
@@ -177,10 +187,12 @@ def skyflat(hdu,trow_o,corerows,axisrow_o,log,datadir,debug=False):
                              
   # Make row,col map of line locations.  
   # Compute intensity profile and fit to polynomial  
-    dwav_loyc = np.abs(wav_oyc - wav_l[:,None,None,None])*(okprof_oyc)+1.e9*((~okprof_oyc).astype(int))
-    dwav_loy = dwav_loyc.min(axis=-1)
-    col_loy = np.argmin(dwav_loyc,axis=-1).astype(int)
-    col_loy[dwav_loy > dwav] = 0
+  # one line at a time, keeping memory to the image size
+    col_loy = np.zeros((lines,2,rows),dtype=int)
+    for l in range(lines):
+        dwav_oyc = np.abs(wav_oyc - wav_l[l])*(okprof_oyc)+1.e9*((~okprof_oyc).astype(int))
+        col_loy[l] = np.argmin(dwav_oyc,axis=-1)
+        col_loy[l][dwav_oyc.min(axis=-1) > dwav] = 0
     dcol_l = dwav_l/(wav_oyc[0,rows/2,col_loy[:,0,rows/2]+1]-wav_oyc[0,rows/2,col_loy[:,0,rows/2]])
         
     line_oyc = -1*np.ones((2,rows,cols),dtype=int)
@@ -244,7 +256,7 @@ def skyflat(hdu,trow_o,corerows,axisrow_o,log,datadir,debug=False):
     if masklines>0:                                        
         wav_m = wav_l[line_m]
         okneb_oy = (np.abs(np.arange(rows) - trow_o[:,None]) < rows/6)                             
-        badbinmore_oyc |= ~okneb_oy[:,:,None] & (line_oyc == line_m[:,None,None,None]).any(axis=0)
+        badbinmore_oyc |= ~okneb_oy[:,:,None] & np.in1d(line_oyc,line_m).reshape((2,rows,cols))
 
         log.message(('Nebula partial mask:   '+masklines*'%6.1f '+' Ang') \
                     % tuple(wav_m), with_header=False)
@@ -305,7 +317,7 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
         sci_orc = hdu['sci'].data.copy()
         var_orc = hdu['var'].data.copy()
         badbin_orc = (hdu['bpm'].data > 0)
-        wav_orc = hdu['wav'].data.copy()
+        wav_orc = getwavmap(hdu).copy()
 
         lam_m = np.loadtxt(datadir+"wollaston.txt",dtype=float,usecols=(0,))
         rpix_om = np.loadtxt(datadir+"wollaston.txt",dtype=float,unpack=True,usecols=(1,2))
@@ -364,15 +376,12 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
             drow2_c = np.polyval(np.polyfit(np.where(okprof_c)[0],drow1_c[okprof_c],3),(range(cols)))
 #            if debug: np.savetxt(sciname+"_drow2_c_"+str(o)+".txt",drow2_c,fmt="%8.3f")
             okprof_c[okwav_c] &= np.abs(drow2_c - drow1_c)[okwav_c] < 3
-            norm_rc = np.zeros((rows,cols));    normsm_rc = np.zeros((rows,cols))
-            for r in range(rows):
-                norm_rc[r] = interp1d(wav_orc[o,trow_o[o],okprof_c],maxval_oc[o,okprof_c], \
-                    bounds_error = False, fill_value=0.)(wav_orc[o,r])
+            norm_rc = interprows(wav_orc[o,trow_o[o],okprof_c],maxval_oc[o,okprof_c],wav_orc[o], \
+                    bounds_error = False, fill_value=0.)
             okprof_rc = (norm_rc != 0.)
 
         # make a slitwidth smoothed norm and profile for the background area
-            for r in range(rows):
-                normsm_rc[r] = boxsmooth1d(norm_rc[r],okprof_rc[r],(8.*slitwidth*profsmoothfac)/cbin,0.5)
+            normsm_rc = boxsmooth(norm_rc,okprof_rc,(8.*slitwidth*profsmoothfac)/cbin,0.5)
             okprofsm_rc = (normsm_rc != 0.)
             profile_orc[o,okprof_rc] = sci_orc[o,okprof_rc]/norm_rc[okprof_rc]
             profilesm_orc[o,okprofsm_rc] = sci_orc[o,okprofsm_rc]/normsm_rc[okprofsm_rc]
@@ -380,12 +389,9 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
             drow_oc[o] = (expectrow_oc[o] - expectrow_oc[o,cols/2] + drow2_c -drow2_c[cols/2])
 
         # take out profile spatial curvature and tilt (r -> y)
-            for c in range(cols):
-                profile_oyc[o,:,c] = shift(profile_orc[o,:,c],-drow_oc[o,c],order=1)
-                profilesm_oyc[o,:,c] = shift(profilesm_orc[o,:,c],-drow_oc[o,c],order=1)
-                badbin_oyc[o,:,c] = shift(badbin_orc[o,:,c].astype(int),-drow_oc[o,c],cval=1,order=1) > 0.1
-                var_oyc[o,:,c] = shift(var_orc[o,:,c],-drow_oc[o,c],order=1)
-                wav_oyc[o,:,c] = shift(wav_orc[o,:,c],-drow_oc[o,c],order=1)
+            profile_oyc[o],profilesm_oyc[o],var_oyc[o],wav_oyc[o] = colshift(  \
+                [profile_orc[o],profilesm_orc[o],var_orc[o],wav_orc[o]],-drow_oc[o])
+            badbin_oyc[o] = colshift(badbin_orc[o].astype(int),-drow_oc[o],cval=1) > 0.1
             okprof_oyc[o] = ~badbin_oyc[o] & okprof_rc
             okprofsm_oyc[o] = ~badbin_oyc[o] & okprofsm_rc
         wav_oyc[:,1:rows-1] *= np.logical_not((wav_oyc[:,1:rows-1]>0) & \
@@ -430,10 +436,7 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
                         profile_oy[1,trow_o[1]-16:trow_o[1]+17])
         profile_Y = interp1d(np.arange(-16.,17.),profile_Y,kind='cubic')(np.arange(-16.,16.,1./16))
         fwhm = 3.*(np.argmax(profile_Y[256:]<0.5) + np.argmax(profile_Y[256:0:-1]<0.5))/16.
-        kernelcenter = np.ones(np.around(fwhm/2)*2+2)
-        kernelbkg = np.ones(kernelcenter.shape[0]+4)
-        kernel = -kernelbkg*kernelcenter.sum()/(kernelbkg.sum()-kernelcenter.sum())
-        kernel[2:-2] = kernelcenter                # ghost search kernel is size of 3*fwhm and sums to zero
+        kernel,kernelbkg = ghostkernel(fwhm)        # ghost search kernel is size of 3*fwhm and sums to zero
 
     # First, look for second order as feature in spatial direction
         ghost_oyc = convolve1d(profilesm_oyc,kernel,axis=1,mode='constant',cval=0.)
@@ -471,8 +474,8 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
                 row2nd_C = np.around(trow_o[o] + (interp1d(lam_m,rpix_om[o],kind='cubic')(lam_c[col_C]/2.)  \
                     - interp1d(lam_m,rpix_om[o],kind='cubic')(lam_c[col_C]))/rbin).astype(int)
                 row2nd_oYC[o] = row2nd_C + boxrange[:,None]
-                for y in np.arange(edgerow_od[o,0],edgerow_od[o,1]+1):
-                    profile_oy[o,y] = np.median(profilesm_oyc[o,y,okprof_oyc[o,y,:]])
+                y0,y1 = edgerow_od[o].astype(int)
+                profile_oy[o,y0:y1+1] = maskedmedian(profilesm_oyc[o,y0:y1+1],okprof_oyc[o,y0:y1+1])
                 dprofile_yc = profilesm_oyc[o] - profile_oy[o,:,None]
                 is2nd_oyc[o][row2nd_oYC[o],col_C] = \
                     (dprofile_yc[row2nd_oYC[o],col_C] > 5.*np.sqrt(var_oyc[o][row2nd_oYC[o],col_C]))
@@ -501,22 +504,15 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
         row_oY = np.add.outer(trow_o,np.arange(Rows)-(Rows+1)/2).astype(int)
         ghost_Yc = 0.5*ghost_oyc[np.arange(2)[:,None],row_oY,:].sum(axis=0) 
         isbadghost_Yc = isbadghost_oyc[np.arange(2)[:,None],row_oY,:].any(axis=0)
-        stdghost_c = np.std(ghost_Yc,axis=0)
         profile_Yc = 0.5*profilesm_oyc[np.arange(2)[:,None],row_oY,:].sum(axis=0) 
         okprof_Yc = okprof_oyc[np.arange(2)[:,None],row_oY,:].all(axis=0)               
                     
     # Search for Littrow ghost as undispersed object off target
     # Convolve with ghost kernal in spectral direction, divide by standard deviation, 
     #  then add up those > 10 sigma within fwhm box
-        isbadlitt_Yc = isbadghost_Yc | \
-            (convolve1d(isbadghost_Yc.astype(int),kernelbkg,axis=1,mode='constant',cval=1) != 0)
-        litt_Yc = convolve1d(ghost_Yc,kernel,axis=-1,mode='constant',cval=0.)*(~isbadlitt_Yc).astype(int)
-        litt_Yc[:,stdghost_c>0] /= stdghost_c[stdghost_c>0]
-        litt_Yc[litt_Yc < 10.] = 0.
-        for c in range(cols):
-            litt_Yc[:,c] = np.convolve(litt_Yc[:,c],np.ones(boxbins))[boxbins/2:boxbins/2+Rows] 
-        for Y in range(Rows):
-            litt_Yc[Y] = np.convolve(litt_Yc[Y],np.ones(boxbins))[boxbins/2:boxbins/2+cols] 
+    #  Box sums are exact (see littrowmap), so of boxes with equal sums the first is taken.  The former
+    #  float box sums broke such ties by rounding, so the box found may then be one bin from before
+        litt_Yc = littrowmap(ghost_Yc,isbadghost_Yc,kernel,kernelbkg,boxbins)
         Rowlitt,collitt = np.argwhere(litt_Yc == litt_Yc[:col2nd0].max())[0]
         littbox_Yc = np.meshgrid(boxrange+Rowlitt,boxrange+collitt)
 
@@ -529,9 +525,10 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
         if litt_Yc[Rowlitt,collitt] > 100:
             islitt_oyc = np.zeros((2,rows,cols),dtype=bool)
             for o in (0,1):
-                for y in np.arange(edgerow_od[o,0],edgerow_od[o,1]+1):
-                    if profilesm_oyc[o,y,okprof_oyc[o,y,:]].shape[0] == 0: continue
-                    profile_oy[o,y] = np.median(profilesm_oyc[o,y,okprof_oyc[o,y]])
+                y0,y1 = edgerow_od[o].astype(int)
+                okrow_y = okprof_oyc[o,y0:y1+1].any(axis=1)
+                profile_oy[o,y0:y1+1][okrow_y] = \
+                    maskedmedian(profilesm_oyc[o,y0:y1+1],okprof_oyc[o,y0:y1+1])[okrow_y]
                 dprofile_yc = profilesm_oyc[o] - profile_oy[o,:,None]
                 littbox_yc = np.meshgrid(boxrange+Rowlitt-Rows/2+trow_o[o],boxrange+collitt)
                 islitt_oyc[o][littbox_yc] =  \
@@ -552,7 +549,7 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
         okprof_Yc = okprof_oyc[np.arange(2)[:,None],row_oY,:].all(axis=0)
         okprof_Y = okprof_Yc.any(axis=1)
         profile_Y = np.zeros(Rows,dtype='float32')
-        for Y in np.where(okprof_Y)[0]: profile_Y[Y] = np.median(profile_Yc[Y,okprof_Yc[Y]])
+        profile_Y[okprof_Y] = maskedmedian(profile_Yc,okprof_Yc)[okprof_Y]
         avoid = int(np.around(fwhm/2)) +5
         okprof_Y[range(avoid) + range(Rows/2-avoid,Rows/2+avoid) + range(Rows-avoid,Rows)] = False
         nbr_Y = convolve1d(profile_Y,kernel,mode='constant',cval=0.)
@@ -626,10 +623,9 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
             
             profile_oyc[o] = blksmooth2d(profile_oyc[o],(okprof_oyc[o] & ~isline_oyc[o]),   \
                         rblk,cblk,0.25,mode='mean')              
-            for c in range(cols):
-                psf_orc[o,:,c] = shift(profile_oyc[o,:,c],drow_oc[o,c],cval=0,order=1)
-                isbkgcont_orc[o,:,c] = shift(isbkgcont_oyc[o,:,c].astype(int),drow_oc[o,c],cval=0,order=1) > 0.1
-                badbinnew_orc[o,:,c] = shift(badbinnew_oyc[o,:,c].astype(int),drow_oc[o,c],cval=1,order=1) > 0.1
+            psf_orc[o] = colshift(profile_oyc[o],drow_oc[o])
+            isbkgcont_orc[o] = colshift(isbkgcont_oyc[o].astype(int),drow_oc[o]) > 0.1
+            badbinnew_orc[o] = colshift(badbinnew_oyc[o].astype(int),drow_oc[o],cval=1) > 0.1
             targetrow_od[o,0] = trow_o[o] - np.argmax(isbkgcont_orc[o,trow_o[o]::-1,cols/2] > 0)
             targetrow_od[o,1] = trow_o[o] + np.argmax(isbkgcont_orc[o,trow_o[o]:,cols/2] > 0)
 
@@ -644,7 +640,156 @@ def specpolsignalmap(hdu,logfile=sys.stdout,debug=False):
             pyfits.PrimaryHDU(badbinnew_orc.astype('uint8')).writeto(sciname+"_badbinnew_orc.fits",clobber=True) 
             pyfits.PrimaryHDU(isbkgcont_orc.astype('uint8')).writeto(sciname+"_isbkgcont_orc.fits",clobber=True)           
         return psf_orc,skyflat_orc,badbinnew_orc,isbkgcont_orc,maprow_od,drow_oc
-                        
+
+#---------------------------------------------------------------------------------------
+signalmapnames = ('psf_orc','skyflat_orc','badbinnew_orc','isbkgcont_orc','maprow_od','drow_oc')
+
+def signalmapkey(hdu):
+    """sha1 hash of everything specpolsignalmap depends on: the image, its header keys, 
+    the data files, and the code"""
+    sha = hashlib.sha1()
+    for ext in ('SCI','VAR','BPM'):
+        ar = np.ascontiguousarray(hdu[ext].data)
+        sha.update(str(ar.dtype)+str(ar.shape))
+        sha.update(ar.tostring())
+    sha.update(np.ascontiguousarray(getwavmap(hdu)).tostring())
+    for key in ('CCDSUM','MASKID'): sha.update(str(hdu[0].header[key]))
+    codefilelist = [os.path.splitext(file)[0]+'.py' for file in  \
+        (__file__,inspect.getfile(ghostkernel),inspect.getfile(blksmooth2d),inspect.getfile(colshift))]
+    for file in [datadir+"wollaston.txt",datadir+"uvesskylines.txt"]+codefilelist:
+        sha.update(open(file,'rb').read())
+    return sha.hexdigest()
+
+def specpolsignalmap_cached(hdu,logfile=sys.stdout,debug=False,cachefile=None,quicklook=0,quickcheck=False):
+    """specpolsignalmap, with its outputs kept in cachefile (.npz) and reused while the 
+    co-added image, data files and code are unchanged
+
+    Parameters
+    ----------
+    hdu: fits.HDUList
+       co-added image, as for specpolsignalmap
+
+    cachefile: str
+       None (default): no cache, same as specpolsignalmap
+
+    quicklook: int
+       > 1: specpolsignalmap_quicklook with quicklook columns per block (experimental).  
+       0 (default): full resolution
+
+    quickcheck: bool
+       with quicklook, also log its fidelity against the full resolution map.  The check is made
+       when the map is computed, not when it is reused from cachefile
+
+    """
+    if quicklook > 1:
+        signalmapfn = lambda hdu: specpolsignalmap_quicklook(hdu,quicklook,logfile=logfile,debug=debug, \
+            fidelity=quickcheck)
+    else:
+        signalmapfn = lambda hdu: specpolsignalmap(hdu,logfile=logfile,debug=debug)
+    if cachefile is None: return signalmapfn(hdu)
+
+    key = signalmapkey(hdu)+('_q'+str(quicklook) if quicklook > 1 else '')
+    if os.path.isfile(cachefile):
+        npz = np.load(cachefile)
+        if str(npz['key']) == key:
+            signalmap = tuple(npz[name] for name in signalmapnames)
+            npz.close()
+            with logging(logfile, debug) as log:
+                log.message('Signal map reused from '+os.path.basename(cachefile), with_header=False)
+            return signalmap
+        npz.close()
+
+    signalmap = signalmapfn(hdu)
+    np.savez_compressed(cachefile,key=key,**dict(zip(signalmapnames,signalmap)))
+    return signalmap
+
+#---------------------------------------------------------------------------------------
+def specpolsignalmap_quicklook(hdu,cblk=8,logfile=sys.stdout,debug=False,fidelity=False):
+    """Approximate specpolsignalmap, for quick-look reductions: the signal map is found on the
+    image averaged over blocks of cblk columns, and the maps are interpolated back to full resolution.
+    Experimental: the speed gain and fidelity have not yet been measured on real data, which 
+    fidelity=True is for
+
+    Parameters
+    ----------
+    hdu: fits.HDUList
+       image, as for specpolsignalmap
+
+    cblk: int
+       columns per block.  The last block takes the remaining columns
+
+    fidelity: bool
+       also do the full resolution specpolsignalmap and log how the quick-look maps differ from it
+       (and the time saved).  The quick-look maps are returned
+
+    Returns: as specpolsignalmap
+
+    """
+    starttime = time.time()
+    sci_orc = hdu['SCI'].data
+    rows,cols = sci_orc.shape[1:3]
+    cbin,rbin = np.array(hdu[0].header["CCDSUM"].split(" ")).astype(int)
+
+    # _C: column block.  Mean of the good bins, bad if none; wavelength only if good throughout
+    col_C = np.arange(0,cols,cblk)
+    cols_C = np.diff(np.append(col_C,cols))
+    okbin_orc = ~(hdu['BPM'].data > 0)
+    wav_orc = getwavmap(hdu)
+    count_orC = np.add.reduceat(okbin_orc.astype(int),col_C,axis=2)
+    sci_orC = np.add.reduceat(sci_orc*okbin_orc,col_C,axis=2)
+    var_orC = np.add.reduceat(hdu['VAR'].data*okbin_orc,col_C,axis=2)
+    sci_orC[count_orC>0] /= count_orC[count_orC>0]
+    var_orC[count_orC>0] /= count_orC[count_orC>0]**2
+    okwav_orC = (np.add.reduceat((wav_orc > 0.).astype(int),col_C,axis=2) == cols_C)
+    wav_orC = (np.add.reduceat(wav_orc.astype(float),col_C,axis=2)/cols_C)*okwav_orC
+
+    hduql = pyfits.HDUList(pyfits.PrimaryHDU(header=hdu[0].header.copy()))
+    hduql[0].header["CCDSUM"] = str(cbin*cblk)+" "+str(rbin)
+    header = hdu['SCI'].header.copy()
+    hduql.append(pyfits.ImageHDU(data=sci_orC, header=header, name='SCI'))
+    hduql.append(pyfits.ImageHDU(data=var_orC, header=header, name='VAR'))
+    hduql.append(pyfits.ImageHDU(data=(count_orC==0).astype('uint8'), header=header, name='BPM'))
+    hduql.append(pyfits.ImageHDU(data=wav_orC.astype('float32'), header=header, name='WAV'))
+
+    psf_orC,skyflat_orC,badbinnew_orC,isbkgcont_orC,maprow_od,drow_oC = \
+        specpolsignalmap(hduql,logfile=logfile,debug=debug)
+
+    # back to full resolution: maps linear between block centers, masks by block
+    x_C = col_C + (cols_C-1)/2.
+    x_c = np.clip(np.arange(cols),x_C[0],x_C[-1])
+    C_c = np.arange(cols)/cblk
+    psf_orc = interprows(x_C,psf_orC.reshape((-1,col_C.shape[0])),x_c).reshape((2,rows,cols))
+    skyflat_orc = interprows(x_C,skyflat_orC.reshape((-1,col_C.shape[0])),x_c).reshape((2,rows,cols))
+    drow_oc = interprows(x_C,drow_oC,x_c)
+    badbinnew_orc = badbinnew_orC[:,:,C_c]
+    isbkgcont_orc = isbkgcont_orC[:,:,C_c]
+    psf_orc *= (~badbinnew_orc).astype(int)
+    quicktime = time.time() - starttime
+
+    if fidelity:
+        starttime = time.time()
+        psffull_orc,skyflatfull_orc,badbinnewfull_orc,isbkgcontfull_orc,maprowfull_od,drowfull_oc = \
+            specpolsignalmap(hdu,logfile=logfile,debug=debug)
+        fulltime = time.time() - starttime
+        ok_orc = ~(badbinnew_orc | badbinnewfull_orc)
+        ispsf_orc = ok_orc & (psffull_orc > 0.)
+        dpsf_orc = (psf_orc - psffull_orc)[ispsf_orc]/max(psffull_orc.max(),1.e-30)
+        dskyflat_orc = (skyflat_orc - skyflatfull_orc)[ok_orc]
+        rmsmax = lambda d: (np.sqrt((d**2).mean()),np.abs(d).max()) if d.size else (np.nan,np.nan)
+        with logging(logfile, debug) as log:
+            log.message('Quick-look signal map, %2i column blocks: %6.1f sec, full %6.1f sec (%4.1f x)' \
+                % (cblk,quicktime,fulltime,fulltime/max(quicktime,1.e-3)), with_header=False)
+            log.message('  psf       rms, max diff (of peak) %8.4f %8.4f' % rmsmax(dpsf_orc), with_header=False)
+            log.message('  skyflat   rms, max diff           %8.4f %8.4f' % rmsmax(dskyflat_orc), with_header=False)
+            log.message('  badbin, bkgcont bins differing    %8.4f %8.4f' \
+                % ((badbinnew_orc != badbinnewfull_orc).mean(),(isbkgcont_orc != isbkgcontfull_orc).mean()), \
+                with_header=False)
+            log.message('  maprow, drow max diff (rows)      %8.2f %8.2f' \
+                % (np.abs(maprow_od - maprowfull_od).max(),np.abs(drow_oc - drowfull_oc).max()), \
+                with_header=False)
+
+    return psf_orc,skyflat_orc,badbinnew_orc,isbkgcont_orc,maprow_od,drow_oc
+
 #---------------------------------------------------------------------------------------
 if __name__=='__main__':
     infilelist=sys.argv[1:]
@@ -0,0 +1,78 @@
+"""
+specpolstray
+
+Stray light search for specpolsignalmap: seeing-sized features in the spatial and spectral profile
+(second order, Littrow ghost, neighbor spectra), as whole-array filters
+
+ghostkernel(fwhm)
+maskedmedian(ar_yc,ok_yc)
+littrowmap(ghost_Yc,isbadghost_Yc,kernel,kernelbkg,boxbins)
+
+"""
+
+import numpy as np
+from scipy.ndimage import convolve1d
+
+# ---------------------------------------------------------------------------------
+def ghostkernel(fwhm):
+    """ghost search kernel, size of 3*fwhm and summing to zero, and its (unit) background kernel
+
+    Returns: kernel, kernelbkg: numpy 1D arrays
+
+    """
+    kernelcenter = np.ones(int(np.around(fwhm/2)*2+2))
+    kernelbkg = np.ones(kernelcenter.shape[0]+4)
+    kernel = -kernelbkg*kernelcenter.sum()/(kernelbkg.sum()-kernelcenter.sum())
+    kernel[2:-2] = kernelcenter
+    return kernel,kernelbkg
+
+# ---------------------------------------------------------------------------------
+def maskedmedian(ar_yc,ok_yc):
+    """median of the ok bins in each row, as np.median(ar_yc[y,ok_yc[y]]) for each row y, using one sort
+
+    Returns: numpy 1D array (rows), nan for rows with no ok bins, or with a nan in an ok bin
+
+    """
+    rows,cols = ar_yc.shape
+    isnan_yc = ok_yc & np.isnan(ar_yc)
+    count_y = (ok_yc & ~isnan_yc).sum(axis=1)
+    sort_yc = np.sort(np.where(ok_yc,ar_yc,np.nan),axis=1)        # masked bins sort last
+    lo_y = np.maximum((count_y-1)/2,0)
+    hi_y = np.maximum(count_y/2,0)
+    median_y = 0.5*(sort_yc[np.arange(rows),lo_y] + sort_yc[np.arange(rows),hi_y])
+    median_y[count_y % 2 == 1] = sort_yc[np.arange(rows),hi_y][count_y % 2 == 1]
+    median_y[(count_y == 0) | isnan_yc.any(axis=1)] = np.nan
+    return median_y
+
+# ---------------------------------------------------------------------------------
+def littrowmap(ghost_Yc,isbadghost_Yc,kernel,kernelbkg,boxbins):
+    """Littrow ghost search: undispersed object off target
+
+    Convolve with ghost kernel in spectral direction, divide by standard deviation over rows,
+    then add up those > 10 sigma within a boxbins x boxbins box.  The box sum is done on a 2^-20 grid,
+    so it is exact, and tied boxes resolve to the first, independent of the order of summation
+
+    Parameters
+    ----------
+    ghost_Yc: numpy 2D array
+        spatial ghost search map (rows around target, cols)
+    isbadghost_Yc: numpy 2D boolean array
+        bins not to use
+    kernel, kernelbkg: numpy 1D arrays
+        from ghostkernel
+    boxbins: int
+        odd box size
+
+    Returns: litt_Yc: numpy 2D array, box sum of > 10 sigma bins
+
+    """
+    stdghost_c = np.std(ghost_Yc,axis=0)
+    isbadlitt_Yc = isbadghost_Yc | \
+        (convolve1d(isbadghost_Yc.astype(int),kernelbkg,axis=1,mode='constant',cval=1) != 0)
+    litt_Yc = convolve1d(ghost_Yc,kernel,axis=-1,mode='constant',cval=0.)*(~isbadlitt_Yc).astype(int)
+    litt_Yc[:,stdghost_c>0] /= stdghost_c[stdghost_c>0]
+    litt_Yc[litt_Yc < 10.] = 0.
+    q_Yc = np.around(litt_Yc*2.**20).astype(np.int64)
+    for axis in (0,1):
+        q_Yc = convolve1d(q_Yc,np.ones(boxbins,dtype=np.int64),axis=axis,mode='constant',cval=0)
+    return q_Yc/2.**20
@@ -1,33 +1,91 @@
 
 # polarimetry utilities, including:
 
+# loadtxt_cal(filename,**kwargs)
+# readlines_cal(filename)
+# interp1d_cal(filename,xcol,ycols,kind='cubic')
 # datedfile(filename,date)
 # datedline(filename,date)
 # greff(grating,grang,artic,dateobs,wav)
 # rssdtralign(datobs,trkrho)
 # rssmodelwave(grating,grang,artic,trkrho,cbin,cols,datobs)
 # configmap(infilelist,confitemlist,debug='False')
+# obslog(infilelist,log=None)
 # image_number(image_name)
 # list_configurations(infilelist, log)
 # configmapset(obs_tab, config_list=('GRATING','GR-ANGLE', 'CAMANG'))
 # list_configurations_old(infilelist, log)
 # blksmooth1d(ar_x,blk,ok_x)
+# colshift(ar_rc,drow_c,cval=0.)
+# interprows(x_nX,y_nX,x_nx,bounds_error=True,fill_value=np.nan)
+# legvalrows(x_c,legcof_ly)
+# wavcofhdu(legcof_oly,xfit_od,drow_oc,edgerow_od)
+# getwavmap(hdul,r_r=None,c_c=None)
+# configpool(configfn,arglist,nworkers=1,logfile='salt.log')
 # angle_average(ang_d)
 # printstdlog(string,logfile)
 
 import os, sys, glob, shutil, inspect
+from collections import OrderedDict
+from multiprocessing import Pool
 import numpy as np
 from astropy.io import fits as pyfits, ascii
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 from scipy.interpolate import interp1d
-from scipy import interpolate as ip
+from oksmooth import blksmooth
 
-from saltobslog import obslog
 from astropy.table import Table,unique
 
 DATADIR = os.path.dirname(__file__) + '/data/'
 
+# calibration data cache: decoded files and interpolators, keyed by file name, mtime,
+#   and how they were read.  The least recently used entries are dropped beyond CALCACHESIZE
+CALCACHESIZE = 64
+calcache = OrderedDict()
+
+# ------------------------------------
+
+def calcached(filename,key,readfn):
+    """ return readfn() for a calibration file, from the cache if the file is unchanged
+
+    Parameters
+    ----------
+    filename: str
+    key: hashable, distinguishing different reads of the same file
+    readfn: function of no arguments that reads the file
+
+    """
+    cachekey = (os.path.abspath(filename), os.path.getmtime(filename), key)
+    if cachekey in calcache:
+        value = calcache.pop(cachekey)
+    else:
+        value = readfn()
+        while len(calcache) >= CALCACHESIZE: calcache.popitem(last=False)
+    calcache[cachekey] = value
+    return value
+
+def loadtxt_cal(filename,**kwargs):
+    """ np.loadtxt of a calibration file, parsed once.  Returns a copy, safe to modify"""
+    key = ('loadtxt',) + tuple(sorted(kwargs.items()))
+    return np.copy(calcached(filename,key,lambda: np.loadtxt(filename,**kwargs)))
+
+def readlines_cal(filename):
+    """ list of lines of a calibration file, read once"""
+    return list(calcached(filename,('readlines',),lambda: open(filename).readlines()))
+
+def interp1d_cal(filename,xcol,ycols,kind='cubic'):
+    """ interpolator of columns ycols against column xcol of a calibration file, built once.
+    bounds_error=False, so out of range gives nan.  Multiple ycols are along axis 0
+
+    """
+    ycols = tuple(np.atleast_1d(ycols))
+    def readfn():
+        xy_dl = np.loadtxt(filename,dtype=float,unpack=True,usecols=(xcol,)+ycols,ndmin=2)
+        y_dl = xy_dl[1:] if len(ycols)>1 else xy_dl[1]
+        return interp1d(xy_dl[0],y_dl,kind=kind,bounds_error=False)
+    return calcached(filename,('interp1d',xcol,ycols,kind),readfn)
+
 # ------------------------------------
 
 def datedfile(filename,date):
@@ -68,7 +126,7 @@ def datedline(filename,date):
     Returns: string which is selected line from file (including datever label)
 
     """
-    line_l = [ll for ll in open(filename) if ll[8:10] == "_v"]
+    line_l = [ll for ll in readlines_cal(filename) if ll[8:10] == "_v"]
     datever_l = [line_l[l].split()[0] for l in range(len(line_l))]
 
     line = ""
@@ -88,10 +146,9 @@ def greff(grating,grang,artic,dateobs,wav):
 #   p/s added 9 July, 2017 khn
 #   wav may be 1D array
 
-    grname=np.loadtxt(DATADIR+"gratings.txt",dtype=str,usecols=(0,))
-    grlmm,grgam0=np.loadtxt(DATADIR+"gratings.txt",usecols=(1,2),unpack=True)
-    gr300wav,gr300eff,gr300ps=np.loadtxt(DATADIR+"grateff_0300.txt",usecols=(0,1,2),unpack=True)
-    grng,grdn,grthick,grtrans,grbroaden=np.loadtxt(DATADIR+"grateff_v1.txt", \
+    grname=loadtxt_cal(DATADIR+"gratings.txt",dtype=str,usecols=(0,))
+    grlmm,grgam0=loadtxt_cal(DATADIR+"gratings.txt",usecols=(1,2),unpack=True)
+    grng,grdn,grthick,grtrans,grbroaden=loadtxt_cal(DATADIR+"grateff_v1.txt", \
         usecols=(1,2,3,4,5),unpack=True)
     spec_dp=np.array(datedline(DATADIR+"RSSspecalign.txt",dateobs).split()[1:]).astype(float)
 
@@ -103,8 +160,8 @@ def greff(grating,grang,artic,dateobs,wav):
     alpha_r = np.radians(grang+Grat0)
 
     if grnum == 0:          # SR grating
-        eff = interp1d(gr300wav,gr300eff,kind='cubic',bounds_error=False)(wav)
-        ps = interp1d(gr300wav,gr300ps,kind='cubic',bounds_error=False)(wav) 
+        eff = interp1d_cal(DATADIR+"grateff_0300.txt",0,1)(wav)
+        ps = interp1d_cal(DATADIR+"grateff_0300.txt",0,2)(wav) 
     else:                   # Kogelnik gratings
         ng = grng[grnum]
         dn = grdn[grnum]
@@ -142,7 +199,7 @@ def rssdtralign(datobs,trkrho):
     """
 
   # optic axis is center of imaging mask.  In columns, same as longslit position
-    rc0_pd=np.loadtxt(DATADIR+"RSSimgalign.txt",usecols=(1,2))
+    rc0_pd=loadtxt_cal(DATADIR+"RSSimgalign.txt",usecols=(1,2))
     flex_p = np.array([np.sin(np.radians(trkrho)),np.cos(np.radians(trkrho))-1.])
     rcflex_d = (rc0_pd[0:2]*flex_p[:,None]).sum(axis=0)
 
@@ -169,8 +226,8 @@ def rssmodelwave(grating,grang,artic,trkrho,cbin,cols,datobs):
     Grat0,Home0,ArtErr,T2Con,T3Con = spec_dp[:5]
     FCampoly=spec_dp[5:]
 
-    grname=np.loadtxt(DATADIR+"gratings.txt",dtype=str,usecols=(0,))
-    grlmm,grgam0=np.loadtxt(DATADIR+"gratings.txt",usecols=(1,2),unpack=True)
+    grname=loadtxt_cal(DATADIR+"gratings.txt",dtype=str,usecols=(0,))
+    grlmm,grgam0=loadtxt_cal(DATADIR+"gratings.txt",usecols=(1,2),unpack=True)
     grnum = np.where(grname==grating)[0][0]
     lmm = grlmm[grnum]
     alpha_r = np.radians(grang+Grat0)
@@ -246,6 +303,21 @@ def configmap(infilelist,confitemlist,debug='False'):
     return obs_i,config_i,obstab,configtab
 # ------------------------------------
 
+def obslog(infilelist,log=None):
+    """header dictionary of infilelist, as pysalt saltobslog.obslog, but read from the header 
+    index obslog_index.json next to the files, so later stages do not open every file again
+
+    As pysalt saltobslog.obslog, infilelist is sorted in place, and int values of float keywords 
+    are replaced by the default.  The index is shared with specpolrawstokes
+
+    """
+    import saltobslog_kn                    # pyraf, only needed here
+
+    infilelist.sort()
+    indexfile = os.path.join(os.path.dirname(os.path.abspath(infilelist[0])),'obslog_index.json')
+    return saltobslog_kn.obslog(infilelist,log,indexfile=indexfile,intfloat=False)
+# ------------------------------------
+
 def image_number(image_name):
     """Return the number for an image"""
     return int(os.path.basename(image_name).split('.')[0][-4:])
@@ -363,6 +435,228 @@ def configmapset(obs_tab, config_list=('GRATING','GR-ANGLE', 'CAMANG')):
     return list(set(zip(*(obs_tab[x] for x in config_list))))
 # ------------------------------------
 
+def colshift(ar_rc,drow_c,cval=0.):
+    """shift each column along rows by linear interpolation, as scipy.ndimage shift(order=1)
+    column by column, but in one gather for the whole array
+
+    Parameters
+    ----------
+    ar_rc: numpy array (..., rows, cols), or list of them
+        a list shares the interpolation indices: arrays may have different dtypes
+    drow_c: numpy array (..., cols)
+        shift of each column, broadcast over the leading dimensions of ar_rc
+    cval: float
+        value where the shifted column comes from outside the array
+
+    Returns: numpy array or list, shifted arrays with the dtype of the input.
+        Integer arrays are rounded, as shift does
+
+    """
+    arlist = ar_rc if isinstance(ar_rc,list) else [ar_rc,]
+    rows = arlist[0].shape[-2]
+    shape = np.broadcast(arlist[0],np.asarray(drow_c)[...,None,:]).shape
+    y_rc = np.arange(rows)[:,None] - np.asarray(drow_c,dtype=float)[...,None,:]
+    ok_rc = np.broadcast_to((y_rc >= 0) & (y_rc <= rows-1),shape)
+    r0_rc = np.clip(np.floor(y_rc).astype(int),0,rows-1)
+    dy_rc = np.broadcast_to(y_rc - r0_rc,shape)
+    r1_rc = np.broadcast_to(np.minimum(r0_rc+1,rows-1),shape)
+    r0_rc = np.broadcast_to(r0_rc,shape)
+
+    # weights as ndimage computes them: the upper one as 1 minus the lower one, which differs from
+    #   dy in the last bits for dy < 1
+    wt0_rc = 1.-dy_rc
+    wt1_rc = 1.-wt0_rc
+
+    shiftlist = []
+    for ar in arlist:
+        ar = np.broadcast_to(ar,shape)
+        sar_rc = np.where(ok_rc, np.take_along_axis(ar,r0_rc,axis=-2)*wt0_rc +  \
+            np.take_along_axis(ar,r1_rc,axis=-2)*wt1_rc, cval)
+        if np.issubdtype(ar.dtype,np.integer):
+            sar_rc = np.trunc(sar_rc + np.where(sar_rc < 0.,-0.5,0.5))
+        shiftlist.append(sar_rc.astype(ar.dtype))
+
+    return shiftlist if isinstance(ar_rc,list) else shiftlist[0]
+
+# ------------------------------------
+
+def interprows(x_nX,y_nX,x_nx,bounds_error=True,fill_value=np.nan):
+    """linear interpolation of many rows, each with its own abscissae, as
+    interp1d(x_nX[n],y_nX[n],bounds_error=bounds_error,fill_value=fill_value)(x_nx[n]) for each row n,
+    without building an interpolator for each row.  interp1d evaluates with np.interp, which is used 
+    directly: one call for all rows if the abscissae are common, else one per row (a linear merge of 
+    the sorted points and abscissae, faster than any searchsorted of all rows at once)
+
+    Parameters
+    ----------
+    x_nX: numpy array (rows,X) or (X)
+        abscissae of each row, or common to all rows.  Rows not increasing are sorted
+    y_nX: numpy array (rows,X) or (X)
+        values at x_nX
+    x_nx: numpy array (rows,x) or (x)
+        points to evaluate
+    bounds_error, fill_value:
+        as interp1d, for points outside the abscissae of their row
+
+    Returns: numpy array (rows,x)
+
+    """
+    x_nX,y_nX,x_nx = [np.atleast_2d(ar).astype(float) for ar in (x_nX,y_nX,x_nx)]
+    rows = max(x_nX.shape[0],y_nX.shape[0],x_nx.shape[0])
+    X,x = x_nX.shape[1],x_nx.shape[1]
+    x_nx = np.broadcast_to(x_nx,(rows,x))
+    if (x_nX[:,1:] < x_nX[:,:-1]).any():
+        X_nX = np.argsort(x_nX,axis=1,kind='mergesort')
+        x_nX = np.take_along_axis(x_nX,X_nX,axis=1)
+        y_nX = np.take_along_axis(np.broadcast_to(y_nX,X_nX.shape),X_nX,axis=1)
+
+    if (x_nX.shape[0] == 1) & (y_nX.shape[0] == 1):
+        y_nx = np.interp(x_nx,x_nX[0],y_nX[0])
+    else:
+        x_nX,y_nX = np.broadcast_to(x_nX,(rows,X)),np.broadcast_to(y_nX,(rows,X))
+        y_nx = np.empty((rows,x))
+        for n in range(rows): y_nx[n] = np.interp(x_nx[n],x_nX[n],y_nX[n])
+
+    out_nx = (x_nx < x_nX[:,:1]) | (x_nx > x_nX[:,-1:])
+    if out_nx.any():
+        if bounds_error:
+            raise ValueError("A value in x_new is out of the interpolation range.")
+        y_nx[out_nx] = fill_value
+    return y_nx
+
+# ------------------------------------
+
+def legvalrows(x_c,legcof_ly):
+    """evaluate a Legendre series for each row at the same points, as
+    np.polynomial.legendre.legval(x_c,legcof_ly), using one Vandermonde matrix product
+
+    Parameters
+    ----------
+    x_c: numpy array (cols)
+        points, common to all rows
+    legcof_ly: numpy array (order+1,rows)
+        coefficients for each row
+
+    Returns: numpy array (rows,cols)
+
+    """
+    leg_cl = np.polynomial.legendre.legvander(x_c,legcof_ly.shape[0]-1)
+    return np.dot(leg_cl,legcof_ly).T
+
+# ------------------------------------
+
+def wavcofhdu(legcof_oly,xfit_od,drow_oc,edgerow_od):
+    """compact WAVCOF table extension for an O,E wavelength map, in place of the WAV image
+
+    Parameters
+    ----------
+    legcof_oly: numpy array (2,order+1,rows/2)
+        Legendre coefficients of each straightened row
+    xfit_od: numpy array (2,2)
+        column zero and scale of the Legendre argument: xfit_c = (c - x0)/xscale
+    drow_oc: numpy array (2,cols)
+        row curvature put back by colshift.  nan for columns with no wavelength
+    edgerow_od: numpy array (2,2)
+        bottom, top straightened row of slit
+
+    Returns: fits.BinTableHDU, one row per beam
+
+    """
+    ls,ys = legcof_oly.shape[1:]
+    cols = drow_oc.shape[1]
+    collist = [pyfits.Column(name='LEGCOF',format=str(ls*ys)+'D',dim='('+str(ys)+','+str(ls)+')',  \
+                    array=legcof_oly),
+               pyfits.Column(name='XFIT',format='2D',array=xfit_od),
+               pyfits.Column(name='DROW',format=str(cols)+'D',array=drow_oc),
+               pyfits.Column(name='EDGEROW',format='2D',array=edgerow_od)]
+    return pyfits.BinTableHDU.from_columns(collist,name='WAVCOF')
+
+# ------------------------------------
+
+def getwavmap(hdul,r_r=None,c_c=None):
+    """wavelength map of a 'w' file, from its WAV image or evaluated from its WAVCOF table
+
+    Parameters
+    ----------
+    hdul: fits.HDUList
+        split O,E data with WAV or WAVCOF extension
+    r_r, c_c: slice or int array, optional
+        rows, columns to evaluate (default all)
+
+    Returns: numpy float32 array (2,rows,cols), 0 outside slit and wavelength range
+
+    """
+    r_r = slice(None) if r_r is None else r_r
+    c_c = slice(None) if c_c is None else c_c
+    if 'WAV' in [hdu.name for hdu in hdul]:
+        return hdul['WAV'].data[:,r_r][:,:,c_c]
+
+    wavcof = hdul['WAVCOF'].data
+    legcof_oly = wavcof['LEGCOF']
+    rows,cols = legcof_oly.shape[2],wavcof['DROW'].shape[1]
+    r_R,c_C = np.arange(rows)[r_r],np.arange(cols)[c_c]
+    wav_oRC = np.zeros((2,r_R.shape[0],c_C.shape[0]),dtype='float32')
+    for o in (0,1):
+        xfit_C = (c_C - wavcof['XFIT'][o,0])/wavcof['XFIT'][o,1]
+        wav_yC = legvalrows(xfit_C,legcof_oly[o])
+        wav_yC[(wav_yC < 3000.) | (wav_yC > 10000.)] = 0
+        notwav_C = np.isnan(wavcof['DROW'][o,c_C])
+        drow_C = np.where(notwav_C,0.,wavcof['DROW'][o,c_C])
+        wav_oRC[o] = colshift(wav_yC,drow_C).astype('float32')[r_R]
+        edgerow_d = wavcof['EDGEROW'][o]
+        wav_oRC[o][(r_R[:,None] < edgerow_d[0] + drow_C) | (r_R[:,None] > edgerow_d[1] + drow_C)] = 0.
+        wav_oRC[o][:,notwav_C] = 0.
+    return wav_oRC
+
+# ------------------------------------
+
+def configpool(configfn,arglist,nworkers=1,logfile='salt.log'):
+    """run configfn(*args,logfile=logfile) for each configuration, optionally over a process pool
+
+    Configurations share no data, so they may run in any order.  With a pool, each 
+    configuration logs to its own logfile.c<n>, appended to logfile in configuration order 
+    afterwards, so the log is grouped by configuration as in the serial run.  Output file names 
+    must depend only on args (e.g. the _c<n> configuration index), never on run order.
+
+    Parameters
+    ----------
+    configfn: function
+        module level function doing one configuration, with a logfile keyword
+    arglist: list
+        argument tuple for each configuration
+    nworkers: int
+        number of processes.  1 (default): serial, in this process
+
+    Returns: list of configfn results, in arglist order
+
+    """
+    configs = len(arglist)
+    if (nworkers < 2) | (configs < 2):
+        return [configfn(*args,logfile=logfile) for args in arglist]
+
+    logfilelist = [logfile+'.c'+str(c) for c in range(configs)]
+    pool = Pool(min(nworkers,configs))
+    try:
+        resultlist = pool.map(configworker,    \
+            [(configfn,arglist[c],logfilelist[c]) for c in range(configs)],chunksize=1)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        with open(logfile,'a') as logout:
+            for clogfile in logfilelist:
+                if not os.path.exists(clogfile): continue
+                logout.write(open(clogfile).read())
+                os.remove(clogfile)
+    return resultlist
+
+def configworker(fnargs):
+    # one configuration in a configpool process
+    configfn,args,logfile = fnargs
+    return configfn(*args,logfile=logfile)
+
+# ------------------------------------
+
 def list_configurations_old(infilelist, log):
     """For data observed prior 2015
 
@@ -432,24 +726,9 @@ def list_configurations_old(infilelist, log):
 #--------------------------------------
 
 def blksmooth1d(ar_x,blk,ok_x):
-# blkaverage, then spline interpolate result
-
-    blks = ar_x.shape[0]/blk
-    offset = (ar_x.shape[0] - blks*blk)/2
-    ar_X = ar_x[offset:offset+blks*blk]                  # cut to integral blocks
-    ok_X = ok_x[offset:offset+blks*blk]    
-    ar_by = ar_X.reshape(blks,blk)
-    ok_by = ok_X.reshape(blks,blk)
-
-    okcount_b = (ok_by.sum(axis=1) > blk/2)
-    ar_b = np.zeros(blks)
-    for b in np.where(okcount_b)[0]: ar_b[b] = ar_by[b][ok_by[b]].mean()
-    gridblk = np.arange(offset+blk/2,offset+blks*blk+blk/2,blk)
-    grid = np.arange(ar_x.shape[0])
-    arsm_x = ip.griddata(gridblk[okcount_b], ar_b[okcount_b], grid, method="cubic", fill_value=0.)
-    oksm_x = (arsm_x != 0.)
-
-    return arsm_x,oksm_x
+# blkaverage, then spline interpolate result.  See oksmooth.blksmooth
+
+    return blksmooth(ar_x,ok_x,blk,0.5)
 # ----------------------------------------------------------
 
 def angle_average(ang_d):
@@ -18,7 +18,6 @@ from scipy import linalg as la
 from pyraf import iraf
 from iraf import pysalt
 
-from saltobslog import obslog
 
 import specrectify as sr
 from specwavemap import wavemap
@@ -34,7 +33,8 @@ datadir = os.path.dirname(__file__) + '/data/'
 debug = False
 
 def specpolwavmap(infilelist, linelistlib="", automethod='Matchlines', 
-                  function='legendre', order=3, debug=False, logfile='salt.log'):
+                  function='legendre', order=3, crmemlimit=1000., wavimage=False, confworkers=1,
+                  debug=False, logfile='salt.log'):
     obsdate=os.path.basename(infilelist[0])[7:15]
 
     with logging(logfile, debug) as log:
@@ -42,174 +42,268 @@ def specpolwavmap(infilelist, linelistlib="", automethod='Matchlines',
         log.message('specpolwavmap version: 20180804', with_header=False)         
         # group the files together
         config_dict = list_configurations(infilelist, log)
-        usesaltlinelist = (len(linelistlib)>0)
-        
-        for config in config_dict:
-            if len(config_dict[config]['arc']) == 0:
-                log.message('No Arc for this configuration:', with_header=False)
-                continue
-            isdualarc = len(config_dict[config]['arc']) > 1
-
-            iarc = config_dict[config]['arc'][0]
-            hduarc = pyfits.open(iarc)
-            image_id = str(image_number(iarc))
-            rows, cols = hduarc[1].data.shape
-            grating = hduarc[0].header['GRATING'].strip()
-            grang = hduarc[0].header['GR-ANGLE']
-            artic = hduarc[0].header['CAMANG']
-            filter = hduarc[0].header['FILTER'].strip()
-            lamp=hduarc[0].header['LAMPID'].strip().replace(' ', '')
-            if lamp == 'NONE': lamp='CuAr'
-            cbin, rbin = [int(x) for x in hduarc[0].header['CCDSUM'].split(" ")]
-
-            if isdualarc:
-                iarc2 = config_dict[config]['arc'][1]
-                hduarc2 = pyfits.open(iarc2)
-                ratio21 = np.percentile(hduarc2[1].data,99.9)/np.percentile(hduarc[1].data,99.9) 
-                image_id = image_id+'_'+str(image_number(iarc2))
-                hduarc[1].data += hduarc2[1].data/ratio21
-                lamp2=hduarc2[0].header['LAMPID'].strip().replace(' ', '')
-                log.message(('\nDual Arcs: '+lamp+' + '+lamp2+'/ %8.4f' % ratio21), with_header=False)
-
-            # need this for the distortion correction 
-            rpix_oc = read_wollaston(hduarc, wollaston_file=datadir+"wollaston.txt")
-
-            #split the arc into the two beams
-            hduarc, splitrow = specpolsplit(hduarc, splitrow=None, wollaston_file=datadir+"wollaston.txt")
-            rows = 2*hduarc['SCI'].data.shape[1]    # allow for odd number of input rows
-
-            if usesaltlinelist:                # if linelistlib specified, use salt-supplied
+
+        # configurations may be done in parallel (confworkers > 1) only if no arc needs interactive 
+        #   line identification
+        if confworkers > 1:
+            for config in config_dict:
+                arclist = config_dict[config]['arc']
+                if len(arclist) == 0: continue
+                image_id = '_'.join([str(image_number(arc)) for arc in arclist[:2]])
+                if not all([os.path.exists("arcdb_"+image_id+"_"+str(o)+".txt") for o in (0,1)]):
+                    log.message('Arc '+image_id+' not yet identified: configurations done serially', \
+                        with_header=False)
+                    confworkers = 1
+                    break
+
+    configpool(wavmap_config, [(config_dict[config], linelistlib, automethod, function, order, \
+        crmemlimit, wavimage, debug) for config in config_dict], nworkers=confworkers, logfile=logfile)
+
+    return
+
+def wavmap_config(filedict, linelistlib, automethod, function, order, crmemlimit, wavimage, 
+                  debug=False, logfile='salt.log'):
+    """ wavelength map, CR cull, and write 'w' files for one configuration
+
+    Parameters 
+    ----------
+    filedict: dict
+       'arc' and 'object' file lists for the configuration, from list_configurations
+
+    The rest are as for specpolwavmap
+
+    """
+    usesaltlinelist = (len(linelistlib)>0)
+
+    with logging(logfile, debug) as log:
+        if len(filedict['arc']) == 0:
+            log.message('No Arc for this configuration:', with_header=False)
+            return
+        isdualarc = len(filedict['arc']) > 1
+
+        iarc = filedict['arc'][0]
+        hduarc = pyfits.open(iarc)
+        image_id = str(image_number(iarc))
+        rows, cols = hduarc[1].data.shape
+        grating = hduarc[0].header['GRATING'].strip()
+        grang = hduarc[0].header['GR-ANGLE']
+        artic = hduarc[0].header['CAMANG']
+        filter = hduarc[0].header['FILTER'].strip()
+        lamp=hduarc[0].header['LAMPID'].strip().replace(' ', '')
+        if lamp == 'NONE': lamp='CuAr'
+        cbin, rbin = [int(x) for x in hduarc[0].header['CCDSUM'].split(" ")]
+
+        if isdualarc:
+            iarc2 = filedict['arc'][1]
+            hduarc2 = pyfits.open(iarc2)
+            ratio21 = np.percentile(hduarc2[1].data,99.9)/np.percentile(hduarc[1].data,99.9) 
+            image_id = image_id+'_'+str(image_number(iarc2))
+            hduarc[1].data += hduarc2[1].data/ratio21
+            lamp2=hduarc2[0].header['LAMPID'].strip().replace(' ', '')
+            log.message(('\nDual Arcs: '+lamp+' + '+lamp2+'/ %8.4f' % ratio21), with_header=False)
+
+        # need this for the distortion correction 
+        rpix_oc = read_wollaston(hduarc, wollaston_file=datadir+"wollaston.txt")
+
+        #split the arc into the two beams
+        hduarc, splitrow = specpolsplit(hduarc, splitrow=None, wollaston_file=datadir+"wollaston.txt")
+        rows = 2*hduarc['SCI'].data.shape[1]    # allow for odd number of input rows
+
+        if usesaltlinelist:                # if linelistlib specified, use salt-supplied
+            with open(linelistlib) as fd:
+                linelistdict = dict(line.strip().split(None, 1) for line in fd)
+            lampfile=iraf.osfn("pysalt$data/linelists/"+linelistdict[lamp])
+            if isdualarc: lamp2file=iraf.osfn("pysalt$data/linelists/"+linelistdict[lamp2])
+        else:                               # else, use line lists in polarimetry area for 300l
+            if grating=="PG0300": 
+                linelistlib=datadir+"linelistlib_300.txt"
+                lib_lf = list(np.loadtxt(linelistlib,dtype=str,usecols=(0,1,2)))    # lamp,filter,file
+                linelistdict = defaultdict(dict)
+                for ll in range(len(lib_lf)):
+                    linelistdict[lib_lf[ll][0]][int(lib_lf[ll][1])] = lib_lf[ll][2] 
+                filter_l = np.sort(np.array(linelistdict[lamp].keys()))
+                usefilter = filter_l[np.where(int(filter[-5:-1]) < filter_l)[0][0]]
+                lampfile = datadir+linelistdict[lamp][usefilter]
+                if isdualarc: lamp2file = datadir+linelistdict[lamp2][usefilter]
+            else:
+                linelistlib=datadir+"linelistlib.txt"
                 with open(linelistlib) as fd:
-                    linelistdict = dict(line.strip().split(None, 1) for line in fd)
+                    linelistdict = dict(line.strip().split(None, 1) for line in fd)   
                 lampfile=iraf.osfn("pysalt$data/linelists/"+linelistdict[lamp])
-                if isdualarc: lamp2file=iraf.osfn("pysalt$data/linelists/"+linelistdict[lamp2])
-            else:                               # else, use line lists in polarimetry area for 300l
-                if grating=="PG0300": 
-                    linelistlib=datadir+"linelistlib_300.txt"
-                    lib_lf = list(np.loadtxt(linelistlib,dtype=str,usecols=(0,1,2)))    # lamp,filter,file
-                    linelistdict = defaultdict(dict)
-                    for ll in range(len(lib_lf)):
-                        linelistdict[lib_lf[ll][0]][int(lib_lf[ll][1])] = lib_lf[ll][2] 
-                    filter_l = np.sort(np.array(linelistdict[lamp].keys()))
-                    usefilter = filter_l[np.where(int(filter[-5:-1]) < filter_l)[0][0]]
-                    lampfile = datadir+linelistdict[lamp][usefilter]
-                    if isdualarc: lamp2file = datadir+linelistdict[lamp2][usefilter]
-                else:
-                    linelistlib=datadir+"linelistlib.txt"
-                    with open(linelistlib) as fd:
-                        linelistdict = dict(line.strip().split(None, 1) for line in fd)   
-                    lampfile=iraf.osfn("pysalt$data/linelists/"+linelistdict[lamp])
-                    if isdualarc: lamp2file=iraf.osfn("pysalt$data/linelists/"+linelistdict[lamp2])  
-            if isdualarc:
-                lamp_dl = np.loadtxt(lampfile,usecols=(0,1),unpack=True)
-                lamp2_dl = np.loadtxt(lamp2file,usecols=(0,1),unpack=True)
-                duallamp_dl = np.sort(np.hstack((lamp_dl,lamp2_dl)))
-                np.savetxt('duallamp.txt',duallamp_dl.T,fmt='%10.3f %8i')
-                lampfile = 'duallamp.txt'
-                lamp = lamp+','+lamp2
-
-            # some housekeeping for bad keywords
-            if hduarc[0].header['MASKTYP'].strip() == 'MOS':   # for now, MOS treated as single, short 1 arcsec longslit
-                hduarc[0].header['MASKTYP'] = 'LONGSLIT'
-                hduarc[0].header['MASKID'] = 'P001000P99'
-            del hduarc['VAR']
-            del hduarc['BPM']
-    
-            # log the information about the arc
-            log.message('\nARC: image '+image_id+' GRATING '+grating\
-                        +' GRANG '+("%8.3f" % grang)+' ARTIC '+("%8.3f" % artic)+' LAMP '+lamp, with_header=False)
-            log.message('  Split Row: '+("%4i " % splitrow), with_header=False)
-
-            # set up the correction for the beam splitter
-            drow_oc = (rpix_oc-rpix_oc[:,cols/2][:,None])/rbin
-
-            wavmap_orc = pol_wave_map(hduarc, image_id, drow_oc, rows, cols,
-                                      lampfile=lampfile, function=function, order=order,
-                                      automethod=automethod, log=log, logfile=logfile)
-
-          # if image not already cleaned,
-          # use upper outlier quartile fence of 3 column subarray across normalized configuration 
-          #     or 10-sigma spike to cull cosmic rays.  Normalize by rows
-            images = len(config_dict[config]['object'])
-            historylist = list(pyfits.open(config_dict[config]['object'][0])[0].header['HISTORY'])
-            cleanhistory = next((x for x in historylist if x[:7]=="CRCLEAN"),"None")
-            iscr_irc = np.zeros((images,rows,cols),dtype='bool')
-
-            if cleanhistory == 'CRCLEAN: None':
-                historyidx = historylist.index(cleanhistory)
-                upperfence = 4.0
-                lowerfence = 1.5
-                sigmaveto = 2.0
-                sci_irc = np.zeros((images,rows,cols))
-                var_irc = np.zeros((images,rows,cols))
-
-                for (i,image) in enumerate(config_dict[config]['object']):
-                    hdulist = pyfits.open(image)
-                    okbin_rc = (hdulist['BPM'].data[:rows,:] == 0)
-                    sci_irc[i][okbin_rc] = hdulist['SCI'].data[:rows,:][okbin_rc]
-                    var_irc[i][okbin_rc] = hdulist['VAR'].data[:rows,:][okbin_rc]
-                    okrow_r = okbin_rc.any(axis=1)
-                    for r in np.where(okrow_r)[0]:
-                        rowmean = sci_irc[i,r][okbin_rc[r]].mean()
-                        sci_irc[i,r] /= rowmean
-                        var_irc[i,r] /= rowmean**2
-                    
-                sci_ijrc = np.zeros((images,3,rows,cols))
-                for j in range(3):
-                    sci_ijrc[:,j,:,1:-1] = sci_irc[:,:,j:cols+j-2]
-                sci_Irc = sci_ijrc.reshape((-1,rows,cols))
-                sci_Irc.sort(axis=0)
-                firstmthird_rc = sci_Irc[-1] - sci_Irc[-3] 
-                q1_rc,q3_rc = np.percentile(sci_Irc,(25,75),axis=0,overwrite_input=True)
-                dq31_rc = q3_rc - q1_rc
-                okq_rc = (dq31_rc > 0.)
-                oksig_rc = (var_irc.sum(axis=0) > 0.)
-                sigma_rc = np.zeros_like(q1_rc)
-                sigma_rc[oksig_rc] = np.sqrt(var_irc.sum(axis=0)[oksig_rc]/((var_irc > 0).sum(axis=0)[oksig_rc]))
-                dq31_rc = np.maximum(dq31_rc,1.35*sigma_rc)                     # avoid impossibly low dq from fluctuations
-
-                iscr1_irc = np.zeros((images,rows,cols),dtype=bool)  
-                iscr2_irc = np.zeros((images,rows,cols),dtype=bool)  
-                iscr1_irc[:,okq_rc] = (sci_irc[:,okq_rc] > (q3_rc + upperfence*dq31_rc)[okq_rc])    # above upper outlier fence
-                iscr2_irc[:,okbin_rc] = ((sci_irc[:,okbin_rc]==sci_irc[:,okbin_rc].max(axis=0)) &   \
-                    (firstmthird_rc[okbin_rc] > 10*sigma_rc[okbin_rc]))                 # or a 10-sigma spike          
-                iscr_irc = (iscr1_irc | iscr2_irc)
-                notcr3_irc =(iscr_irc & (iscr_irc.sum(axis=0)>2))                      # but >2 CR's in one place are bogus
-                notcr4_irc =(iscr_irc & (firstmthird_rc < sigmaveto*dq31_rc))          # seeing/guiding errors, not CR 
-                iscr_irc &= (np.logical_not(notcr3_irc | notcr4_irc))
-
-                isnearcr_irc = np.zeros((images,rows+2,cols+2),dtype=bool)
-                for dr,dc in np.ndindex(3,3):                                       # lower fence on neighbors
-                    isnearcr_irc[:,dr:rows+dr,dc:cols+dc] |= iscr_irc
-                isnearcr_irc = isnearcr_irc[:,1:-1,1:-1]
-                iscr_irc[isnearcr_irc] |= (okq_rc & (sci_irc > (q3_rc + lowerfence*dq31_rc)))[isnearcr_irc]   
-
-                log.message('CR culling with upper quartile fence\n', with_header=False)
-
-            elif cleanhistory == 'None':
-                log.message('CR clean history unknown, none applied (suggest rerunning imred)',with_header=False)
-            else:
-                log.message('CR cleaning already done: '+cleanhistory,with_header=False)
-
-            # for images using this arc,save split data along third fits axis, 
-            # add wavmap extension, save as 'w' file
+                if isdualarc: lamp2file=iraf.osfn("pysalt$data/linelists/"+linelistdict[lamp2])  
+        if isdualarc:
+            lamp_dl = np.loadtxt(lampfile,usecols=(0,1),unpack=True)
+            lamp2_dl = np.loadtxt(lamp2file,usecols=(0,1),unpack=True)
+            duallamp_dl = np.sort(np.hstack((lamp_dl,lamp2_dl)))
+            lampfile = 'duallamp_'+image_id+'.txt'
+            np.savetxt(lampfile,duallamp_dl.T,fmt='%10.3f %8i')
+            lamp = lamp+','+lamp2
+
+        # some housekeeping for bad keywords
+        if hduarc[0].header['MASKTYP'].strip() == 'MOS':   # for now, MOS treated as single, short 1 arcsec longslit
+            hduarc[0].header['MASKTYP'] = 'LONGSLIT'
+            hduarc[0].header['MASKID'] = 'P001000P99'
+        del hduarc['VAR']
+        del hduarc['BPM']
+
+        # log the information about the arc
+        log.message('\nARC: image '+image_id+' GRATING '+grating\
+                    +' GRANG '+("%8.3f" % grang)+' ARTIC '+("%8.3f" % artic)+' LAMP '+lamp, with_header=False)
+        log.message('  Split Row: '+("%4i " % splitrow), with_header=False)
+
+        # set up the correction for the beam splitter
+        drow_oc = (rpix_oc-rpix_oc[:,cols/2][:,None])/rbin
+
+        wavmap_orc, hduwavcof = pol_wave_map(hduarc, image_id, drow_oc, rows, cols,
+                                  lampfile=lampfile, function=function, order=order,
+                                  automethod=automethod, log=log, logfile=logfile)
+
+      # if image not already cleaned,
+      # use upper outlier quartile fence of 3 column subarray across normalized configuration 
+      #     or 10-sigma spike to cull cosmic rays.  Normalize by rows
+        images = len(filedict['object'])
+        historylist = list(pyfits.open(filedict['object'][0])[0].header['HISTORY'])
+        cleanhistory = next((x for x in historylist if x[:7]=="CRCLEAN"),"None")
+        iscr_irc = np.zeros((images,rows,cols),dtype='bool')
+
+        if cleanhistory == 'CRCLEAN: None':
+            historyidx = historylist.index(cleanhistory)
+            upperfence = 4.0
+            lowerfence = 1.5
+            sigmaveto = 2.0
+            iscr_irc = crcull(filedict['object'],rows,upperfence,lowerfence,sigmaveto,   \
+                memlimit=crmemlimit)
+
+            log.message('CR culling with upper quartile fence\n', with_header=False)
+
+        elif cleanhistory == 'None':
+            log.message('CR clean history unknown, none applied (suggest rerunning imred)',with_header=False)
+        else:
+            log.message('CR cleaning already done: '+cleanhistory,with_header=False)
+
+        # for images using this arc,save split data along third fits axis, 
+        # add wavmap extension (compact WAVCOF table, unless wavimage), save as 'w' file
+        if wavimage:
             hduwav = pyfits.ImageHDU(data=wavmap_orc.astype('float32'), header=hduarc['SCI'].header, name='WAV') 
-              
-            for (i,image) in enumerate(config_dict[config]['object']):
-                hdu = pyfits.open(image)
-                if cleanhistory == 'CRCLEAN: None':                
-                    hdu['BPM'].data[:rows,:][iscr_irc[i]] = 1
-                    hdu[0].header['HISTORY'][historyidx] = \
-                        ('CRCLEAN: upper= %3.1f, lower= %3.1f, sigmaveto= %3.1f' % (upperfence,lowerfence,sigmaveto))
-                hdu, splitrow = specpolsplit(hdu, splitrow=splitrow)
-                hdu['BPM'].data[:rows,:][wavmap_orc==0.] = 1 
-                hdu.append(hduwav)
-                for f in ('SCI','VAR','BPM','WAV'): hdu[f].header['CTYPE3'] = 'O,E'
-                hdu.writeto('w'+image,overwrite='True')
-                log.message('Output file '+'w'+image+'  crs: '+str(iscr_irc[i].sum()), with_header=False)
+        else:
+            hduwav = hduwavcof
+          
+        for (i,image) in enumerate(filedict['object']):
+            hdu = pyfits.open(image)
+            if cleanhistory == 'CRCLEAN: None':                
+                hdu['BPM'].data[:rows,:][iscr_irc[i]] = 1
+                hdu[0].header['HISTORY'][historyidx] = \
+                    ('CRCLEAN: upper= %3.1f, lower= %3.1f, sigmaveto= %3.1f' % (upperfence,lowerfence,sigmaveto))
+            hdu, splitrow = specpolsplit(hdu, splitrow=splitrow)
+            hdu['BPM'].data[:rows,:][wavmap_orc==0.] = 1 
+            hdu.append(hduwav)
+            for f in ('SCI','VAR','BPM'): hdu[f].header['CTYPE3'] = 'O,E'
+            if wavimage: hdu['WAV'].header['CTYPE3'] = 'O,E'
+            hdu.writeto('w'+image,overwrite='True')
+            log.message('Output file '+'w'+image+'  crs: '+str(iscr_irc[i].sum()), with_header=False)
 
     return
 
+def crcull(imagelist,rows,upperfence,lowerfence,sigmaveto,memlimit=1000.):
+    """ cull cosmic rays across the images of one configuration
+
+    Use upper outlier quartile fence of 3 column subarray across the row-normalized images, 
+    or 10-sigma spike, with a lower fence on neighbors.  Images are read in blocks of rows
+    in float32, with a one row halo for the neighbors, so the working arrays are bounded.
+
+    Parameters 
+    ----------
+    imagelist: list
+       Object image file names for the configuration
+
+    rows: int
+       Number of rows to use
+
+    upperfence, lowerfence: float
+       Quartile fences, in units of the interquartile range, for a CR and its neighbors
+
+    sigmaveto: float
+       Veto CR if first minus third highest is less than this times interquartile range
+
+    memlimit: float
+       Approximate limit of working memory (MB)
+
+    Returns
+    -------
+    iscr_irc: numpy.ndarray
+       Boolean (images,rows,cols), True for cosmic rays
+
+    """
+
+    images = len(imagelist)
+    hdulist_i = [pyfits.open(image, memmap=False) for image in imagelist]
+    cols = hdulist_i[0]['SCI'].header['NAXIS1']
+    rblk = max(1, int(memlimit*2.**20/(32*images*cols)) - 2)       # ~32 bytes per image pixel
+    Is = 3*images
+    qidx_q = np.array([.25,.75])*(Is-1)
+    qlo_q,qhi_q = np.floor(qidx_q).astype(int),np.ceil(qidx_q).astype(int)
+    kth_k = np.unique(np.concatenate((qlo_q,qhi_q,[max(Is-3,0),Is-1])))
+    iscr_irc = np.zeros((images,rows,cols),dtype='bool')
+
+    for r0 in range(0,rows,rblk):
+        r1 = min(rows,r0+rblk)
+        R0,R1 = max(0,r0-1),min(rows,r1+1)
+        Rows = R1-R0
+        sci_irc = np.zeros((images,Rows,cols),dtype='float32')
+        var_irc = np.zeros((images,Rows,cols),dtype='float32')
+        okbin_irc = np.zeros((images,Rows,cols),dtype='bool')
+        for (i,hdulist) in enumerate(hdulist_i):
+            okbin_irc[i] = (hdulist['BPM'].section[R0:R1,:] == 0)
+            sci_irc[i][okbin_irc[i]] = hdulist['SCI'].section[R0:R1,:][okbin_irc[i]]
+            var_irc[i][okbin_irc[i]] = hdulist['VAR'].section[R0:R1,:][okbin_irc[i]]
+        count_ir = okbin_irc.sum(axis=2)
+        okrow_ir = (count_ir > 0)
+        rowmean_ir = np.ones((images,Rows))
+        rowmean_ir[okrow_ir] = sci_irc.sum(axis=2,dtype='float64')[okrow_ir]/count_ir[okrow_ir]
+        sci_irc /= rowmean_ir[:,:,None]
+        var_irc /= (rowmean_ir**2)[:,:,None]
+        okbin_rc = okbin_irc[-1]                                        # as before, last image bpm
+        del okbin_irc
+
+        sci_Irc = np.zeros((Is,Rows,cols),dtype='float32')
+        for j in range(3):
+            sci_Irc[j::3,:,1:-1] = sci_irc[:,:,j:cols+j-2]
+        sci_Irc.partition(kth_k,axis=0)
+        firstmthird_rc = sci_Irc[-1] - sci_Irc[max(Is-3,0)]
+        q1_rc,q3_rc = [sci_Irc[qlo_q[q]]*(1.-(qidx_q[q]-qlo_q[q])) + sci_Irc[qhi_q[q]]*(qidx_q[q]-qlo_q[q])   \
+                        for q in (0,1)]
+        del sci_Irc
+        dq31_rc = q3_rc - q1_rc
+        okq_rc = (dq31_rc > 0.)
+        varsum_rc = var_irc.sum(axis=0,dtype='float64')
+        oksig_rc = (varsum_rc > 0.)
+        sigma_rc = np.zeros_like(dq31_rc)
+        sigma_rc[oksig_rc] = np.sqrt(varsum_rc[oksig_rc]/((var_irc > 0).sum(axis=0)[oksig_rc]))
+        dq31_rc = np.maximum(dq31_rc,1.35*sigma_rc)                     # avoid impossibly low dq from fluctuations
+        del var_irc
+
+        iscr1_irc = np.zeros((images,Rows,cols),dtype=bool)  
+        iscr2_irc = np.zeros((images,Rows,cols),dtype=bool)  
+        iscr1_irc[:,okq_rc] = (sci_irc[:,okq_rc] > (q3_rc + upperfence*dq31_rc)[okq_rc])    # above upper outlier fence
+        iscr2_irc[:,okbin_rc] = ((sci_irc[:,okbin_rc]==sci_irc[:,okbin_rc].max(axis=0)) &   \
+            (firstmthird_rc[okbin_rc] > 10*sigma_rc[okbin_rc]))                 # or a 10-sigma spike          
+        isblkcr_irc = (iscr1_irc | iscr2_irc)
+        del iscr1_irc, iscr2_irc
+        notcr3_irc =(isblkcr_irc & (isblkcr_irc.sum(axis=0)>2))                # but >2 CR's in one place are bogus
+        notcr4_irc =(isblkcr_irc & (firstmthird_rc < sigmaveto*dq31_rc))       # seeing/guiding errors, not CR 
+        isblkcr_irc &= (np.logical_not(notcr3_irc | notcr4_irc))
+        del notcr3_irc, notcr4_irc
+
+        isnearcr_irc = np.zeros((images,Rows+2,cols+2),dtype=bool)
+        for dr,dc in np.ndindex(3,3):                                       # lower fence on neighbors
+            isnearcr_irc[:,dr:Rows+dr,dc:cols+dc] |= isblkcr_irc
+        isnearcr_irc = isnearcr_irc[:,1:-1,1:-1]
+        isblkcr_irc[isnearcr_irc] |= (okq_rc & (sci_irc > (q3_rc + lowerfence*dq31_rc)))[isnearcr_irc]   
+        iscr_irc[:,r0:r1] = isblkcr_irc[:,(r0-R0):(r1-R0)]
+
+    for hdulist in hdulist_i: hdulist.close()
+    return iscr_irc
+
 def pol_wave_map(hduarc, image_id, drow_oc, rows, cols, lampfile, 
                  function='legendre', order=3, automethod="Matchlines",
                  log=None, logfile=None):
@@ -253,6 +347,9 @@ def pol_wave_map(hduarc, image_id, drow_oc, rows, cols, lampfile,
     wavmap: numpy.ndarray
        Wave map of wavelengths correspond to pixels
 
+    hduwavcof: fits.BinTableHDU
+       WAVCOF table: the same map as Legendre coefficients by row, see specpolutils.getwavmap
+
     """
 
     arc_orc =  hduarc[1].data
@@ -269,6 +366,9 @@ def pol_wave_map(hduarc, image_id, drow_oc, rows, cols, lampfile,
     edgerow_od = np.zeros((2,2))
     cofrows_o = np.zeros(2)
     legy_od = np.zeros((2,2))
+    legcof_oly = np.zeros((2,order+1,rows/2))
+    xfit_od = np.zeros((2,2))
+    drowwav_oc = np.copy(drow_oc)
 
     lam_X = rssmodelwave(grating,grang,artic,trkrho,cbin,cols,date)
 #    np.savetxt("lam_X_"+image_id+".txt",lam_X,fmt="%8.3f")
@@ -326,7 +426,7 @@ def pol_wave_map(hduarc, image_id, drow_oc, rows, cols, lampfile,
                 inter=True, clobber=True, logfile=logfile, verbose=True)
             if (not debug): os.remove(arcimage)
                 
-        wavmap_yc, cofrows_o[o], legy_od[o], edgerow_od[o] = \
+        wavmap_yc, cofrows_o[o], legy_od[o], edgerow_od[o], legcof_oly[o], xfit_od[o] = \
                 wave_map(dbfilename, edgerow_od[o], rows, cols, ystart, order, log=log)
         #TODO: Once rest is working, try to switch to pysalt wavemap
         #soldict = sr.entersolution(dbfilename)
@@ -357,7 +457,7 @@ def pol_wave_map(hduarc, image_id, drow_oc, rows, cols, lampfile,
         log.message('  Bottom, top row:  O %4i %4i   E %4i %4i \n' \
             % tuple(edgerow_od.flatten()), with_header=False)
 
-    return wavmap_orc
+    return wavmap_orc, wavcofhdu(legcof_oly,xfit_od,drowwav_oc,edgerow_od)
 
  
 def wave_map(dbfilename, edgerow_d, rows, cols, ystart, order=3, log=None):
@@ -385,6 +485,12 @@ def wave_map(dbfilename, edgerow_d, rows, cols, ystart, order=3, log=None):
     wavmap_yc: numpy.ndarray
         Map with wavelength for each pixel position
 
+    cofrows, legy_d, edgerow_d: 
+        Number and range of database rows used, slit edge rows
+
+    legcof_ly, xfit_d: numpy.ndarray
+        Legendre coefficients for each row, and (zero, scale) of their column argument
+
     """
     # process dbfile legendre coefs within FOV into wavmap (_Y = line in dbfile)
     legy_Y = np.loadtxt(dbfilename,dtype=float,usecols=(0,),ndmin=1)
@@ -400,6 +506,7 @@ def wave_map(dbfilename, edgerow_d, rows, cols, ystart, order=3, log=None):
         xcenter = domain_c.mean()
         legcof_lY = dblegcof_lY
         xfit_c = 2.*(np.arange(cols) - xcenter)/(domain_c[1]-domain_c[0])   
+        xfit_d = xcenter,(domain_c[1]-domain_c[0])/2.
     else:
       # convert to centered legendre coefficients to remove crosscoupling
         xcenter = cols/2.
@@ -412,6 +519,7 @@ def wave_map(dbfilename, edgerow_d, rows, cols, ystart, order=3, log=None):
         legcof_lY[1] = 1.5*legcof_lY[3] + (dblegcof_lY[1]-1.5*dblegcof_lY[3]) + \
             3.*dblegcof_lY[2]*xcenter + 7.5*dblegcof_lY[3]*xcenter**2
         xfit_c = np.arange(-cols/2,cols/2)
+        xfit_d = -xfit_c[0],1.
 
     # remove rows outside slit
     argYbad = np.where((legy_Y<edgerow_d[0]) | (legy_Y>edgerow_d[1]))[0]
@@ -440,7 +548,7 @@ def wave_map(dbfilename, edgerow_d, rows, cols, ystart, order=3, log=None):
         log.message('TOO FEW USABLE DATABASE ROWS, USE CONSTANT, CENTER ROW' , with_header=False)
         Yuse = np.argmin(np.abs(ystart - legy_Y))                    
         legcof_l = legcof_lY[:,Yuse].ravel()
-        wavmap_yc = np.tile(np.polynomial.legendre.legval(xfit_c,legcof_l)[:,None],rows/2).T
+        legcof_ly = np.tile(legcof_l[:,None],rows/2)
         edgerow_d = 0,rows/2
         cofrows = 1
         legy_d = ystart,ystart
@@ -452,13 +560,10 @@ def wave_map(dbfilename, edgerow_d, rows, cols, ystart, order=3, log=None):
         polycofs = la.lstsq(aa,legcof_lY[0])[0]
         legcof_ly = np.zeros((order+1,rows/2))
         legcof_ly[0] = np.polyval(polycofs,Y_y)
-        for l in range(1,order+1):
-            polycofs = la.lstsq(aa[:,1:],legcof_lY[l])[0]
-            legcof_ly[l] = np.polyval(polycofs,Y_y)
-        wavmap_yc = np.zeros((rows/2,cols))
-        for y in range(rows/2):
-            wavmap_yc[y] = np.polynomial.legendre.legval(xfit_c,legcof_ly[:,y])
+        polycofs_pl = la.lstsq(aa[:,1:],legcof_lY[1:].T)[0]                # all higher orders at once
+        legcof_ly[1:] = np.dot(np.vstack((Y_y,np.ones(rows/2))).T,polycofs_pl).T
         legy_d = legy_Y.min(),legy_Y.max()
+    wavmap_yc = legvalrows(xfit_c,legcof_ly)
     wavmap_yc[(wavmap_yc < 3000.) | (wavmap_yc > 10000.)] = 0
 
-    return wavmap_yc, cofrows, legy_d, edgerow_d
+    return wavmap_yc, cofrows, legy_d, edgerow_d, legcof_ly, xfit_d
@@ -7,11 +7,7 @@ Split O and E beams
 """
 
 
-import numpy as np
-from scipy.interpolate import interp1d
-from scipy.ndimage.interpolation import shift
-
-from specpolutils import rssmodelwave
+from specpolutils import rssmodelwave, interp1d_cal, colshift
 
 
 
@@ -45,10 +41,8 @@ def read_wollaston(hdu, wollaston_file):
 
 
     #load data from wollaston file
-    lam_m = np.loadtxt(wollaston_file,dtype=float,usecols=(0,))
-    rpix_om = np.loadtxt(wollaston_file,dtype=float,unpack=True,usecols=(1,2))
     lam_c = rssmodelwave(grating,grang,artic,trkrho,cbin,cols,date)
-    return interp1d(lam_m,rpix_om,kind='cubic',bounds_error=False)(lam_c)
+    return interp1d_cal(wollaston_file,0,(1,2))(lam_c)
 
 
 def specpolwollaston(hdu, wollaston_file=None):
@@ -103,8 +97,4 @@ def correct_wollaston(data, drow_shift):
     
     """
     
-    rows,cols = data.shape
-    sdata = np.zeros(data.shape, dtype='float32')
-    for c in range(cols):
-        shift(data[:,c], drow_shift[c], sdata[:,c], order=1)
-    return sdata
+    return colshift(data.astype(float), drow_shift).astype('float32')
@@ -0,0 +1,106 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Check that reducestages.runstage redoes only the stale groups, with toy stage functions
+that write one product per input file
+"""
+
+import os
+import pytest
+
+pytest.importorskip('saltsafelog')
+
+from ..reducestages import runstage, imagegroups
+
+
+def write(filename, text):
+    with open(filename, 'w') as f:
+        f.write(text)
+
+
+class ToyStage(object):
+    """Stage fn writing p<name> for each input <name>, recording the input list of each call"""
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.calllist = []
+
+    def outnames(self, infilelist):
+        return [os.path.join(self.dirname, 'p' + os.path.basename(f)) for f in infilelist]
+
+    def __call__(self, infilelist, scale=1, logfile=None):
+        self.calllist.append([os.path.basename(f) for f in infilelist])
+        for infile, outfile in zip(infilelist, self.outnames(infilelist)):
+            write(outfile, str(scale) + ' ' + open(infile).read())
+
+
+@pytest.fixture
+def stagedir(tmpdir):
+    for name in ('a', 'b', 'c'):
+        write(str(tmpdir.join(name + '.txt')), name)
+    return tmpdir
+
+
+def infiles(stagedir):
+    return sorted(str(f) for f in stagedir.listdir('[abcd].txt'))
+
+
+@pytest.mark.parametrize('usenames', [True, False])
+def test_runstage(stagedir, usenames):
+    manifestfile = str(stagedir.join('manifest.json'))
+    logfile = str(stagedir.join('salt.log'))
+    stage = ToyStage(str(stagedir))
+
+    def run(params={'scale': 1}):
+        if usenames:
+            kwargs = dict(outnames=stage.outnames)
+        else:
+            kwargs = dict(outglob=str(stagedir.join('p*.txt')))
+        stage.calllist = []
+        outfilelist = runstage(manifestfile, 'toy', stage, imagegroups(infiles(stagedir)),
+                               params=params, runargs={'logfile': logfile}, logfile=logfile, **kwargs)
+        return outfilelist, stage.calllist
+
+    def called(namelist):
+        if usenames:
+            return [namelist] if len(namelist) else []
+        return [[name] for name in namelist]
+
+    outfilelist, calllist = run()
+    assert calllist == called(['a.txt', 'b.txt', 'c.txt'])
+    assert outfilelist == stage.outnames(infiles(stagedir))
+
+    # unchanged inputs and outputs: nothing to do, same outputs
+    outfilelist, calllist = run()
+    assert calllist == []
+    assert outfilelist == stage.outnames(infiles(stagedir))
+
+    # a new group is done alone
+    write(str(stagedir.join('d.txt')), 'd')
+    outfilelist, calllist = run()
+    assert calllist == called(['d.txt'])
+    assert outfilelist == stage.outnames(infiles(stagedir))
+
+    # a changed input, and a deleted output, redo their groups only
+    write(str(stagedir.join('a.txt')), 'aa')
+    os.remove(str(stagedir.join('pc.txt')))
+    outfilelist, calllist = run()
+    assert calllist == called(['a.txt', 'c.txt'])
+    assert open(str(stagedir.join('pa.txt'))).read() == '1 aa'
+    assert os.path.isfile(str(stagedir.join('pc.txt')))
+
+    # an altered output redoes its group
+    write(str(stagedir.join('pb.txt')), 'altered output')
+    outfilelist, calllist = run()
+    assert calllist == called(['b.txt'])
+
+    # a parameter change redoes all groups
+    outfilelist, calllist = run({'scale': 2})
+    assert calllist == called(['a.txt', 'b.txt', 'c.txt', 'd.txt'])
+    assert open(str(stagedir.join('pd.txt'))).read() == '2 d'
+    outfilelist, calllist = run({'scale': 2})
+    assert calllist == []
+
+    # a removed group is dropped from the outputs returned
+    os.remove(str(stagedir.join('b.txt')))
+    outfilelist, calllist = run({'scale': 2})
+    assert calllist == []
+    assert outfilelist == stage.outnames(infiles(stagedir))
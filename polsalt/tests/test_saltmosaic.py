@@ -0,0 +1,95 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Compare the numpy transform in saltmosaic_kn (geotran=False) with IRAF geotran,
+called as in make_mosaic, on the small tile in data/geotran_tile.fits, and the
+vectorized fill_gaps with the original row by row numpy.interp loop
+"""
+
+import os
+import numpy as np
+import pytest
+from astropy.io import fits
+from scipy import ndimage as nd
+
+pytest.importorskip('pyraf')
+pytest.importorskip('saltsafeio')
+
+from pyraf import iraf
+from ..saltmosaic_kn import geotran_native, fill_gaps
+
+tilefile = os.path.join(os.path.dirname(__file__), 'data', 'geotran_tile.fits')
+
+# binned shift and rotation, as make_mosaic passes them for CCD 1 or 3.  The rotation
+# is larger than RSSgeom's, so that an error in the rotation centre shows in a small tile
+geoparams = [(-1.37, 0.62, 1.0, 1.0), (2.2, -0.9, -0.6, -0.6)]
+
+
+def geotran_iraf(ext, outfile, xshift, yshift, rot, constant):
+    iraf.images.immatch.geotran(tilefile + "[" + ext + "]", outfile, "", "",
+                                xshift=xshift, yshift=yshift,
+                                xrotation=rot, yrotation=rot,
+                                xmag=1, ymag=1, xmin='INDEF', xmax='INDEF',
+                                ymin='INDEF', ymax='INDEF', ncols='INDEF',
+                                nlines='INDEF', verbose='no', fluxconserve='yes',
+                                nxblock=2048, nyblock=2048, interpolant="linear",
+                                boundary="constant", constant=constant)
+    return fits.getdata(outfile).astype(float)
+
+
+@pytest.mark.parametrize(('xshift', 'yshift', 'xrot', 'yrot'), geoparams)
+def test_geotran_native(tmpdir, xshift, yshift, xrot, yrot):
+    tile = fits.open(tilefile)
+    sci_rc, var_rc, bpm_rc = \
+        geotran_native([tile['SCI'].data, tile['VAR'].data, tile['BPM'].data],
+                       xshift, yshift, xrot, yrot, cval_list=[0., 0., 1.])
+
+    scigeo_rc = geotran_iraf('SCI', str(tmpdir.join('sci.fits')), xshift, yshift, xrot, 0)
+    vargeo_rc = geotran_iraf('VAR', str(tmpdir.join('var.fits')), xshift, yshift, xrot, 0)
+    bpmgeo_rc = geotran_iraf('BPM', str(tmpdir.join('bpm.fits')), xshift, yshift, xrot, 1)
+
+    # geotran and the numpy transform may treat the last fraction of a pixel at the
+    # input boundary differently, so the edge rows and columns are left out
+    inner = (slice(3, -3), slice(3, -3))
+    np.testing.assert_allclose(sci_rc[inner], scigeo_rc[inner], rtol=1.e-4, atol=1.e-2)
+    np.testing.assert_allclose(var_rc[inner], vargeo_rc[inner], rtol=1.e-4, atol=1.e-2)
+    np.testing.assert_array_equal((bpm_rc > 0)[inner], (bpmgeo_rc > 0)[inner])
+
+
+def fill_gaps_rowloop(data, mask):
+    """The original fill_gaps, one numpy.interp per row"""
+    ys, xs = data.shape
+    if isinstance(mask, np.ndarray):
+        mask = (mask == 0)
+    else:
+        mask = (data != mask)
+    for i in range(ys):
+        x = np.arange(xs)
+        rdata = data[i, :]
+        rmask = mask[i, :]
+        rmask = nd.minimum_filter(rmask, size=3)
+        if rmask.any() == True:
+            rdata = np.interp(x, x[rmask], rdata[rmask])
+            data[i, rmask == 0] = rdata[rmask == 0]
+    return data
+
+
+@pytest.mark.parametrize('maskarray', [False, True])
+def test_fill_gaps(maskarray):
+    np.random.seed(42)
+    rows, cols = 120, 300
+    data_rc = np.random.normal(1000., 30., (rows, cols)).astype(np.float32)
+    data_rc[:, 95:105] = 0.                                 # ccd gaps
+    data_rc[:, 195:205] = 0.
+    data_rc[:, np.random.randint(0, cols, 8)] = 0.          # bad columns
+    data_rc[np.random.rand(rows, cols) > 0.97] = 0.         # bad pixels
+    data_rc[:6] = 0.                                        # empty rows
+    data_rc[10, :] = 0.                                     # one good pixel, none unflagged
+    data_rc[10, 50] = 1000.
+    data_rc[11, :] = 0.                                     # three good pixels
+    data_rc[11, 50:53] = 1000.
+    data_rc[12:20, :3] = 0.                                 # gaps at the row ends
+    data_rc[12:20, -2:] = 0.
+    mask = (data_rc == 0).astype(int) if maskarray else 0
+
+    np.testing.assert_array_equal(fill_gaps(data_rc.copy(), mask),
+                                  fill_gaps_rowloop(data_rc.copy(), mask))
@@ -0,0 +1,58 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Compare the sparse matrix rebinning of scrunch2d with scrunch1d, row by row
+"""
+
+import os
+import numpy as np
+import pytest
+
+from ..scrunch1d import scrunch1d, scrunchmatrix, scrunchmatrix_cached, scrunch2d, scrunchcache
+
+
+def random_binedges(rows, na, nx):
+    """increasing bin edges for each row, some bins narrower and some wider than the input bins,
+    and some rows starting before or ending beyond the input"""
+    binedge_nx = np.zeros((rows, nx+1))
+    for n in range(rows):
+        width_x = np.random.uniform(0.2, 2.5, nx)*float(na)/nx
+        binedge_nx[n] = np.random.uniform(-0.1*na, 0.1*na) + np.append(0., np.cumsum(width_x))
+    binedge_nx[0, :4] = [0., 0.5, 1.0, 1.25]                # edges on and between input bin edges
+    binedge_nx[1] = np.linspace(-5.5, na + 3.3, nx+1)       # past both ends of the input
+    return binedge_nx
+
+
+@pytest.mark.parametrize(('na', 'nx'), [(60, 60), (80, 37), (40, 97)])
+def test_scrunch2d(na, nx):
+    np.random.seed(na + nx)
+    rows = 25
+    input_na = np.random.normal(100., 20., (rows, na))
+    binedge_nx = random_binedges(rows, na, nx)
+    output_nx = np.array([scrunch1d(input_na[n], binedge_nx[n]) for n in range(rows)])
+
+    np.testing.assert_allclose(scrunch2d(input_na, binedge_nx), output_nx, rtol=1.e-12, atol=1.e-9)
+    scrunch_XA = scrunchmatrix(binedge_nx, na)
+    assert scrunch_XA.shape == (rows*nx, rows*na)
+    np.testing.assert_allclose(scrunch2d(input_na, scrunch_XA=scrunch_XA), output_nx,
+                               rtol=1.e-12, atol=1.e-9)
+
+    # a list of arrays shares the matrix
+    var_na = input_na**2
+    var_nx = np.array([scrunch1d(var_na[n], binedge_nx[n]) for n in range(rows)])
+    outputlist = scrunch2d([input_na, var_na], scrunch_XA=scrunch_XA)
+    np.testing.assert_allclose(outputlist[0], output_nx, rtol=1.e-12, atol=1.e-9)
+    np.testing.assert_allclose(outputlist[1], var_nx, rtol=1.e-12, atol=1.e-9)
+
+
+def test_scrunchmatrix_cached(tmpdir):
+    np.random.seed(5)
+    na, nx = 50, 45
+    binedge_nx = random_binedges(10, na, nx)
+    cachefile = str(tmpdir.join('scrunch.npz'))
+    scrunch_XA = scrunchmatrix(binedge_nx, na)
+    for i in range(2):                                      # make the file, then read it
+        scrunchcache.clear()
+        cached_XA = scrunchmatrix_cached(binedge_nx, na, cachefile)
+        assert os.path.isfile(cachefile)
+        np.testing.assert_array_equal(cached_XA.toarray(), scrunch_XA.toarray())
+    assert scrunchmatrix_cached(binedge_nx, na) is cached_XA
@@ -0,0 +1,38 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Compare the one-sort maskedmedian in specpolstray with np.median of the ok bins, row by row
+"""
+
+import warnings
+import numpy as np
+import pytest
+
+from ..specpolstray import maskedmedian
+
+
+def maskedmedian_loop(ar_yc, ok_yc):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)     # empty rows
+        return np.array([np.median(ar_yc[y, ok_yc[y]]) for y in range(ar_yc.shape[0])])
+
+
+@pytest.mark.parametrize('cols', [1, 2, 7, 40])
+def test_maskedmedian(cols):
+    np.random.seed(cols)
+    rows = 60
+    ar_yc = np.random.normal(0., 10., (rows, cols))
+    ar_yc[:, ::3] = np.round(ar_yc[:, ::3])                 # ties
+    ok_yc = np.random.rand(rows, cols) > 0.3
+    ok_yc[:3] = False                                       # rows with no ok bins
+    ok_yc[3:6] = True
+    ar_yc[6, 0] = np.nan                                    # nan in an ok bin
+    ok_yc[6, 0] = True
+    if cols > 1:
+        ar_yc[7, -1] = np.nan                               # nan in a masked bin
+        ok_yc[7, -1] = False
+        ok_yc[7, 0] = True
+
+    median_y = maskedmedian(ar_yc, ok_yc)
+    np.testing.assert_array_equal(median_y, maskedmedian_loop(ar_yc, ok_yc))
+    assert np.isnan(median_y[:3]).all() & np.isnan(median_y[6])
+    assert (cols == 1) | ~np.isnan(median_y[7])
@@ -0,0 +1,115 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Compare the vectorized array utilities in specpolutils with the column by column
+and row by row code they replaced
+"""
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from scipy.ndimage import shift
+
+from ..specpolutils import colshift, wavcofhdu, getwavmap
+from ..specpolwollaston import correct_wollaston
+
+
+def colshift_loop(ar_rc, drow_c, cval=0.):
+    return np.array([shift(ar_rc[:, c], drow_c[c], order=1, cval=cval)
+                     for c in range(ar_rc.shape[1])]).T
+
+
+@pytest.mark.parametrize('cval', [0., 1.])
+@pytest.mark.parametrize('dtype', [float, np.float32, int, np.uint8])
+def test_colshift(dtype, cval):
+    np.random.seed(1)
+    rows, cols = 60, 24
+    if np.issubdtype(dtype, np.integer):
+        ar_rc = np.random.randint(0, 200, (rows, cols)).astype(dtype)
+    else:
+        ar_rc = (100.*np.random.randn(rows, cols)).astype(dtype)
+    # fractional, negative, integer, zero, beyond the array, and nan (no wavelength) shifts
+    drow_c = np.random.uniform(-8., 8., cols)
+    drow_c[:4] = [0., 3., -5., 0.5]
+    drow_c[4:6] = [rows + 2.5, -rows - 0.1]
+    drow_c[6:8] = np.nan
+
+    np.testing.assert_array_equal(colshift(ar_rc, drow_c, cval=cval),
+                                  colshift_loop(ar_rc, drow_c, cval=cval))
+
+
+def test_colshift_nandata():
+    np.random.seed(2)
+    ar_rc = np.random.randn(40, 10)
+    ar_rc[[3, 20, 39], [1, 4, 9]] = np.nan
+    drow_c = np.random.uniform(-3., 3., 10)
+    np.testing.assert_array_equal(colshift(ar_rc, drow_c), colshift_loop(ar_rc, drow_c))
+
+
+def test_colshift_stacked():
+    np.random.seed(3)
+    ar_orc = np.random.randn(2, 50, 16)
+    drow_oc = np.random.uniform(-6., 6., (2, 16))
+    drow_oc[1, 5] = np.nan
+    shift_orc = np.array([colshift_loop(ar_orc[o], drow_oc[o]) for o in (0, 1)])
+    np.testing.assert_array_equal(colshift(ar_orc, drow_oc), shift_orc)
+
+    # a list of arrays shares the indices; each keeps its dtype
+    bad_orc = np.random.rand(2, 50, 16) > 0.9
+    sci_orc, bad_orc_shift = colshift([ar_orc, bad_orc.astype(int)], drow_oc, cval=1)
+    np.testing.assert_array_equal(sci_orc, np.array(
+        [colshift_loop(ar_orc[o], drow_oc[o], cval=1) for o in (0, 1)]))
+    np.testing.assert_array_equal(bad_orc_shift, np.array(
+        [colshift_loop(bad_orc[o].astype(int), drow_oc[o], cval=1) for o in (0, 1)]))
+    assert bad_orc_shift.dtype == int
+
+
+def wavmap_wollaston(legcof_ly, xfit_d, drow_c, edgerow_d, cols):
+    """The WAV image as specpolwavmap made it: legval, correct_wollaston, and the masks"""
+    xfit_c = (np.arange(cols) - xfit_d[0])/xfit_d[1]
+    wav_yc = np.polynomial.legendre.legval(xfit_c, legcof_ly)
+    wav_yc[(wav_yc < 3000.) | (wav_yc > 10000.)] = 0
+    wav_rc = correct_wollaston(wav_yc, drow_c)
+    y = np.indices(wav_rc.shape)[0]
+    notwav_c = np.isnan(drow_c)
+    drow_c = np.where(notwav_c, 0., drow_c)
+    wav_rc[(y < edgerow_d[0] + drow_c) | (y > edgerow_d[1] + drow_c)] = 0.
+    wav_rc[:, notwav_c] = 0.
+    return wav_rc
+
+
+def test_getwavmap_wavcof(tmpdir):
+    rows, cols = 40, 120
+    y_y = np.arange(rows) - rows/2.
+    legcof_oly = np.zeros((2, 4, rows))
+    for o in (0, 1):
+        # dispersion wide enough that both ends pass out of 3000-10000 Ang
+        legcof_oly[o] = np.vstack((6500. + 3.*y_y + 0.02*y_y**2, 4200. + 0.5*y_y,
+                                   -60. + 0.1*y_y, 8. + 0.*y_y))
+    xfit_od = np.array([[cols/2. - 0.5, cols/2.], [cols/2. + 1.5, cols/2.]])
+    xfit_c = (np.arange(cols) - cols/2.)/(cols/2.)
+    drow_oc = np.vstack((3.*xfit_c**2 - 0.7, -2.5*xfit_c**2 + 0.3*xfit_c))
+    drow_oc[0, :5] = np.nan                                  # columns with no wavelength
+    drow_oc[1, -7:] = np.nan
+    edgerow_od = np.array([[4., 33.], [2., rows - 1.]])
+
+    hdul = fits.HDUList([fits.PrimaryHDU(), wavcofhdu(legcof_oly, xfit_od, drow_oc, edgerow_od)])
+    wfile = str(tmpdir.join('w.fits'))
+    hdul.writeto(wfile)
+    hdul = fits.open(wfile)
+
+    wav_orc = np.array([wavmap_wollaston(legcof_oly[o], xfit_od[o], drow_oc[o], edgerow_od[o], cols)
+                        for o in (0, 1)])
+    assert (wav_orc == 0).any() & (wav_orc > 0).any()
+    wavmap_orc = getwavmap(hdul)
+    assert wavmap_orc.dtype == np.float32
+    np.testing.assert_array_equal(wavmap_orc == 0, wav_orc == 0)
+    np.testing.assert_allclose(wavmap_orc, wav_orc, rtol=1.e-6)
+
+    # subsets of rows and columns, as slices and as index arrays
+    for r_r, c_c in [(slice(3, 30), None), (None, np.array([0, 4, 5, 60, 113, 119])),
+                     (np.array([0, 2, 4, 17, 33, 34, 39]), slice(10, 116))]:
+        wavsub_orc = getwavmap(hdul, r_r=r_r, c_c=c_c)
+        rsub = slice(None) if r_r is None else r_r
+        csub = slice(None) if c_c is None else c_c
+        np.testing.assert_allclose(wavsub_orc, wav_orc[:, rsub][:, :, csub], rtol=1.e-6)
+        np.testing.assert_array_equal(wavsub_orc, wavmap_orc[:, rsub][:, :, csub])
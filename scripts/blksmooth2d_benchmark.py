@@ -0,0 +1,137 @@
+"""
+blksmooth2d_benchmark
+
+Time oksmooth.blksmooth2d (spline on the regular block grid) against the original 
+griddata cubic triangulation, and report the difference between them.
+
+python blksmooth2d_benchmark.py [rows cols [rblk cblk [repeats]]]
+
+Default is a 2x2 binned full-frame spectrum, 1026 x 3170, with two spectral traces and 
+a CCD gap masked out, and 20 x 100 blocks, as in specpolextract background fitting.
+
+"""
+
+import os, sys, time
+
+import numpy as np
+from scipy.interpolate import griddata
+
+polsaltdir = '/'.join(os.path.realpath(__file__).split('/')[:-2])
+datadir = polsaltdir+'/polsalt/data/'
+sys.path.extend((polsaltdir+'/polsalt/',))
+
+from oksmooth import blksmooth2d
+
+# ---------------------------------------------------------------------------------
+def blksmooth2d_griddata(ar_rc,ok_rc,rblk,cblk,blklim,mode="mean",debug=False):
+# the original oksmooth.blksmooth2d, griddata cubic triangulation of the block centroids
+# blkaverage (using mask, with blks with > blklim fraction of the pts), then spline interpolate result
+# optional: median instead of mean
+
+    rows,cols = ar_rc.shape
+    arr_rc = np.zeros_like(ar_rc)
+    arr_rc[ok_rc] = ar_rc[ok_rc]
+    r_rc,c_rc = np.indices((rows,cols)).astype(float)
+    rblks,cblks = int(rows/rblk),int(cols/cblk)
+
+# equalize block scaling to avoid triangularization failure    
+    rfac,cfac = max(rblk,cblk)/rblk, max(rblk,cblk)/cblk     
+    r0,c0 = (rows % rblk)/2,(cols % cblk)/2
+    arr_RCb = arr_rc[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)]    \
+        .reshape(rblks,rblk,cblks,cblk).transpose(0,2,1,3).reshape(rblks,cblks,rblk*cblk)
+    ok_RCb = ok_rc[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)]    \
+        .reshape(rblks,rblk,cblks,cblk).transpose(0,2,1,3).reshape(rblks,cblks,rblk*cblk)
+    r_RCb = rfac*((ok_rc*r_rc)[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)])    \
+        .reshape(rblks,rblk,cblks,cblk).transpose(0,2,1,3).reshape(rblks,cblks,rblk*cblk)
+    c_RCb = cfac*((ok_rc*c_rc)[r0:(r0+rblk*rblks),c0:(c0+cblk*cblks)])    \
+        .reshape(rblks,rblk,cblks,cblk).transpose(0,2,1,3).reshape(rblks,cblks,rblk*cblk)    
+    ok_RC = ok_RCb.sum(axis=-1) > rblk*cblk*blklim
+    arr_RC = np.zeros((rblks,cblks))
+    if mode == "mean":
+        arr_RC[ok_RC] = arr_RCb[ok_RC].sum(axis=-1)/ok_RCb[ok_RC].sum(axis=-1) 
+    elif mode == "median":          
+        arr_RC[ok_RC] = np.median(arr_RCb[ok_RC],axis=-1)
+    else: 
+        print "Illegal mode "+mode+" for smoothing"
+        exit()
+    r_RC = np.zeros_like(arr_RC); c_RC = np.zeros_like(arr_RC)
+    r_RC[ok_RC] = r_RCb[ok_RC].sum(axis=-1)/ok_RCb[ok_RC].sum(axis=-1)
+    c_RC[ok_RC] = c_RCb[ok_RC].sum(axis=-1)/ok_RCb[ok_RC].sum(axis=-1)
+
+# evaluate slopes at edge for edge extrapolation   
+    dar_RC = arr_RC[1:,:] - arr_RC[:-1,:]
+    dac_RC = arr_RC[:,1:] - arr_RC[:,:-1]
+    dr_RC = r_RC[1:,:] - r_RC[:-1,:]
+    dc_RC = c_RC[:,1:] - c_RC[:,:-1]
+
+    dadr_RC = np.zeros_like(dar_RC);    dadc_RC = np.zeros_like(dac_RC)
+    dadr_RC[dr_RC!=0] = rfac*dar_RC[dr_RC!=0]/dr_RC[dr_RC!=0]
+    dadc_RC[dc_RC!=0] = cfac*dac_RC[dc_RC!=0]/dc_RC[dc_RC!=0]
+    argR = np.where(ok_RC.sum(axis=1)>0)[0]
+    argC = np.where(ok_RC.sum(axis=0)>0)[0]    
+    dadr_RC[argR[0],argC]    *= (arr_RC[argR[0,],argC] > 0)
+    dadr_RC[argR[-1]-1,argC] *= (arr_RC[argR[-1],argC] > 0)
+    dadc_RC[argR,argC[0]]    *= (arr_RC[argR,argC[0]] > 0)
+    dadc_RC[argR,argC[-1]-1] *= (arr_RC[argR,argC[-1]] > 0)    
+
+# force outer block positions into a rectangle to avoid edge effects, spline interpolate
+
+    r_RC[argR[[0,-1]][:,None],argC] = rfac*(r0+(rblk-1)/2.+rblk*argR[[0,-1]])[:,None]
+    c_RC[argR[:,None],argC[[0,-1]]] = cfac*(c0+(cblk-1)/2.+cblk*argC[[0,-1]])
+        
+    arr_rc = griddata((r_RC[ok_RC],c_RC[ok_RC]),arr_RC[ok_RC],  \
+        tuple(np.mgrid[:rfac*rows:rfac,:cfac*cols:cfac].astype(float)),method='cubic',fill_value=0.)
+
+# extrapolate to original array size
+    argR_r = ((np.arange(rows) - r0)/rblk).clip(0,rblks-1).astype(int)
+    argC_c = ((np.arange(cols) - c0)/cblk).clip(0,cblks-1).astype(int)
+    r0,r1 = np.where(arr_rc.sum(axis=1)>0)[0][[0,-1]]
+    c0,c1 = np.where(arr_rc.sum(axis=0)>0)[0][[0,-1]]
+
+    arr_rc[r0-rblk/2:r0,c0:c1+1]   += arr_rc[r0,c0:c1+1]   +        \
+                    dadr_RC[argR[0],argC_c[c0:c1+1]]*(np.arange(-int(rblk/2),0)[:,None])
+    arr_rc[r1+1:r1+rblk/2,c0:c1+1] += arr_rc[r1,c0:c1+1]   +        \
+                    dadr_RC[argR[-1]-1,argC_c[c0:c1+1]]*(np.arange(1,rblk/2)[:,None])
+    arr_rc[r0-rblk/2:r1+rblk/2,c0-cblk/2:c0]   += arr_rc[r0-rblk/2:r1+rblk/2,c0][:,None] + \
+                    dadc_RC[argR_r[r0-rblk/2:r1+rblk/2],argC[0]][:,None]*np.arange(-int(cblk/2),0)
+    arr_rc[r0-rblk/2:r1+rblk/2,c1+1:c1+cblk/2] += arr_rc[r0-rblk/2:r1+rblk/2,c1][:,None] + \
+                    dadc_RC[argR_r[r0-rblk/2:r1+rblk/2],argC[-1]-1][:,None]*np.arange(1,cblk/2)
+    
+    return arr_rc
+
+# ---------------------------------------------------------------------------------
+def blksmooth2d_benchmark(rows, cols, rblk, cblk, repeats=3):
+    """Return best wall time (sec) of griddata (_0) and spline (_1) blksmooth2d, and max |difference|/rms of the background"""
+    np.random.seed(42)
+    r_rc,c_rc = np.indices((rows,cols)).astype(float)
+    bkg_rc = 100. + 20.*np.sin(np.pi*c_rc/cols) + 10.*((r_rc - rows/2.)/rows)**2 + 5.*r_rc*c_rc/(rows*cols)
+    ar_rc = bkg_rc + np.random.normal(0.,3.,(rows,cols))
+    ok_rc = np.ones((rows,cols),dtype=bool)
+    for r in (rows/4, 3*rows/4):                            # spectral traces
+        ok_rc[r-rows/40:r+rows/40] = False
+    ok_rc[:,cols/3-cols/100:cols/3+cols/100] = False        # ccd gap
+    ok_rc[:,:cols/50] = False
+    time_f = np.zeros(2)
+    for f,func in enumerate((blksmooth2d_griddata,blksmooth2d)):
+        tlist = []
+        for r in range(repeats):
+            t0 = time.time()
+            result_rc = func(ar_rc,ok_rc,rblk,cblk,0.25,mode="mean")
+            tlist.append(time.time() - t0)
+        time_f[f] = min(tlist)
+        if f==0: ref_rc = result_rc
+    both_rc = (ref_rc != 0.) & (result_rc != 0.)
+    diff = np.abs(result_rc - ref_rc)[both_rc].max()
+    rms = np.sqrt(((ar_rc - bkg_rc)[ok_rc]**2).mean())
+    return time_f, diff/rms
+
+if __name__=='__main__':
+    rows, cols = 1026, 3170
+    rblk, cblk = 20, 100
+    repeats = 3
+    if len(sys.argv) > 2: rows, cols = int(sys.argv[1]), int(sys.argv[2])
+    if len(sys.argv) > 4: rblk, cblk = int(sys.argv[3]), int(sys.argv[4])
+    if len(sys.argv) > 5: repeats = int(sys.argv[5])
+    time_f, diffrms = blksmooth2d_benchmark(rows, cols, rblk, cblk, repeats)
+    print "\n image %i x %i  blocks %i x %i   griddata %8.3f s   spline %8.3f s   speedup %6.1f   max diff/rms %8.4f" % \
+        ((rows,cols,rblk,cblk)+tuple(time_f)+(time_f[0]/time_f[1],diffrms))
@@ -0,0 +1,68 @@
+"""
+fill_gaps_benchmark
+
+Time saltmosaic_kn.fill_gaps against the original row-by-row numpy.interp loop.
+That the output is identical is checked in polsalt/tests/test_saltmosaic.py
+
+python fill_gaps_benchmark.py [rows cols [repeats]]
+
+Default is an unbinned full-frame RSS mosaic, 4102 x 6340, with CCD gaps and random bad columns.
+
+"""
+
+import os, sys, time
+
+import numpy as np
+from scipy import ndimage as nd
+
+polsaltdir = '/'.join(os.path.realpath(__file__).split('/')[:-2])
+datadir = polsaltdir+'/polsalt/data/'
+sys.path.extend((polsaltdir+'/polsalt/',))
+
+from saltmosaic_kn import fill_gaps
+
+def fill_gaps_rowloop(data, mask):
+    """The original fill_gaps, one numpy.interp per row"""
+    ys, xs = data.shape
+    if isinstance(mask, np.ndarray):
+        mask = (mask == 0)
+    else:
+        mask = (data != mask)
+    for i in range(ys):
+        x = np.arange(xs)
+        rdata = data[i, :]
+        rmask = mask[i, :]
+        rmask = nd.minimum_filter(rmask, size=3)
+        if rmask.any() == True:
+            rdata = np.interp(x, x[rmask], rdata[rmask])
+            data[i, rmask == 0] = rdata[rmask == 0]
+    return data
+
+def fill_gaps_benchmark(rows, cols, repeats=3):
+    """Return best wall time (sec) of row loop (_0) and vectorized (_1) fill_gaps"""
+    np.random.seed(42)
+    data_rc = np.random.normal(1000.,30.,(rows,cols)).astype(np.float32)
+    for c in (cols/3, 2*cols/3):                            # ccd gaps
+        data_rc[:,c-cols/60:c+cols/60] = 0.
+    badcols = np.random.randint(0,cols,cols/100)
+    data_rc[:,badcols] = 0.
+    data_rc[:rows/20] = 0.                                  # some empty rows
+    time_f = np.zeros(2)
+    for f,func in enumerate((fill_gaps_rowloop,fill_gaps)):
+        tlist = []
+        for r in range(repeats):
+            datain_rc = data_rc.copy()
+            t0 = time.time()
+            func(datain_rc, 0)
+            tlist.append(time.time() - t0)
+        time_f[f] = min(tlist)
+    return time_f
+
+if __name__=='__main__':
+    rows, cols = 4102, 6340
+    repeats = 3
+    if len(sys.argv) > 2: rows, cols = int(sys.argv[1]), int(sys.argv[2])
+    if len(sys.argv) > 3: repeats = int(sys.argv[3])
+    time_f = fill_gaps_benchmark(rows, cols, repeats)
+    print "\n image %i x %i   row loop %8.3f s   vectorized %8.3f s   speedup %6.1f" % \
+        ((rows,cols)+tuple(time_f)+(time_f[0]/time_f[1],))
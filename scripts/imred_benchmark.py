@@ -0,0 +1,54 @@
+"""
+imred_benchmark
+
+Time imred on the first n raw frames of a night, serially and with a process pool,
+to show the speedup from nworkers against frame count.
+
+python imred_benchmark.py rawdir bpmfile nworkers [frames ...]
+
+Each run is done in a scratch directory bench_<nworkers>_<frames>, removed afterwards.
+
+"""
+
+import os, sys, glob, shutil, time
+
+import numpy as np
+
+polsaltdir = '/'.join(os.path.realpath(__file__).split('/')[:-2])
+datadir = polsaltdir+'/polsalt/data/'
+sys.path.extend((polsaltdir+'/polsalt/',))
+
+from imred import imred
+
+def imred_benchmark(infilelist, bpmfile, nworkers, framelist):
+    """Return wall time (sec) of imred for each frame count, serial (_0) and nworkers (_1)"""
+
+    infilelist = [os.path.abspath(f) for f in infilelist]
+    bpmfile = os.path.abspath(bpmfile)
+    topdir = os.getcwd()
+    time_nw = np.zeros((len(framelist),2))
+    for n,frames in enumerate(framelist):
+        for w,workers in enumerate((1,nworkers)):
+            benchdir = 'bench_'+str(workers)+'_'+str(frames)
+            if os.path.isdir(benchdir): shutil.rmtree(benchdir)
+            os.mkdir(benchdir)
+            os.chdir(benchdir)
+            try:
+                t0 = time.time()
+                imred(infilelist[:frames], './', bpmfile, cleanup=True, nworkers=workers)
+                time_nw[n,w] = time.time() - t0
+            finally:
+                os.chdir(topdir)
+                shutil.rmtree(benchdir)
+    return time_nw
+
+if __name__=='__main__':
+    rawdir, bpmfile, nworkers = sys.argv[1], sys.argv[2], int(sys.argv[3])
+    infilelist = sorted(glob.glob(rawdir+'/P*fits'))
+    if len(sys.argv) > 4: framelist = map(int,sys.argv[4:])
+    else: framelist = [f for f in (1,2,5,10,20,50,100) if f <= len(infilelist)]
+    time_nw = imred_benchmark(infilelist, bpmfile, nworkers, framelist)
+
+    print "\n frames  serial(s)  %2i workers(s)  speedup" % nworkers
+    for n,frames in enumerate(framelist):
+        print " %5i %10.1f %14.1f %9.2f" % ((frames,)+tuple(time_nw[n])+(time_nw[n,0]/time_nw[n,1],))
@@ -14,40 +14,51 @@ from specpolwavmap import specpolwavmap
 from specpolextract_sc import specpolextract_sc
 from specpolrawstokes import specpolrawstokes
 from specpolfinalstokes import specpolfinalstokes
+from reducestages import runstage, imagegroups, configgroups, rawstokesgroups
 
+# python reducepoldata_sc.py obsdate [stage ...]
+#   each stage is redone only for groups whose inputs or parameters changed since the last run,
+#   as recorded in sci/reducepoldata.json.  Stages listed after obsdate are redone in full.
 print sys.argv
 obsdate = sys.argv[1]
+forcelist = sys.argv[2:]
 print obsdate
 os.chdir(obsdate)
 if not os.path.isdir('sci'): os.mkdir('sci')
 shutil.copy(scrdir+'script.py','sci')
 os.chdir('sci')
-
-#basic image reductions
-infilelist = sorted(glob.glob('../raw/P*fits'))
-imred(infilelist, './', datadir+'bpm_rss_11.fits', crthresh=False, cleanup=True)
+manifestfile = 'reducepoldata.json'
 
 #basic polarimetric reductions
 logfile='specpol'+obsdate+'.log'
 
-#wavelength map
-infilelist = sorted(glob.glob('m*fits'))
-linelistlib=""
-specpolwavmap(infilelist, linelistlib=linelistlib, logfile=logfile)
+#basic image reductions, by image
+infilelist = sorted(glob.glob('../raw/P*fits'))
+params = dict(prodir='./', bpmfile=datadir+'bpm_rss_11.fits', crthresh=False, cleanup=True)
+infilelist = runstage(manifestfile, 'imred', imred, imagegroups(infilelist), params=params,    \
+    outnames=lambda flist: ['mxgbp'+os.path.basename(f) for f in flist], force=('imred' in forcelist), logfile=logfile)
+
+#wavelength map, by configuration
+params = dict(linelistlib="")
+infilelist = runstage(manifestfile, 'wavmap', specpolwavmap, configgroups(infilelist, logfile), params=params,  \
+    outnames=lambda flist: ['w'+f for f in flist], runargs=dict(logfile=logfile),   \
+    force=('wavmap' in forcelist), logfile=logfile)
 
-#background subtraction and extraction
-infilelist = sorted(glob.glob('wm*fits'))
+#background subtraction and extraction, by configuration
 extract = 10.   # star +/-5, bkg= +/-(25-35)arcsec:  2nd order is 9-20 arcsec away
 locate = (-120.,120.)    # science target is brightest target in whole slit
 #locate = (-20.,20.)
 
-specpolextract_sc(infilelist,logfile=logfile,locate=locate,extract=extract)
-#specpolextract_sc(infilelist,logfile=logfile,locate=locate,extract=extract,docomp=True,useoldc=True)
+params = dict(locate=locate, extract=extract)
+#params = dict(locate=locate, extract=extract, docomp=True, useoldc=True)
+infilelist = runstage(manifestfile, 'extract', specpolextract_sc, configgroups(infilelist, logfile), params=params,  \
+    outnames=lambda flist: ['ec'+f for f in flist], runargs=dict(logfile=logfile), \
+    force=('extract' in forcelist), logfile=logfile)
 
-#raw stokes
-infilelist = sorted(glob.glob('e*fits'))
-specpolrawstokes(infilelist, logfile=logfile)
+#raw stokes: file names number the configurations over the whole night, so all are redone together
+infilelist = runstage(manifestfile, 'rawstokes', specpolrawstokes, {'all':infilelist}, outglob='*_h*.fits',  \
+    runargs=dict(logfile=logfile), force=('rawstokes' in forcelist), logfile=logfile)
 
-#final stokes
-infilelist = sorted(glob.glob('*_h*.fits'))
-specpolfinalstokes(infilelist, logfile=logfile)
+#final stokes, by raw stokes configuration
+infilelist = runstage(manifestfile, 'finalstokes', specpolfinalstokes, rawstokesgroups(infilelist),   \
+    outglob='*_stokes.fits', runargs=dict(logfile=logfile), force=('finalstokes' in forcelist), logfile=logfile)
@@ -23,7 +23,7 @@ datadir = polsaltdir+'/polsalt/data/'
 sys.path.extend((polsaltdir+'/polsalt/',))
 
 from rssmaptools import ccdcenter
-from specpolutils import datedfile, configmap
+from specpolutils import datedfile, configmap, getwavmap
 
 def specpolcorrect_sc(infileList,**kwargs):
     print '\nspecpolcorrect_sc version: 20191123'
@@ -73,7 +73,7 @@ def specpolcorrect_sc(infileList,**kwargs):
           #   as small as possible to avoid picking up more than one spectrum
             row_o = np.zeros(2,dtype=int)
             row_o[0] = np.argmax(np.median(sci_orc[0,:,(2*cols/5):(3*cols/5)],axis=1)).astype(int)
-            lam_c = hdul['WAV'].data[0,row_o[0]]
+            lam_c = getwavmap(hdul,r_r=row_o[:1])[0,0]
             rpix_oc = interp1d(lam_m,rpix_om,kind='cubic',bounds_error=False)(lam_c)
             raxis_o = (np.array([rows,0]) +   \
                 np.array([-1.,1.])*0.5*(rpix_oc[1,cols/2] - rpix_oc[0,cols/2])/rbin).astype(int)
@@ -187,7 +187,7 @@ def specpolspectrum_sc(infileList,**kwargs):
 
           # find row of O and E spectrum, center ccd only
             hduw = pyfits.open(img[1:])         # compute axis row using wavmap from wm (ok at col center)                                      
-            wave_orc = hduw['WAV'].data           
+            wave_orc = getwavmap(hduw)           
             lam_c = wave_orc[0,rows/2]
             rpix_oc = interp1d(lam_m,rpix_om,kind='cubic',bounds_error=False)(lam_c)
             raxis_o = (np.array([rows,0]) +   \
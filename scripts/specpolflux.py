@@ -25,7 +25,6 @@ sys.path.extend((polsaltdir+'/polsalt/',))
 
 from pyraf import iraf
 from iraf import pysalt
-from saltobslog import obslog
 from saltsafelog import logging
 from scrunch1d import scrunch1d
 from specpolutils import configmap